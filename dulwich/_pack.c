@@ -19,8 +19,20 @@
 
 #include <Python.h>
 #include <stdint.h>
+#ifdef HAVE_ZLIB
+#include <zlib.h>
+#endif
+
+/* Keep these in sync with dulwich/pack.py. */
+#define OFS_DELTA 6
+#define REF_DELTA 7
+#define ZLIB_BUFSIZE 4096
 
 static PyObject *PyExc_ApplyDeltaError = NULL;
+#ifdef HAVE_ZLIB
+static PyObject *PyExc_ZlibError = NULL;
+static PyObject *unpacked_object_cls = NULL;
+#endif
 
 static int py_is_sha(PyObject *sha)
 {
@@ -187,6 +199,380 @@ static PyObject *py_apply_delta(PyObject *self, PyObject *args)
 	return ret_list;
 }
 
+/* Keep in sync with the _DELTA_* constants in pack.py */
+#define DELTA_BLOCK_SIZE 16
+#define DELTA_MIN_PREFIX_LEN 4
+#define DELTA_MAX_BLOCK_OFFSETS 64
+#define DELTA_MAX_COPY_LEN 0xffff
+
+struct delta_index_entry {
+	size_t offset;
+	Py_ssize_t next;
+};
+
+struct delta_index {
+	const uint8_t *buf;
+	size_t buf_len;
+	size_t hash_mask;
+	Py_ssize_t *buckets;
+	struct delta_index_entry *entries;
+};
+
+struct delta_output {
+	uint8_t *buf;
+	size_t len;
+	size_t alloc;
+};
+
+static uint32_t delta_block_hash(const uint8_t *block)
+{
+	/* FNV-1a */
+	uint32_t hash = 2166136261U;
+	int i;
+	for (i = 0; i < DELTA_BLOCK_SIZE; i++) {
+		hash ^= block[i];
+		hash *= 16777619U;
+	}
+	return hash;
+}
+
+static void delta_index_free(struct delta_index *index)
+{
+	PyMem_Free(index->buckets);
+	PyMem_Free(index->entries);
+	index->buckets = NULL;
+	index->entries = NULL;
+}
+
+/* Index the aligned blocks of buf. For identical blocks, only the first
+ * DELTA_MAX_BLOCK_OFFSETS offsets are kept, in ascending order. */
+static int delta_index_init(struct delta_index *index, const uint8_t *buf,
+							size_t buf_len)
+{
+	size_t num_blocks = buf_len / DELTA_BLOCK_SIZE;
+	size_t num_buckets = 16, i;
+	Py_ssize_t num_entries = 0;
+
+	while (num_buckets < num_blocks)
+		num_buckets <<= 1;
+	index->buf = buf;
+	index->buf_len = buf_len;
+	index->hash_mask = num_buckets - 1;
+	index->buckets = PyMem_New(Py_ssize_t, num_buckets);
+	index->entries = PyMem_New(struct delta_index_entry, num_blocks + 1);
+	if (index->buckets == NULL || index->entries == NULL) {
+		delta_index_free(index);
+		PyErr_NoMemory();
+		return -1;
+	}
+	for (i = 0; i < num_buckets; i++)
+		index->buckets[i] = -1;
+
+	for (i = 0; i < num_blocks; i++) {
+		const uint8_t *block = buf + i * DELTA_BLOCK_SIZE;
+		Py_ssize_t *link = &index->buckets[delta_block_hash(block) & index->hash_mask];
+		int same = 0;
+		while (*link != -1) {
+			struct delta_index_entry *entry = &index->entries[*link];
+			if (!memcmp(buf + entry->offset, block, DELTA_BLOCK_SIZE))
+				same++;
+			link = &entry->next;
+		}
+		if (same >= DELTA_MAX_BLOCK_OFFSETS)
+			continue;
+		index->entries[num_entries].offset = i * DELTA_BLOCK_SIZE;
+		index->entries[num_entries].next = -1;
+		*link = num_entries;
+		num_entries++;
+	}
+	return 0;
+}
+
+static int delta_output_reserve(struct delta_output *out, size_t len)
+{
+	uint8_t *buf;
+	size_t alloc = out->alloc;
+	if (out->len + len <= alloc)
+		return 0;
+	while (out->len + len > alloc)
+		alloc = alloc * 2 + 64;
+	buf = PyMem_Realloc(out->buf, alloc);
+	if (buf == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+	out->buf = buf;
+	out->alloc = alloc;
+	return 0;
+}
+
+static int delta_encode_size(struct delta_output *out, size_t size)
+{
+	if (delta_output_reserve(out, 10) < 0)
+		return -1;
+	while (size >= 0x80) {
+		out->buf[out->len++] = (size & 0x7f) | 0x80;
+		size >>= 7;
+	}
+	out->buf[out->len++] = size;
+	return 0;
+}
+
+static int delta_encode_insert(struct delta_output *out, const uint8_t *data,
+							   size_t len)
+{
+	if (delta_output_reserve(out, len + len / 127 + 1) < 0)
+		return -1;
+	while (len > 0) {
+		size_t n = len > 127 ? 127 : len;
+		out->buf[out->len++] = n;
+		memcpy(out->buf + out->len, data, n);
+		out->len += n;
+		data += n;
+		len -= n;
+	}
+	return 0;
+}
+
+static int delta_encode_copy(struct delta_output *out, size_t start,
+							 size_t len)
+{
+	while (len > 0) {
+		size_t n = len > DELTA_MAX_COPY_LEN ? DELTA_MAX_COPY_LEN : len;
+		uint8_t op = 0x80;
+		size_t op_pos;
+		int i;
+		if (delta_output_reserve(out, 7) < 0)
+			return -1;
+		op_pos = out->len++;
+		for (i = 0; i < 4; i++) {
+			if (start & ((size_t)0xff << (i * 8))) {
+				out->buf[out->len++] = (start >> (i * 8)) & 0xff;
+				op |= 1 << i;
+			}
+		}
+		for (i = 0; i < 2; i++) {
+			if (n & ((size_t)0xff << (i * 8))) {
+				out->buf[out->len++] = (n >> (i * 8)) & 0xff;
+				op |= 1 << (4 + i);
+			}
+		}
+		out->buf[op_pos] = op;
+		start += n;
+		len -= n;
+	}
+	return 0;
+}
+
+static int delta_create(struct delta_index *index, struct delta_output *out,
+						const uint8_t *target, size_t target_len)
+{
+	const uint8_t *base = index->buf;
+	size_t base_len = index->buf_len;
+	size_t insert_start = 0, i = 0;
+
+	if (delta_encode_size(out, base_len) < 0 ||
+		delta_encode_size(out, target_len) < 0)
+		return -1;
+
+	/* The block index can not find matches shorter than a block, so check
+	 * for a common prefix separately; this matters for small objects. */
+	while (i < base_len && i < target_len && base[i] == target[i])
+		i++;
+	if (i >= DELTA_MIN_PREFIX_LEN) {
+		if (delta_encode_copy(out, 0, i) < 0)
+			return -1;
+	} else {
+		i = 0;
+	}
+	insert_start = i;
+
+	while (i + DELTA_BLOCK_SIZE <= target_len) {
+		const uint8_t *block = target + i;
+		Py_ssize_t e = index->buckets[delta_block_hash(block) & index->hash_mask];
+		size_t copy_start = 0, copy_len = 0;
+		while (e != -1) {
+			struct delta_index_entry *entry = &index->entries[e];
+			e = entry->next;
+			if (memcmp(base + entry->offset, block, DELTA_BLOCK_SIZE))
+				continue;
+			{
+				size_t max_len = base_len - entry->offset;
+				size_t len = DELTA_BLOCK_SIZE;
+				if (target_len - i < max_len)
+					max_len = target_len - i;
+				while (len < max_len && base[entry->offset + len] == target[i + len])
+					len++;
+				if (len > copy_len) {
+					copy_start = entry->offset;
+					copy_len = len;
+				}
+			}
+		}
+		if (copy_len == 0) {
+			i++;
+			continue;
+		}
+		while (i > insert_start && copy_start > 0 &&
+			   base[copy_start - 1] == target[i - 1]) {
+			i--;
+			copy_start--;
+			copy_len++;
+		}
+		if (delta_encode_insert(out, target + insert_start, i - insert_start) < 0)
+			return -1;
+		i += copy_len;
+		insert_start = i;
+		if (delta_encode_copy(out, copy_start, copy_len) < 0)
+			return -1;
+	}
+	return delta_encode_insert(out, target + insert_start,
+							   target_len - insert_start);
+}
+
+static PyObject *py_create_delta(PyObject *self, PyObject *args)
+{
+	PyObject *py_base_buf, *py_target_buf, *ret;
+	struct delta_index index;
+	struct delta_output out = { NULL, 0, 0 };
+
+	if (!PyArg_ParseTuple(args, "SS", &py_base_buf, &py_target_buf))
+		return NULL;
+
+	if (delta_index_init(&index, (uint8_t *)PyString_AS_STRING(py_base_buf),
+						 PyString_GET_SIZE(py_base_buf)) < 0)
+		return NULL;
+
+	if (delta_create(&index, &out,
+					 (uint8_t *)PyString_AS_STRING(py_target_buf),
+					 PyString_GET_SIZE(py_target_buf)) < 0) {
+		delta_index_free(&index);
+		PyMem_Free(out.buf);
+		return NULL;
+	}
+	delta_index_free(&index);
+
+	ret = PyString_FromStringAndSize((char *)out.buf, out.len);
+	PyMem_Free(out.buf);
+	return ret;
+}
+
+typedef struct {
+	PyObject_HEAD
+	PyObject *base_buf;
+	struct delta_index index;
+} DeltaIndexObject;
+
+static PyObject *py_delta_index_new(PyTypeObject *type, PyObject *args,
+									PyObject *kwargs)
+{
+	PyObject *py_base_buf;
+	DeltaIndexObject *self;
+
+	if (!PyArg_ParseTuple(args, "S", &py_base_buf))
+		return NULL;
+
+	self = (DeltaIndexObject *)type->tp_alloc(type, 0);
+	if (self == NULL)
+		return NULL;
+
+	if (delta_index_init(&self->index,
+						 (uint8_t *)PyString_AS_STRING(py_base_buf),
+						 PyString_GET_SIZE(py_base_buf)) < 0) {
+		Py_DECREF(self);
+		return NULL;
+	}
+	Py_INCREF(py_base_buf);
+	self->base_buf = py_base_buf;
+	return (PyObject *)self;
+}
+
+static void py_delta_index_dealloc(DeltaIndexObject *self)
+{
+	delta_index_free(&self->index);
+	Py_XDECREF(self->base_buf);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *py_delta_index_create_delta(DeltaIndexObject *self,
+											 PyObject *args)
+{
+	PyObject *py_target_buf, *ret;
+	struct delta_output out = { NULL, 0, 0 };
+
+	if (!PyArg_ParseTuple(args, "S", &py_target_buf))
+		return NULL;
+
+	if (delta_create(&self->index, &out,
+					 (uint8_t *)PyString_AS_STRING(py_target_buf),
+					 PyString_GET_SIZE(py_target_buf)) < 0) {
+		PyMem_Free(out.buf);
+		return NULL;
+	}
+
+	ret = PyString_FromStringAndSize((char *)out.buf, out.len);
+	PyMem_Free(out.buf);
+	return ret;
+}
+
+static PyObject *py_delta_index_sizeof(DeltaIndexObject *self)
+{
+	size_t size = sizeof(DeltaIndexObject);
+	size += (self->index.hash_mask + 1) * sizeof(Py_ssize_t);
+	size += (self->index.buf_len / DELTA_BLOCK_SIZE + 1) *
+		sizeof(struct delta_index_entry);
+	size += PyString_GET_SIZE(self->base_buf);
+	return PyInt_FromSsize_t(size);
+}
+
+static PyMethodDef py_delta_index_methods[] = {
+	{ "create_delta", (PyCFunction)py_delta_index_create_delta, METH_VARARGS,
+		"Create a delta from the indexed base to a target buffer." },
+	{ "__sizeof__", (PyCFunction)py_delta_index_sizeof, METH_NOARGS, NULL },
+	{ NULL, NULL, 0, NULL }
+};
+
+static PyTypeObject DeltaIndexType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"dulwich._pack.DeltaIndex",	/* tp_name */
+	sizeof(DeltaIndexObject),	/* tp_basicsize */
+	0,							/* tp_itemsize */
+	(destructor)py_delta_index_dealloc,	/* tp_dealloc */
+	0,							/* tp_print */
+	0,							/* tp_getattr */
+	0,							/* tp_setattr */
+	0,							/* tp_compare */
+	0,							/* tp_repr */
+	0,							/* tp_as_number */
+	0,							/* tp_as_sequence */
+	0,							/* tp_as_mapping */
+	0,							/* tp_hash */
+	0,							/* tp_call */
+	0,							/* tp_str */
+	0,							/* tp_getattro */
+	0,							/* tp_setattro */
+	0,							/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,			/* tp_flags */
+	"Index of a delta base buffer.",	/* tp_doc */
+	0,							/* tp_traverse */
+	0,							/* tp_clear */
+	0,							/* tp_richcompare */
+	0,							/* tp_weaklistoffset */
+	0,							/* tp_iter */
+	0,							/* tp_iternext */
+	py_delta_index_methods,		/* tp_methods */
+	0,							/* tp_members */
+	0,							/* tp_getset */
+	0,							/* tp_base */
+	0,							/* tp_dict */
+	0,							/* tp_descr_get */
+	0,							/* tp_descr_set */
+	0,							/* tp_dictoffset */
+	0,							/* tp_init */
+	0,							/* tp_alloc */
+	py_delta_index_new,			/* tp_new */
+};
+
 static PyObject *py_bisect_find_sha(PyObject *self, PyObject *args)
 {
 	PyObject *unpack_name;
@@ -232,10 +618,426 @@ static PyObject *py_bisect_find_sha(PyObject *self, PyObject *args)
 	Py_RETURN_NONE;
 }
 
+#ifdef HAVE_ZLIB
+/* The functions below need zlib; without it, dulwich.pack falls back to the
+ * pure-Python read_zlib_chunks and unpack_object. */
+
+/* Compute the CRC32 of a string, continuing from crc. */
+static void update_crc32(int have_crc32, uLong *crc, const char *data,
+						 Py_ssize_t len)
+{
+	if (!have_crc32)
+		return;
+	while (len > 0) {
+		uInt n = len > 0x40000000 ? 0x40000000 : (uInt)len;
+		*crc = crc32(*crc, (const Bytef *)data, n);
+		data += n;
+		len -= n;
+	}
+}
+
+static PyObject *zlib_error(int err, z_stream *zst)
+{
+	if (zst->msg != NULL)
+		PyErr_Format(PyExc_ZlibError,
+					 "Error %d while decompressing data: %.200s", err, zst->msg);
+	else
+		PyErr_Format(PyExc_ZlibError,
+					 "Error %d while decompressing data", err);
+	return NULL;
+}
+
+/* Decompress as much of data as possible into a new string.
+ *
+ * Sets *consumed to the number of bytes of data that were used, and
+ * *stream_end if the end of the zlib stream was reached.
+ */
+static PyObject *inflate_chunk(z_stream *zst, const char *data, Py_ssize_t len,
+							   Py_ssize_t *consumed, int *stream_end)
+{
+	PyObject *ret;
+	Py_ssize_t out_size = len * 2 + 64, produced = 0;
+	int err;
+
+	ret = PyString_FromStringAndSize(NULL, out_size);
+	if (ret == NULL)
+		return NULL;
+
+	zst->next_in = (Bytef *)data;
+	zst->avail_in = (uInt)len;
+	while (1) {
+		zst->next_out = (Bytef *)PyString_AS_STRING(ret) + produced;
+		zst->avail_out = (uInt)(out_size - produced);
+		err = inflate(zst, Z_SYNC_FLUSH);
+		produced = out_size - zst->avail_out;
+		if (err == Z_STREAM_END) {
+			*stream_end = 1;
+			break;
+		}
+		if (err != Z_OK && err != Z_BUF_ERROR) {
+			Py_DECREF(ret);
+			return zlib_error(err, zst);
+		}
+		if (zst->avail_out != 0 || zst->avail_in == 0)
+			break;
+		out_size *= 2;
+		if (_PyString_Resize(&ret, out_size) < 0)
+			return NULL;
+	}
+	if (_PyString_Resize(&ret, produced) < 0)
+		return NULL;
+	*consumed = len - zst->avail_in;
+	return ret;
+}
+
+static PyObject *read_zlib_chunks(PyObject *read_some, PyObject *unpacked,
+								  int include_comp, Py_ssize_t buffer_size)
+{
+	PyObject *py_decomp_len, *py_crc32;
+	PyObject *comp_chunks = NULL, *decomp_chunks = NULL;
+	PyObject *add = NULL, *decomp, *unused = NULL;
+	Py_ssize_t expected_len, decomp_len = 0, len, consumed;
+	const char *data;
+	uLong crc = 0;
+	int have_crc32, stream_end = 0, err;
+	z_stream zst;
+
+	py_decomp_len = PyObject_GetAttrString(unpacked, "decomp_len");
+	if (py_decomp_len == NULL)
+		return NULL;
+	expected_len = PyNumber_AsSsize_t(py_decomp_len, PyExc_OverflowError);
+	Py_DECREF(py_decomp_len);
+	if (expected_len == -1 && PyErr_Occurred())
+		return NULL;
+	if (expected_len <= -1) {
+		PyErr_SetString(PyExc_ValueError,
+						"non-negative zlib data stream size expected");
+		return NULL;
+	}
+
+	py_crc32 = PyObject_GetAttrString(unpacked, "crc32");
+	if (py_crc32 == NULL)
+		return NULL;
+	have_crc32 = (py_crc32 != Py_None);
+	if (have_crc32) {
+		crc = PyInt_AsUnsignedLongMask(py_crc32) & 0xffffffff;
+		if (PyErr_Occurred()) {
+			Py_DECREF(py_crc32);
+			return NULL;
+		}
+	}
+	Py_DECREF(py_crc32);
+
+	decomp_chunks = PyObject_GetAttrString(unpacked, "decomp_chunks");
+	if (decomp_chunks == NULL)
+		return NULL;
+	if (!PyList_Check(decomp_chunks)) {
+		PyErr_SetString(PyExc_TypeError, "decomp_chunks is not a list");
+		Py_DECREF(decomp_chunks);
+		return NULL;
+	}
+
+	comp_chunks = PyList_New(0);
+	if (comp_chunks == NULL) {
+		Py_DECREF(decomp_chunks);
+		return NULL;
+	}
+
+	memset(&zst, 0, sizeof(zst));
+	err = inflateInit(&zst);
+	if (err != Z_OK) {
+		Py_DECREF(comp_chunks);
+		Py_DECREF(decomp_chunks);
+		if (err == Z_MEM_ERROR)
+			return PyErr_NoMemory();
+		return zlib_error(err, &zst);
+	}
+
+	while (1) {
+		add = PyObject_CallFunction(read_some, "n", buffer_size);
+		if (add == NULL)
+			goto error;
+		/* read_some may return a buffer rather than a string. */
+		if (PyObject_AsReadBuffer(add, (const void **)&data, &len) < 0)
+			goto error;
+		if (len == 0) {
+			PyErr_SetString(PyExc_ZlibError, "EOF before end of zlib stream");
+			goto error;
+		}
+		if (PyList_Append(comp_chunks, add) < 0)
+			goto error;
+
+		if (stream_end) {
+			/* Everything after the end of the stream is unused. */
+			consumed = 0;
+			decomp = PyString_FromStringAndSize(NULL, 0);
+		} else {
+			decomp = inflate_chunk(&zst, data, len,
+								   &consumed, &stream_end);
+		}
+		if (decomp == NULL)
+			goto error;
+		decomp_len += PyString_GET_SIZE(decomp);
+		err = PyList_Append(decomp_chunks, decomp);
+		Py_DECREF(decomp);
+		if (err < 0)
+			goto error;
+
+		if (consumed < len) {
+			unused = PyString_FromStringAndSize(
+				data + consumed, len - consumed);
+			if (unused == NULL)
+				goto error;
+			update_crc32(have_crc32, &crc, data,
+						 consumed);
+			if (include_comp) {
+				PyObject *comp = PyString_FromStringAndSize(
+					data, consumed);
+				if (comp == NULL)
+					goto error;
+				if (PyList_SetItem(comp_chunks,
+								   PyList_GET_SIZE(comp_chunks) - 1, comp) < 0)
+					goto error;
+			}
+			break;
+		}
+		update_crc32(have_crc32, &crc, data, len);
+		Py_DECREF(add);
+	}
+	Py_DECREF(add);
+	add = NULL;
+	inflateEnd(&zst);
+
+	if (decomp_len != expected_len) {
+		PyErr_SetString(PyExc_ZlibError,
+						"decompressed data does not match expected size");
+		goto error_end;
+	}
+
+	if (have_crc32)
+		py_crc32 = PyInt_FromSize_t(crc & 0xffffffff);
+	else {
+		Py_INCREF(Py_None);
+		py_crc32 = Py_None;
+	}
+	if (py_crc32 == NULL)
+		goto error_end;
+	err = PyObject_SetAttrString(unpacked, "crc32", py_crc32);
+	Py_DECREF(py_crc32);
+	if (err < 0)
+		goto error_end;
+	if (include_comp &&
+		PyObject_SetAttrString(unpacked, "comp_chunks", comp_chunks) < 0)
+		goto error_end;
+
+	Py_DECREF(comp_chunks);
+	Py_DECREF(decomp_chunks);
+	return unused;
+
+error:
+	Py_XDECREF(add);
+	inflateEnd(&zst);
+error_end:
+	Py_XDECREF(unused);
+	Py_DECREF(comp_chunks);
+	Py_DECREF(decomp_chunks);
+	return NULL;
+}
+
+static PyObject *py_read_zlib_chunks(PyObject *self, PyObject *args,
+									 PyObject *kw)
+{
+	static char *kwlist[] = {"read_some", "unpacked", "include_comp",
+							 "buffer_size", NULL};
+	PyObject *read_some, *unpacked, *py_include_comp = Py_False;
+	Py_ssize_t buffer_size = ZLIB_BUFSIZE;
+	int include_comp;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "OO|On", kwlist, &read_some,
+									 &unpacked, &py_include_comp,
+									 &buffer_size))
+		return NULL;
+
+	include_comp = PyObject_IsTrue(py_include_comp);
+	if (include_comp == -1)
+		return NULL;
+
+	return read_zlib_chunks(read_some, unpacked, include_comp, buffer_size);
+}
+
+/* Read a single byte using read, updating the CRC32. */
+static int read_byte(PyObject *read, int have_crc32, uLong *crc)
+{
+	PyObject *b;
+	int ret;
+
+	b = PyObject_CallFunction(read, "i", 1);
+	if (b == NULL)
+		return -1;
+	if (!PyString_Check(b)) {
+		PyErr_SetString(PyExc_TypeError, "read returned non-string");
+		Py_DECREF(b);
+		return -1;
+	}
+	if (PyString_GET_SIZE(b) == 0) {
+		PyErr_SetString(PyExc_TypeError, "unexpected end of object header");
+		Py_DECREF(b);
+		return -1;
+	}
+	update_crc32(have_crc32, crc, PyString_AS_STRING(b),
+				 PyString_GET_SIZE(b));
+	ret = (uint8_t)PyString_AS_STRING(b)[0];
+	Py_DECREF(b);
+	return ret;
+}
+
+static PyObject *py_unpack_object(PyObject *self, PyObject *args, PyObject *kw)
+{
+	static char *kwlist[] = {"read_all", "read_some", "compute_crc32",
+							 "include_comp", "zlib_bufsize", NULL};
+	PyObject *read_all, *read_some = Py_None;
+	PyObject *py_compute_crc32 = Py_False, *py_include_comp = Py_False;
+	PyObject *delta_base = NULL, *py_size = NULL, *py_crc32 = NULL;
+	PyObject *unpacked = NULL, *unused;
+	Py_ssize_t zlib_bufsize = ZLIB_BUFSIZE;
+	int have_crc32, include_comp, type_num, c, shift;
+	size_t size;
+	uLong crc = 0;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "O|OOOn", kwlist, &read_all,
+									 &read_some, &py_compute_crc32,
+									 &py_include_comp, &zlib_bufsize))
+		return NULL;
+
+	if (read_some == Py_None)
+		read_some = read_all;
+	have_crc32 = PyObject_IsTrue(py_compute_crc32);
+	if (have_crc32 == -1)
+		return NULL;
+	include_comp = PyObject_IsTrue(py_include_comp);
+	if (include_comp == -1)
+		return NULL;
+
+	if (unpacked_object_cls == NULL) {
+		/* Importing this at module initialization would be circular, since
+		 * this module is imported at the very bottom of pack.py. */
+		PyObject *pack_mod = PyImport_ImportModule("dulwich.pack");
+		if (pack_mod == NULL)
+			return NULL;
+		unpacked_object_cls = PyObject_GetAttrString(pack_mod,
+													 "UnpackedObject");
+		Py_DECREF(pack_mod);
+		if (unpacked_object_cls == NULL)
+			return NULL;
+	}
+
+	c = read_byte(read_all, have_crc32, &crc);
+	if (c == -1)
+		return NULL;
+	type_num = (c >> 4) & 0x07;
+	size = c & 0x0f;
+	shift = 4;
+	while (c & 0x80) {
+		c = read_byte(read_all, have_crc32, &crc);
+		if (c == -1)
+			return NULL;
+		if (shift >= (int)(sizeof(size) * 8)) {
+			PyErr_SetString(PyExc_OverflowError, "object size too large");
+			return NULL;
+		}
+		size += (size_t)(c & 0x7f) << shift;
+		shift += 7;
+	}
+
+	if (type_num == OFS_DELTA) {
+		unsigned PY_LONG_LONG delta_base_offset;
+		c = read_byte(read_all, have_crc32, &crc);
+		if (c == -1)
+			return NULL;
+		delta_base_offset = c & 0x7f;
+		while (c & 0x80) {
+			c = read_byte(read_all, have_crc32, &crc);
+			if (c == -1)
+				return NULL;
+			if (delta_base_offset >> 56) {
+				PyErr_SetString(PyExc_OverflowError,
+								"delta base offset too large");
+				return NULL;
+			}
+			delta_base_offset += 1;
+			delta_base_offset <<= 7;
+			delta_base_offset += (c & 0x7f);
+		}
+		delta_base = PyLong_FromUnsignedLongLong(delta_base_offset);
+		if (delta_base != NULL && PyLong_Check(delta_base)) {
+			/* Return an int where it fits, like the Python implementation. */
+			PyObject *tmp = PyNumber_Int(delta_base);
+			Py_DECREF(delta_base);
+			delta_base = tmp;
+		}
+	} else if (type_num == REF_DELTA) {
+		delta_base = PyObject_CallFunction(read_all, "i", 20);
+		if (delta_base != NULL && have_crc32) {
+			if (!PyString_Check(delta_base)) {
+				PyErr_SetString(PyExc_TypeError, "read returned non-string");
+				goto error;
+			}
+			update_crc32(have_crc32, &crc, PyString_AS_STRING(delta_base),
+						 PyString_GET_SIZE(delta_base));
+		}
+	} else {
+		Py_INCREF(Py_None);
+		delta_base = Py_None;
+	}
+	if (delta_base == NULL)
+		return NULL;
+
+	py_size = PyInt_FromSize_t(size);
+	if (py_size == NULL)
+		goto error;
+	if (have_crc32)
+		py_crc32 = PyInt_FromSize_t(crc);
+	else {
+		Py_INCREF(Py_None);
+		py_crc32 = Py_None;
+	}
+	if (py_crc32 == NULL)
+		goto error;
+
+	unpacked = PyObject_CallFunction(unpacked_object_cls, "iOOO", type_num,
+									 delta_base, py_size, py_crc32);
+	if (unpacked == NULL)
+		goto error;
+	Py_DECREF(delta_base);
+	Py_DECREF(py_size);
+	Py_DECREF(py_crc32);
+
+	unused = read_zlib_chunks(read_some, unpacked, include_comp, zlib_bufsize);
+	if (unused == NULL) {
+		Py_DECREF(unpacked);
+		return NULL;
+	}
+	return Py_BuildValue("(NN)", unpacked, unused);
+
+error:
+	Py_XDECREF(delta_base);
+	Py_XDECREF(py_size);
+	Py_XDECREF(py_crc32);
+	return NULL;
+}
+#endif /* HAVE_ZLIB */
+
 
 static PyMethodDef py_pack_methods[] = {
 	{ "apply_delta", (PyCFunction)py_apply_delta, METH_VARARGS, NULL },
 	{ "bisect_find_sha", (PyCFunction)py_bisect_find_sha, METH_VARARGS, NULL },
+	{ "create_delta", (PyCFunction)py_create_delta, METH_VARARGS, NULL },
+#ifdef HAVE_ZLIB
+	{ "read_zlib_chunks", (PyCFunction)py_read_zlib_chunks,
+		METH_VARARGS | METH_KEYWORDS, NULL },
+	{ "unpack_object", (PyCFunction)py_unpack_object,
+		METH_VARARGS | METH_KEYWORDS, NULL },
+#endif
 	{ NULL, NULL, 0, NULL }
 };
 
@@ -243,6 +1045,9 @@ void init_pack(void)
 {
 	PyObject *m;
 	PyObject *errors_module;
+#ifdef HAVE_ZLIB
+	PyObject *zlib_module;
+#endif
 
 	errors_module = PyImport_ImportModule("dulwich.errors");
 	if (errors_module == NULL)
@@ -252,7 +1057,24 @@ void init_pack(void)
 	if (PyExc_ApplyDeltaError == NULL)
 		return;
 
+#ifdef HAVE_ZLIB
+	zlib_module = PyImport_ImportModule("zlib");
+	if (zlib_module == NULL)
+		return;
+
+	PyExc_ZlibError = PyObject_GetAttrString(zlib_module, "error");
+	Py_DECREF(zlib_module);
+	if (PyExc_ZlibError == NULL)
+		return;
+#endif
+
+	if (PyType_Ready(&DeltaIndexType) < 0)
+		return;
+
 	m = Py_InitModule3("_pack", py_pack_methods, NULL);
 	if (m == NULL)
 		return;
+
+	Py_INCREF(&DeltaIndexType);
+	PyModule_AddObject(m, "DeltaIndex", (PyObject *)&DeltaIndexType);
 }
@@ -0,0 +1,499 @@
+# bitmap.py -- Reading and writing of pack bitmap files
+# Copyright (C) 2015 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# or (at your option) any later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reading and writing of pack bitmap files.
+
+A pack bitmap stores, for a selection of commits in a pack, the set of
+objects reachable from that commit as a bitmap over the objects of the pack.
+That allows the objects to send for a fetch to be computed with a few bitmap
+operations rather than by walking (and parsing) every commit and tree.
+
+The format is the one used by C git, in pack-*.bitmap next to the pack:
+
+ * a 32 byte header: 'BITM', version, flags, number of commit bitmaps and
+   the checksum of the pack.
+ * bitmaps of the commits, trees, blobs and tags in the pack.
+ * for every commit bitmap: the position of the commit in the pack index,
+   the distance to an earlier bitmap this bitmap was XOR-ed with, flags
+   and the bitmap itself.
+ * optionally, a cache of hashes of the names of the objects, and a lookup
+   table for the commit bitmaps.
+ * a SHA1 checksum over all of the above.
+
+Bit i of a bitmap stands for the i-th object in the pack, in the order of
+their offsets. Bitmaps are stored EWAH-compressed; here they are represented
+as (unbounded) integers, so that they can be combined with the usual binary
+operators.
+"""
+
+import binascii
+from hashlib import sha1
+import stat
+import struct
+from struct import unpack_from
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.file import GitFile
+from dulwich.objects import (
+    Blob,
+    Commit,
+    Tag,
+    Tree,
+    hex_to_sha,
+    sha_to_hex,
+    S_ISGITLINK,
+    )
+from dulwich.pack import (
+    SHA1Writer,
+    _load_file_contents,
+    )
+
+
+BITMAP_SIGNATURE = b'BITM'
+BITMAP_VERSION = 1
+
+BITMAP_OPT_FULL_DAG = 0x1
+BITMAP_OPT_HASH_CACHE = 0x4
+BITMAP_OPT_LOOKUP_TABLE = 0x10
+
+# Maximum run length and literal word count of an EWAH marker word.
+_EWAH_MAX_RUNNING_LENGTH = 0xffffffff
+_EWAH_MAX_LITERAL_WORDS = 0x7fffffff
+_EWAH_ALL_ONES = 0xffffffffffffffff
+
+# Order of the type bitmaps in the file.
+_TYPE_NUMS = (Commit.type_num, Tree.type_num, Blob.type_num, Tag.type_num)
+
+
+def _bytes_to_int(data):
+    """Convert little-endian bytes to an integer."""
+    if hasattr(int, 'from_bytes'):
+        return int.from_bytes(data, 'little')
+    return int(binascii.hexlify(bytes(data)[::-1]) or b'0', 16)
+
+
+def _int_to_bytes(n, length=None):
+    """Convert an integer to little-endian bytes.
+
+    :param n: Non-negative integer
+    :param length: Minimum length of the result; it is padded with zeros
+    """
+    if n == 0:
+        data = b''
+    else:
+        h = '%x' % n
+        data = binascii.unhexlify(('0' * (len(h) % 2)) + h)[::-1]
+    if length is not None and len(data) < length:
+        data += b'\0' * (length - len(data))
+    return data
+
+
+def iter_bits(bitmap):
+    """Iterate over the positions of the bits set in a bitmap, in order."""
+    for i, byte in enumerate(bytearray(_int_to_bytes(bitmap))):
+        if byte:
+            for j in range(8):
+                if byte & (1 << j):
+                    yield i * 8 + j
+
+
+def read_ewah(contents, offset):
+    """Read an EWAH-compressed bitmap.
+
+    :param contents: Buffer to read from
+    :param offset: Offset of the bitmap in contents
+    :return: Tuple with the bitmap as integer and the offset just past it
+    """
+    bit_size, num_words = unpack_from('>LL', contents, offset)
+    offset += 8
+    words = unpack_from('>%dQ' % num_words, contents, offset)
+    # The position of the last marker word is only needed for appending.
+    offset += num_words * 8 + 4
+    chunks = []
+    i = 0
+    while i < num_words:
+        marker = words[i]
+        i += 1
+        running_length = (marker >> 1) & _EWAH_MAX_RUNNING_LENGTH
+        num_literals = marker >> 33
+        if running_length:
+            if marker & 1:
+                chunks.append(b'\xff' * (8 * running_length))
+            else:
+                chunks.append(b'\0' * (8 * running_length))
+        if num_literals:
+            chunks.append(struct.pack(
+                '<%dQ' % num_literals, *words[i:i+num_literals]))
+            i += num_literals
+    return _bytes_to_int(b''.join(chunks)), offset
+
+
+def write_ewah(f, bitmap):
+    """Write an EWAH-compressed bitmap.
+
+    :param f: File-like object to write to
+    :param bitmap: Bitmap as integer
+    """
+    data = _int_to_bytes(bitmap)
+    data += b'\0' * (-len(data) % 8)
+    words = struct.unpack('<%dQ' % (len(data) // 8), data)
+    out = []
+    last_marker = 0
+    i = 0
+    while i < len(words) or not out:
+        running_bit = 0
+        running_length = 0
+        if i < len(words) and words[i] in (0, _EWAH_ALL_ONES):
+            clean = words[i]
+            running_bit = int(clean == _EWAH_ALL_ONES)
+            while (i < len(words) and words[i] == clean and
+                   running_length < _EWAH_MAX_RUNNING_LENGTH):
+                running_length += 1
+                i += 1
+        literals_start = i
+        while (i < len(words) and words[i] not in (0, _EWAH_ALL_ONES) and
+               i - literals_start < _EWAH_MAX_LITERAL_WORDS):
+            i += 1
+        last_marker = len(out)
+        out.append(running_bit | (running_length << 1) |
+                   ((i - literals_start) << 33))
+        out.extend(words[literals_start:i])
+    f.write(struct.pack('>LL', len(words) * 64, len(out)))
+    f.write(struct.pack('>%dQ' % len(out), *out))
+    f.write(struct.pack('>L', last_marker))
+
+
+class PackBitmap(object):
+    """A pack bitmap file."""
+
+    def __init__(self, filename, pack_index, file=None, contents=None,
+                 size=None):
+        """Open a pack bitmap file.
+
+        :param filename: Path to the file
+        :param pack_index: PackIndex of the pack the bitmap is for
+        :param file: Optional file-like object to read from
+        :param contents: Optional contents of the file
+        :param size: Optional size of the file
+        """
+        self._filename = filename
+        self._pack_index = pack_index
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        self._shas = None
+        self._positions = None
+        self._decoded = {}
+        self._read_header()
+
+    def _read_header(self):
+        contents = self._contents
+        if contents[:4] != BITMAP_SIGNATURE:
+            raise AssertionError('Not a pack bitmap file')
+        version, self.flags, num_entries = unpack_from('>HHL', contents, 4)
+        if version != BITMAP_VERSION:
+            raise AssertionError('Version was %d' % version)
+        if not self.flags & BITMAP_OPT_FULL_DAG:
+            raise AssertionError('Pack bitmaps without full DAG unsupported')
+        self.pack_checksum = bytes(contents[12:32])
+        offset = 32
+        self.commits, offset = read_ewah(contents, offset)
+        self.trees, offset = read_ewah(contents, offset)
+        self.blobs, offset = read_ewah(contents, offset)
+        self.tags, offset = read_ewah(contents, offset)
+        # Commit bitmaps are only decoded when needed.
+        self._entries = []
+        for i in range(num_entries):
+            index_position, xor_offset, flags = unpack_from(
+                '>LBB', contents, offset)
+            offset += 6
+            self._entries.append((index_position, xor_offset, offset))
+            num_words = unpack_from('>L', contents, offset + 4)[0]
+            offset += 12 + num_words * 8
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        """Return the number of commits with a bitmap."""
+        return len(self._entries)
+
+    def _load_positions(self):
+        if self._shas is not None:
+            return
+        index_entries = sorted(self._pack_index.iterentries())
+        by_offset = sorted((offset, sha)
+                           for (sha, offset, crc32) in index_entries)
+        self._shas = [sha for (offset, sha) in by_offset]
+        self._positions = dict(
+            (sha, i) for (i, sha) in enumerate(self._shas))
+        self._blob_bits = bytearray(
+            _int_to_bytes(self.blobs, (len(self._shas) + 7) // 8))
+        # Commits in the bitmap are identified by their position in the index.
+        self._entry_numbers = dict(
+            (index_entries[index_position][0], i)
+            for (i, (index_position, xor_offset, ewah_offset))
+            in enumerate(self._entries))
+
+    def _to_binary(self, sha):
+        if len(sha) == 40:
+            return hex_to_sha(sha)
+        return sha
+
+    def position(self, sha):
+        """Return the position of an object in the bitmaps.
+
+        :param sha: SHA of the object, either hex or binary
+        :raise KeyError: If the object is not in the pack
+        """
+        self._load_positions()
+        return self._positions[self._to_binary(sha)]
+
+    def __contains__(self, sha):
+        """Check whether there is a bitmap for a commit."""
+        self._load_positions()
+        return self._to_binary(sha) in self._entry_numbers
+
+    def _decode_entry(self, i):
+        # XOR-ed bitmaps refer to earlier entries, which may in turn be
+        # XOR-ed with yet earlier ones.
+        todo = []
+        while i not in self._decoded:
+            todo.append(i)
+            xor_offset = self._entries[i][1]
+            if not xor_offset:
+                break
+            i -= xor_offset
+        for i in reversed(todo):
+            index_position, xor_offset, ewah_offset = self._entries[i]
+            bitmap = read_ewah(self._contents, ewah_offset)[0]
+            if xor_offset:
+                bitmap ^= self._decoded[i - xor_offset]
+            self._decoded[i] = bitmap
+        return self._decoded[i]
+
+    def get_bitmap(self, sha):
+        """Return the bitmap of the objects reachable from a commit.
+
+        :param sha: SHA of the commit, either hex or binary
+        :return: Bitmap as integer
+        :raise KeyError: If there is no bitmap for the commit
+        """
+        self._load_positions()
+        return self._decode_entry(self._entry_numbers[self._to_binary(sha)])
+
+    def iter_shas(self, bitmap):
+        """Iterate over the hex SHAs of the objects in a bitmap.
+
+        :param bitmap: Bitmap as integer
+        :return: Iterator over SHAs, in pack order
+        """
+        self._load_positions()
+        for i in iter_bits(bitmap):
+            yield sha_to_hex(self._shas[i])
+
+    def find_reachable(self, shas, get_object):
+        """Compute the bitmap of the objects reachable from a set of objects.
+
+        Only objects that are reachable from the given objects, but not from a
+        commit with a bitmap, are retrieved and parsed.
+
+        :param shas: Iterable over hex SHAs of objects
+        :param get_object: Function that returns the object for a hex SHA
+        :return: Bitmap as integer
+        :raise KeyError: If any of the objects is not in the pack
+        """
+        self._load_positions()
+        length = (len(self._shas) + 7) // 8
+        bits = bytearray(length)
+        # Walk commits and tags before trees, so that the trees of commits
+        # reachable from commits with a bitmap are skipped.
+        todo = list(shas)
+        trees = []
+        while todo or trees:
+            if todo:
+                sha = todo.pop()
+            else:
+                sha = trees.pop()
+            i = self.position(sha)
+            if bits[i >> 3] & (1 << (i & 7)):
+                continue
+            try:
+                bitmap = self.get_bitmap(sha)
+            except KeyError:
+                pass
+            else:
+                bits = bytearray(_int_to_bytes(
+                    _bytes_to_int(bits) | bitmap, length))
+                continue
+            bits[i >> 3] |= 1 << (i & 7)
+            if self._blob_bits[i >> 3] & (1 << (i & 7)):
+                continue
+            obj = get_object(sha)
+            if isinstance(obj, Commit):
+                todo.extend(obj.parents)
+                trees.append(obj.tree)
+            elif isinstance(obj, Tag):
+                todo.append(obj.object[1])
+            elif isinstance(obj, Tree):
+                for name, mode, child in obj.iteritems():
+                    if S_ISGITLINK(mode):
+                        continue
+                    if stat.S_ISDIR(mode):
+                        trees.append(child)
+                    else:
+                        j = self.position(child)
+                        bits[j >> 3] |= 1 << (j & 7)
+        return _bytes_to_int(bits)
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this file.
+
+        :return: This is a 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this file.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+
+def load_pack_bitmap(path, pack_index):
+    """Load a pack bitmap file by path.
+
+    :param path: Path to the pack bitmap file
+    :param pack_index: PackIndex of the pack the bitmap is for
+    :return: A PackBitmap loaded from the given path
+    """
+    with GitFile(path, 'rb') as f:
+        return PackBitmap(path, pack_index, file=f)
+
+
+class _IncompleteClosure(Exception):
+    """Not all objects reachable from a commit are in the pack."""
+
+
+def write_pack_bitmap(f, pack, commits):
+    """Write a bitmap file for a pack.
+
+    A bitmap is only written for commits of which all reachable objects are
+    in the pack; other commits are skipped.
+
+    :param f: File-like object to write to
+    :param pack: Pack to write the bitmap for
+    :param commits: Iterable over hex SHAs of the commits to write a bitmap
+        for
+    :return: Tuple with the number of commit bitmaps written and the SHA of
+        the written file
+    """
+    index_entries = sorted(pack.index.iterentries())
+    index_positions = dict(
+        (sha, i) for (i, (sha, offset, crc32)) in enumerate(index_entries))
+    by_offset = sorted((offset, sha) for (sha, offset, crc32) in index_entries)
+    positions = dict((sha, i) for (i, (offset, sha)) in enumerate(by_offset))
+
+    def position(hexsha):
+        # Objects outside the pack are marked with -1.
+        return positions.get(hex_to_sha(hexsha), -1)
+
+    selected = set(hex_to_sha(sha) for sha in commits)
+    type_bits = dict((type_num, bytearray((len(positions) + 7) // 8))
+                     for type_num in _TYPE_NUMS)
+    # Positions of the objects each object refers to.
+    links = [()] * len(positions)
+    commit_times = []
+    for obj in pack.iterobjects():
+        sha = obj.sha().digest()
+        i = positions[sha]
+        type_bits[obj.type_num][i >> 3] |= 1 << (i & 7)
+        if isinstance(obj, Commit):
+            links[i] = tuple(
+                [position(obj.tree)] + [position(p) for p in obj.parents])
+            if sha in selected:
+                commit_times.append((obj.commit_time, i, sha))
+        elif isinstance(obj, Tree):
+            links[i] = tuple(position(child)
+                             for (name, mode, child) in obj.iteritems()
+                             if not S_ISGITLINK(mode))
+        elif isinstance(obj, Tag):
+            links[i] = (position(obj.object[1]), )
+
+    # Walk the oldest commits first, so that the bitmaps of their ancestors
+    # can be reused.
+    commit_times.sort()
+    length = (len(positions) + 7) // 8
+    bitmaps = {}
+    entries = []
+    for commit_time, pos, sha in commit_times:
+        bits = bytearray(length)
+        todo = [pos]
+        try:
+            while todo:
+                i = todo.pop()
+                if i < 0:
+                    raise _IncompleteClosure()
+                if bits[i >> 3] & (1 << (i & 7)):
+                    continue
+                if i in bitmaps:
+                    bits = bytearray(_int_to_bytes(
+                        _bytes_to_int(bits) | bitmaps[i], length))
+                    continue
+                bits[i >> 3] |= 1 << (i & 7)
+                todo.extend(links[i])
+        except _IncompleteClosure:
+            continue
+        bitmaps[pos] = _bytes_to_int(bits)
+        entries.append((index_positions[sha], bitmaps[pos]))
+
+    f = SHA1Writer(f)
+    f.write(BITMAP_SIGNATURE)
+    f.write(struct.pack('>HHL', BITMAP_VERSION, BITMAP_OPT_FULL_DAG,
+                        len(entries)))
+    f.write(pack.index.get_pack_checksum())
+    for type_num in _TYPE_NUMS:
+        write_ewah(f, _bytes_to_int(type_bits[type_num]))
+    for index_position, bitmap in entries:
+        # Bitmaps are not XOR-ed with earlier ones.
+        f.write(struct.pack('>LBB', index_position, 0, 0))
+        write_ewah(f, bitmap)
+    return len(entries), f.write_sha()
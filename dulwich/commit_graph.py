@@ -0,0 +1,393 @@
+# commit_graph.py -- Reading and writing of commit-graph files
+# Copyright (C) 2015 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# or (at your option) any later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reading and writing of commit-graph files.
+
+A commit-graph stores the parents, tree, commit time and generation number of
+commits, so that history can be walked without inflating and parsing commit
+objects. The format is the one used by C git, in objects/info/commit-graph:
+
+ * an 8 byte header: 'CGPH', version, hash version, number of chunks and
+   number of base commit-graphs.
+ * a table of chunk ids and offsets, terminated by an all-zero id.
+ * the chunks:
+   OIDF: fan-out table over the commit names
+   OIDL: sorted binary commit names
+   CDAT: tree, positions of the first two parents, generation number and
+         commit time of each commit
+   EDGE: positions of further parents of octopus merges (optional)
+ * a SHA1 checksum over all of the above.
+
+Other chunks, like the corrected commit dates written by recent versions of
+C git, are ignored.
+"""
+
+from hashlib import sha1
+import struct
+from struct import unpack_from
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.file import GitFile
+from dulwich.objects import (
+    hex_to_sha,
+    sha_to_hex,
+    )
+from dulwich.pack import (
+    SHA1Writer,
+    _load_file_contents,
+    bisect_find_sha,
+    )
+
+
+COMMIT_GRAPH_FILENAME = 'commit-graph'
+
+_COMMIT_GRAPH_SIGNATURE = b'CGPH'
+_COMMIT_GRAPH_VERSION = 1
+_OID_VERSION_SHA1 = 1
+
+_CHUNK_OID_FANOUT = b'OIDF'
+_CHUNK_OID_LOOKUP = b'OIDL'
+_CHUNK_COMMIT_DATA = b'CDAT'
+_CHUNK_EXTRA_EDGES = b'EDGE'
+
+_PARENT_NONE = 0x70000000
+_EXTRA_EDGES_FLAG = 0x80000000
+_LAST_EDGE_FLAG = 0x80000000
+
+# Generation numbers are stored in 30 bits and commit times in 34 bits.
+GENERATION_NUMBER_MAX = 0x3fffffff
+# Stored by versions of git that don't compute generation numbers.
+GENERATION_NUMBER_ZERO = 0
+_COMMIT_TIME_MASK = 0x3ffffffff
+
+
+class CommitGraph(object):
+    """A commit-graph file."""
+
+    def __init__(self, filename, file=None, contents=None, size=None):
+        """Open a commit-graph file.
+
+        :param filename: Path to the file
+        :param file: Optional file-like object to read from
+        :param contents: Optional contents of the file
+        :param size: Optional size of the file
+        """
+        self._filename = filename
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        self._read_header()
+
+    def _read_header(self):
+        contents = self._contents
+        if contents[:4] != _COMMIT_GRAPH_SIGNATURE:
+            raise AssertionError('Not a commit-graph file')
+        (version, oid_version, num_chunks,
+         num_base_graphs) = unpack_from('>BBBB', contents, 4)
+        if version != _COMMIT_GRAPH_VERSION:
+            raise AssertionError('Version was %d' % version)
+        if oid_version != _OID_VERSION_SHA1:
+            raise AssertionError('Object id version was %d' % oid_version)
+        if num_base_graphs != 0:
+            raise AssertionError('Base commit-graph files not supported')
+        chunks = [unpack_from('>4sQ', contents, 8 + i * 12)
+                  for i in range(num_chunks + 1)]
+        # Chunk ids mapped to (start, end); the last row only marks the end
+        # of the final chunk.
+        self._chunks = dict(
+            (chunk_id, (start, chunks[i + 1][1]))
+            for i, (chunk_id, start) in enumerate(chunks[:-1]))
+        for chunk_id in (_CHUNK_OID_FANOUT, _CHUNK_OID_LOOKUP,
+                         _CHUNK_COMMIT_DATA):
+            if chunk_id not in self._chunks:
+                raise AssertionError('Missing chunk %r' % chunk_id)
+        start, end = self._chunks[_CHUNK_OID_FANOUT]
+        self._fan_out_table = list(unpack_from('>256L', contents, start))
+        self._names_start = self._chunks[_CHUNK_OID_LOOKUP][0]
+        self._data_start = self._chunks[_CHUNK_COMMIT_DATA][0]
+        self._edges_start = self._chunks.get(
+            _CHUNK_EXTRA_EDGES, (None, None))[0]
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        """Return the number of commits in this commit-graph."""
+        return self._fan_out_table[-1]
+
+    def __iter__(self):
+        """Iterate over the SHAs of the commits in this commit-graph."""
+        for i in range(len(self)):
+            yield sha_to_hex(self._unpack_name(i))
+
+    def _unpack_name(self, i):
+        offset = self._names_start + i * 20
+        return self._contents[offset:offset+20]
+
+    def _find(self, sha):
+        """Find the position of a commit.
+
+        :param sha: SHA of the commit, either hex or binary
+        :raise KeyError: If the commit is not in the commit-graph
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        idx = ord(sha[:1])
+        if idx == 0:
+            start = 0
+        else:
+            start = self._fan_out_table[idx-1]
+        end = self._fan_out_table[idx]
+        i = bisect_find_sha(start, end, sha, self._unpack_name)
+        if i is None:
+            raise KeyError(sha)
+        return i
+
+    def __contains__(self, sha):
+        try:
+            self._find(sha)
+        except KeyError:
+            return False
+        return True
+
+    def _unpack_data(self, i):
+        """Unpack the commit data of the i-th commit.
+
+        :return: Tuple with the binary tree SHA, the positions of the first
+            two parents, the generation number and the commit time
+        """
+        offset = self._data_start + i * 36
+        parent1, parent2, generation, time_low = unpack_from(
+            '>LLLL', self._contents, offset + 20)
+        commit_time = ((generation & 0x3) << 32) | time_low
+        return (self._contents[offset:offset+20], parent1, parent2,
+                generation >> 2, commit_time)
+
+    def _unpack_parents(self, parent1, parent2):
+        if parent1 == _PARENT_NONE:
+            return []
+        parents = [parent1]
+        if parent2 == _PARENT_NONE:
+            return parents
+        if not parent2 & _EXTRA_EDGES_FLAG:
+            parents.append(parent2)
+            return parents
+        offset = self._edges_start + (parent2 & ~_EXTRA_EDGES_FLAG) * 4
+        while True:
+            edge = unpack_from('>L', self._contents, offset)[0]
+            parents.append(edge & ~_LAST_EDGE_FLAG)
+            if edge & _LAST_EDGE_FLAG:
+                return parents
+            offset += 4
+
+    def get_parents(self, sha):
+        """Return the parents of a commit.
+
+        :param sha: SHA of the commit, either hex or binary
+        :return: List of hex SHAs of the parents
+        :raise KeyError: If the commit is not in the commit-graph
+        """
+        tree, parent1, parent2, generation, commit_time = self._unpack_data(
+            self._find(sha))
+        return [sha_to_hex(self._unpack_name(i))
+                for i in self._unpack_parents(parent1, parent2)]
+
+    def get_tree(self, sha):
+        """Return the hex SHA of the tree of a commit.
+
+        :param sha: SHA of the commit, either hex or binary
+        :raise KeyError: If the commit is not in the commit-graph
+        """
+        return sha_to_hex(self._unpack_data(self._find(sha))[0])
+
+    def get_commit_time(self, sha):
+        """Return the commit time of a commit.
+
+        :param sha: SHA of the commit, either hex or binary
+        :raise KeyError: If the commit is not in the commit-graph
+        """
+        return self._unpack_data(self._find(sha))[4]
+
+    def get_generation(self, sha):
+        """Return the generation number of a commit.
+
+        The generation number is one for commits without parents, and one
+        more than the largest generation number of the parents otherwise,
+        capped at GENERATION_NUMBER_MAX.
+
+        :param sha: SHA of the commit, either hex or binary
+        :return: Generation number, or None if the commit-graph was written
+            without generation numbers
+        :raise KeyError: If the commit is not in the commit-graph
+        """
+        generation = self._unpack_data(self._find(sha))[3]
+        if generation == GENERATION_NUMBER_ZERO:
+            return None
+        return generation
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this file.
+
+        :return: This is a 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this file.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+
+def load_commit_graph(path):
+    """Load a commit-graph file by path.
+
+    :param path: Path to the commit-graph file
+    :return: A CommitGraph loaded from the given path
+    """
+    with GitFile(path, 'rb') as f:
+        return CommitGraph(path, file=f)
+
+
+def compute_generation(sha, get_parents, generations, lookup=None):
+    """Compute the generation number of a commit.
+
+    :param sha: SHA of the commit
+    :param get_parents: Function that returns the parents of a commit
+    :param generations: Dictionary mapping SHAs to generation numbers that
+        are already known; the numbers computed are added to it
+    :param lookup: Optional function that returns the generation number of
+        a commit if it is known, e.g. from a commit-graph, and None otherwise
+    :return: The generation number of the commit
+    """
+    def known(sha):
+        generation = generations.get(sha)
+        if generation is None and lookup is not None:
+            generation = lookup(sha)
+        return generation
+
+    # Walk depth-first, without recursion, so that long histories don't hit
+    # the recursion limit.
+    todo = [sha]
+    while todo:
+        current = todo[-1]
+        if known(current) is not None:
+            todo.pop()
+            continue
+        parents = get_parents(current)
+        pending = [p for p in parents if known(p) is None]
+        if pending:
+            todo.extend(pending)
+            continue
+        todo.pop()
+        generations[current] = min(GENERATION_NUMBER_MAX, 1 + max(
+            [0] + [known(p) for p in parents]))
+    return known(sha)
+
+
+def write_commit_graph(f, commits):
+    """Write a commit-graph file.
+
+    :param f: File-like object to write to
+    :param commits: Iterable over Commit objects; the parents of each commit
+        have to be included as well
+    :return: The SHA of the written file
+    :raise ValueError: If a parent of one of the commits is not included
+    """
+    commits = dict((commit.id, commit) for commit in commits)
+    for commit in commits.values():
+        for parent in commit.parents:
+            if parent not in commits:
+                raise ValueError('Parent %s of %s not included' %
+                                 (parent, commit.id))
+    generations = {}
+    for sha in commits:
+        compute_generation(sha, lambda sha: commits[sha].parents, generations)
+    shas = sorted(commits)
+    positions = dict((sha, i) for (i, sha) in enumerate(shas))
+
+    fan_out_table = [0] * 0x100
+    for sha in shas:
+        fan_out_table[int(sha[:2], 16)] += 1
+    for i in range(1, 0x100):
+        fan_out_table[i] += fan_out_table[i-1]
+    commit_data = []
+    extra_edges = []
+    for sha in shas:
+        commit = commits[sha]
+        parents = [positions[p] for p in commit.parents]
+        if not parents:
+            parent1 = parent2 = _PARENT_NONE
+        elif len(parents) == 1:
+            parent1, parent2 = parents[0], _PARENT_NONE
+        elif len(parents) == 2:
+            parent1, parent2 = parents
+        else:
+            parent1 = parents[0]
+            parent2 = _EXTRA_EDGES_FLAG | len(extra_edges)
+            extra_edges.extend(parents[1:-1])
+            extra_edges.append(_LAST_EDGE_FLAG | parents[-1])
+        commit_time = commit.commit_time & _COMMIT_TIME_MASK
+        commit_data.append(hex_to_sha(commit.tree) + struct.pack(
+            '>LLLL', parent1, parent2,
+            (generations[sha] << 2) | (commit_time >> 32),
+            commit_time & 0xffffffff))
+    chunks = [
+        (_CHUNK_OID_FANOUT, [struct.pack('>256L', *fan_out_table)]),
+        (_CHUNK_OID_LOOKUP, [hex_to_sha(sha) for sha in shas]),
+        (_CHUNK_COMMIT_DATA, commit_data),
+        ]
+    if extra_edges:
+        chunks.append((_CHUNK_EXTRA_EDGES, [
+            struct.pack('>%dL' % len(extra_edges), *extra_edges)]))
+
+    f = SHA1Writer(f)
+    f.write(_COMMIT_GRAPH_SIGNATURE)
+    f.write(struct.pack('>BBBB', _COMMIT_GRAPH_VERSION, _OID_VERSION_SHA1,
+                        len(chunks), 0))
+    offset = 8 + (len(chunks) + 1) * 12
+    for chunk_id, data in chunks:
+        f.write(struct.pack('>4sQ', chunk_id, offset))
+        offset += sum(len(d) for d in data)
+    f.write(struct.pack('>4sQ', b'\0\0\0\0', offset))
+    for chunk_id, data in chunks:
+        f.write(b''.join(data))
+    return f.write_sha()
@@ -33,10 +33,15 @@ try:
         MutableMapping,
         )
 except ImportError:
-    from dulwich._compat import (
-        OrderedDict,
-        MutableMapping
-        )
+    try:
+        # Python 3.10 and later only have the ABCs in collections.abc
+        from collections import OrderedDict
+        from collections.abc import MutableMapping
+    except ImportError:
+        from dulwich._compat import (
+            OrderedDict,
+            MutableMapping
+            )
 
 
 from dulwich.file import GitFile
@@ -41,13 +41,13 @@ from dulwich.greenthreads import (
     GreenThreadsObjectStoreIterator,
     )
 
-from dulwich.lru_cache import LRUSizeCache
 from dulwich.objects import (
     Blob,
     Commit,
     Tree,
     Tag,
     S_ISGITLINK,
+    hex_to_sha,
     )
 from dulwich.object_store import (
     PackBasedObjectStore,
@@ -55,6 +55,7 @@ from dulwich.object_store import (
     INFODIR,
     )
 from dulwich.pack import (
+    DeltaBaseCache,
     PackData,
     Pack,
     PackIndexer,
@@ -65,7 +66,6 @@ from dulwich.pack import (
     write_pack_index_v2,
     load_pack_index_file,
     read_pack_header,
-    _compute_object_size,
     unpack_object,
     write_pack_object,
     )
@@ -139,7 +139,7 @@ class PackInfoMissingObjectFinder(GreenThreadsMissingObjectFinder):
             if not self.objects_to_send:
                 return None
             (sha, name, leaf) = self.objects_to_send.pop()
-            if sha not in self.sha_done:
+            if not self.is_done(sha):
                 break
         if not leaf:
             info = self.object_store.pack_info_get(sha)
@@ -151,7 +151,7 @@ class PackInfoMissingObjectFinder(GreenThreadsMissingObjectFinder):
                 self.add_todo([(info[1], None, False)])
             if sha in self._tagged:
                 self.add_todo([(self._tagged[sha], None, True)])
-        self.sha_done.add(sha)
+        self.sha_done.add(hex_to_sha(sha))
         self.progress("counting objects: %d\r" % len(self.sha_done))
         return (sha, name)
 
@@ -572,13 +572,14 @@ class SwiftPackData(PackData):
         pack_reader = SwiftPackReader(self.scon, self._filename,
                                       self.pack_length)
         (version, self._num_objects) = read_pack_header(pack_reader.read)
-        self._offset_cache = LRUSizeCache(1024*1024*self.scon.cache_length,
-                                          compute_size=_compute_object_size)
+        self._delta_base_cache = DeltaBaseCache(
+            1024*1024*self.scon.cache_length)
         self.pack = None
 
     def get_object_at(self, offset):
-        if offset in self._offset_cache:
-            return self._offset_cache[offset]
+        cached = self._delta_base_cache.get((self, offset))
+        if cached is not None:
+            return cached
         assert isinstance(offset, long) or isinstance(offset, int),\
             'offset was %r' % offset
         assert offset >= self._header_size
@@ -652,6 +653,7 @@ class SwiftObjectStore(PackBasedObjectStore):
     def _update_pack_cache(self):
         for pack in self._load_packs():
             self._pack_cache[pack._basename] = pack
+        self._invalidate_pack_order()
 
     def _iter_loose_objects(self):
         """Loose objects are not supported by this repository
@@ -750,7 +752,8 @@ class SwiftObjectStore(PackBasedObjectStore):
         self.add_objects([(obj, None), ])
 
     def _pack_cache_stale(self):
-        return False
+        # The packs are only loaded once, when first needed.
+        return not self._pack_cache
 
     def _get_loose_object(self, sha):
         return None
@@ -794,7 +797,9 @@ class SwiftObjectStore(PackBasedObjectStore):
             assert len(ext_sha) == 20
             type_num, data = self.get_raw(ext_sha)
             offset = f.tell()
-            crc32 = write_pack_object(f, type_num, data, sha=new_sha)
+            crc32 = write_pack_object(
+                f, type_num, data, sha=new_sha,
+                compression_level=self.pack_compression_level)
             entries.append((ext_sha, offset, crc32))
         pack_sha = new_sha.digest()
         f.write(pack_sha)
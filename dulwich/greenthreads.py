@@ -21,16 +21,20 @@
 
 """Utility module for querying an ObjectStore with gevent."""
 
+import collections
+
 import gevent
 from gevent import pool
 
 from dulwich.objects import (
     Commit,
     Tag,
+    hex_to_sha,
     )
 from dulwich.object_store import (
     MissingObjectFinder,
     _collect_filetree_revs,
+    _walk_missing_commits,
     ObjectStoreIterator,
     )
 
@@ -75,7 +79,7 @@ class GreenThreadsMissingObjectFinder(MissingObjectFinder):
                  concurrency=1, get_parents=None):
 
         def collect_tree_sha(sha):
-            self.sha_done.add(sha)
+            self.sha_done.add(hex_to_sha(sha))
             cmt = object_store[sha]
             _collect_filetree_revs(object_store, cmt.tree, self.sha_done)
 
@@ -88,18 +92,24 @@ class GreenThreadsMissingObjectFinder(MissingObjectFinder):
         want_commits, want_tags = \
             _split_commits_and_tags(object_store, wants,
                                     False, p)
-        all_ancestors = object_store._collect_ancestors(have_commits)[0]
-        missing_commits, common_commits = \
-            object_store._collect_ancestors(want_commits, all_ancestors)
+        found = _walk_missing_commits(object_store, have_commits, want_commits)
+        if found is None:
+            all_ancestors = object_store._collect_ancestors(have_commits)[0]
+            found = object_store._collect_ancestors(
+                want_commits, all_ancestors)
+        missing_commits, common_commits = found
 
         self.sha_done = set()
         jobs = [p.spawn(collect_tree_sha, c) for c in common_commits]
         gevent.joinall(jobs)
         for t in have_tags:
-            self.sha_done.add(t)
+            self.sha_done.add(hex_to_sha(t))
         missing_tags = want_tags.difference(have_tags)
-        wants = missing_commits.union(missing_tags)
-        self.objects_to_send = set([(w, None, False) for w in wants])
+        wants = list(missing_commits.union(missing_tags))
+        self.objects_to_send = collections.deque(
+            [(w, None, False) for w in wants])
+        self._retrieved = {}
+        self._to_retrieve = collections.deque(wants)
         if progress is None:
             self.progress = lambda x: None
         else:
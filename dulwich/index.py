@@ -478,21 +478,28 @@ def build_index_from_tree(prefix, index_path, object_store, tree_id,
 
     index = Index(index_path)
 
+    # Entries to check out, by blob SHA1; the blobs are retrieved in one go,
+    # in whatever order is cheapest for the object store.
+    entries = {}
     for entry in object_store.iter_tree_contents(tree_id):
         if not validate_path(entry.path):
             continue
-        full_path = os.path.join(prefix, entry.path.decode(sys.getfilesystemencoding()))
-
-        if not os.path.exists(os.path.dirname(full_path)):
-            os.makedirs(os.path.dirname(full_path))
-
-        # FIXME: Merge new index into working tree
-        obj = object_store[entry.sha]
-        build_file_from_blob(obj, entry.mode, full_path,
-            honor_filemode=honor_filemode)
-        # Add file to index
-        st = os.lstat(full_path)
-        index[entry.path] = index_entry_from_stat(st, entry.sha, 0)
+        entries.setdefault(entry.sha, []).append(entry)
+
+    for obj in object_store.get_many(entries):
+        for entry in entries[obj.id]:
+            full_path = os.path.join(
+                prefix, entry.path.decode(sys.getfilesystemencoding()))
+
+            if not os.path.exists(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+
+            # FIXME: Merge new index into working tree
+            build_file_from_blob(obj, entry.mode, full_path,
+                                 honor_filemode=honor_filemode)
+            # Add file to index
+            st = os.lstat(full_path)
+            index[entry.path] = index_entry_from_stat(st, entry.sha, 0)
 
     index.write()
 
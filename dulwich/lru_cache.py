@@ -227,6 +227,8 @@ class LRUCache(object):
     def _remove_node(self, node):
         if node is self._least_recently_used:
             self._least_recently_used = node.prev
+        elif node is self._most_recently_used:
+            self._most_recently_used = self._cache[node.next_key]
         self._cache.pop(node.key)
         # If we have removed all entries, remove the head pointer as well
         if self._least_recently_used is None:
@@ -0,0 +1,300 @@
+# midx.py -- Reading and writing of multi-pack-index files
+# Copyright (C) 2015 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# or (at your option) any later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reading and writing of multi-pack-index files.
+
+A multi-pack-index indexes the objects in all packs of a repository, so an
+object can be found with a single lookup rather than one lookup per pack.
+The format is the one used by C git, in objects/pack/multi-pack-index:
+
+ * a 12 byte header: 'MIDX', version, object id version, number of chunks,
+   number of base files and number of packs.
+ * a table of chunk ids and offsets, terminated by an all-zero id.
+ * the chunks:
+   PNAM: NUL-terminated names of the pack indexes, sorted
+   OIDF: fan-out table over the object names
+   OIDL: sorted binary object names
+   OOFF: pack number and offset for each object
+   LOFF: 64-bit offsets, for offsets that don't fit in 31 bits (optional)
+ * a SHA1 checksum over all of the above.
+"""
+
+from hashlib import sha1
+import heapq
+import struct
+from struct import unpack_from
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.file import GitFile
+from dulwich.objects import (
+    hex_to_sha,
+    sha_to_hex,
+    )
+from dulwich.pack import (
+    SHA1Writer,
+    _load_file_contents,
+    bisect_find_sha,
+    )
+
+
+MULTI_PACK_INDEX_FILENAME = 'multi-pack-index'
+
+_MIDX_SIGNATURE = b'MIDX'
+_MIDX_VERSION = 1
+_OID_VERSION_SHA1 = 1
+
+_CHUNK_PACK_NAMES = b'PNAM'
+_CHUNK_OID_FANOUT = b'OIDF'
+_CHUNK_OID_LOOKUP = b'OIDL'
+_CHUNK_OBJECT_OFFSETS = b'OOFF'
+_CHUNK_LARGE_OFFSETS = b'LOFF'
+
+_LARGE_OFFSET_FLAG = 0x80000000
+
+
+class MultiPackIndex(object):
+    """A multi-pack-index file."""
+
+    def __init__(self, filename, file=None, contents=None, size=None):
+        """Open a multi-pack-index file.
+
+        :param filename: Path to the file
+        :param file: Optional file-like object to read from
+        :param contents: Optional contents of the file
+        :param size: Optional size of the file
+        """
+        self._filename = filename
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        self._read_header()
+
+    def _read_header(self):
+        contents = self._contents
+        if contents[:4] != _MIDX_SIGNATURE:
+            raise AssertionError('Not a multi-pack-index file')
+        (version, oid_version, num_chunks, num_base_files,
+         num_packs) = unpack_from('>BBBBL', contents, 4)
+        if version != _MIDX_VERSION:
+            raise AssertionError('Version was %d' % version)
+        if oid_version != _OID_VERSION_SHA1:
+            raise AssertionError('Object id version was %d' % oid_version)
+        if num_base_files != 0:
+            raise AssertionError('Base multi-pack-index files not supported')
+        chunks = [unpack_from('>4sQ', contents, 12 + i * 12)
+                  for i in range(num_chunks + 1)]
+        # Chunk ids mapped to (start, end); the last row only marks the end
+        # of the final chunk.
+        self._chunks = dict(
+            (chunk_id, (start, chunks[i + 1][1]))
+            for i, (chunk_id, start) in enumerate(chunks[:-1]))
+        for chunk_id in (_CHUNK_PACK_NAMES, _CHUNK_OID_FANOUT,
+                         _CHUNK_OID_LOOKUP, _CHUNK_OBJECT_OFFSETS):
+            if chunk_id not in self._chunks:
+                raise AssertionError('Missing chunk %r' % chunk_id)
+        start, end = self._chunks[_CHUNK_PACK_NAMES]
+        names = bytes(contents[start:end]).split(b'\0')[:num_packs]
+        self.pack_names = [name.decode('ascii') for name in names]
+        start, end = self._chunks[_CHUNK_OID_FANOUT]
+        self._fan_out_table = list(unpack_from('>256L', contents, start))
+        self._names_start = self._chunks[_CHUNK_OID_LOOKUP][0]
+        self._offsets_start = self._chunks[_CHUNK_OBJECT_OFFSETS][0]
+        self._large_offsets_start = self._chunks.get(
+            _CHUNK_LARGE_OFFSETS, (None, None))[0]
+        if self._large_offsets_start is None:
+            offsets = unpack_from(
+                '>%dL' % (2 * len(self)), contents, self._offsets_start)
+            if any(offset & _LARGE_OFFSET_FLAG for offset in offsets[1::2]):
+                raise ValueError('missing LOFF chunk')
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        """Return the number of objects in this index."""
+        return self._fan_out_table[-1]
+
+    def __iter__(self):
+        """Iterate over the SHAs of the objects in this index."""
+        for i in range(len(self)):
+            yield sha_to_hex(self._unpack_name(i))
+
+    def _unpack_name(self, i):
+        offset = self._names_start + i * 20
+        return self._contents[offset:offset+20]
+
+    def _unpack_offset(self, i):
+        """Unpack the pack number and offset in that pack of the i-th object.
+        """
+        pack_num, offset = unpack_from(
+            '>LL', self._contents, self._offsets_start + i * 8)
+        if offset & _LARGE_OFFSET_FLAG:
+            offset = unpack_from(
+                '>Q', self._contents, self._large_offsets_start +
+                (offset & ~_LARGE_OFFSET_FLAG) * 8)[0]
+        return pack_num, offset
+
+    def iterentries(self):
+        """Iterate over the entries in this index.
+
+        :return: iterator over tuples with object name, name of the pack
+            index of the pack the object is in and offset in that pack.
+        """
+        for i in range(len(self)):
+            pack_num, offset = self._unpack_offset(i)
+            yield self._unpack_name(i), self.pack_names[pack_num], offset
+
+    def object_index(self, sha):
+        """Find an object.
+
+        :param sha: SHA of the object, either hex or binary
+        :return: Tuple with the name of the index of the pack the object is in
+            and the offset of the object in that pack
+        :raise KeyError: If the object is not in any of the packs
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        idx = ord(sha[:1])
+        if idx == 0:
+            start = 0
+        else:
+            start = self._fan_out_table[idx-1]
+        end = self._fan_out_table[idx]
+        i = bisect_find_sha(start, end, sha, self._unpack_name)
+        if i is None:
+            raise KeyError(sha)
+        pack_num, offset = self._unpack_offset(i)
+        return self.pack_names[pack_num], offset
+
+    def __contains__(self, sha):
+        try:
+            self.object_index(sha)
+        except KeyError:
+            return False
+        return True
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this file.
+
+        :return: This is a 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this file.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+
+def load_multi_pack_index(path):
+    """Load a multi-pack-index file by path.
+
+    :param path: Path to the multi-pack-index file
+    :return: A MultiPackIndex loaded from the given path
+    """
+    with GitFile(path, 'rb') as f:
+        return MultiPackIndex(path, file=f)
+
+
+def _iter_pack_index_entries(index, preference, pack_num):
+    for sha, offset, crc32 in index.iterentries():
+        yield sha, preference, pack_num, offset
+
+
+def write_multi_pack_index(f, pack_indexes):
+    """Write a multi-pack-index file.
+
+    :param f: File-like object to write to
+    :param pack_indexes: Sequence of (name, PackIndex) tuples, with name the
+        file name of the pack index, e.g. "pack-<sha>.idx". Objects that are
+        in several packs are looked up in the first of those packs.
+    :return: The SHA of the written file
+    """
+    pack_names = sorted(name for (name, index) in pack_indexes)
+    pack_nums = dict((name, i) for (i, name) in enumerate(pack_names))
+    entries = []
+    # Pack indexes are sorted by SHA, so merge them.
+    for sha, preference, pack_num, offset in heapq.merge(*[
+            _iter_pack_index_entries(index, preference, pack_nums[name])
+            for (preference, (name, index)) in enumerate(pack_indexes)]):
+        if entries and entries[-1][0] == sha:
+            continue
+        entries.append((sha, pack_num, offset))
+
+    pack_names_chunk = b''.join(
+        name.encode('ascii') + b'\0' for name in pack_names)
+    pack_names_chunk += b'\0' * (-len(pack_names_chunk) % 4)
+    fan_out_table = [0] * 0x100
+    for (sha, pack_num, offset) in entries:
+        fan_out_table[ord(sha[:1])] += 1
+    for i in range(1, 0x100):
+        fan_out_table[i] += fan_out_table[i-1]
+    object_offsets = []
+    large_offsets = []
+    for (sha, pack_num, offset) in entries:
+        if offset < _LARGE_OFFSET_FLAG:
+            object_offsets.append(struct.pack('>LL', pack_num, offset))
+        else:
+            object_offsets.append(struct.pack(
+                '>LL', pack_num, _LARGE_OFFSET_FLAG | len(large_offsets)))
+            large_offsets.append(struct.pack('>Q', offset))
+    chunks = [
+        (_CHUNK_PACK_NAMES, [pack_names_chunk]),
+        (_CHUNK_OID_FANOUT, [struct.pack('>256L', *fan_out_table)]),
+        (_CHUNK_OID_LOOKUP, [sha for (sha, pack_num, offset) in entries]),
+        (_CHUNK_OBJECT_OFFSETS, object_offsets),
+        ]
+    if large_offsets:
+        chunks.append((_CHUNK_LARGE_OFFSETS, large_offsets))
+
+    f = SHA1Writer(f)
+    f.write(_MIDX_SIGNATURE)
+    f.write(struct.pack('>BBBBL', _MIDX_VERSION, _OID_VERSION_SHA1,
+                        len(chunks), 0, len(pack_names)))
+    offset = 12 + (len(chunks) + 1) * 12
+    for chunk_id, data in chunks:
+        f.write(struct.pack('>4sQ', chunk_id, offset))
+        offset += sum(len(d) for d in data)
+    f.write(struct.pack('>4sQ', b'\0\0\0\0', offset))
+    for chunk_id, data in chunks:
+        f.write(b''.join(data))
+    return f.write_sha()
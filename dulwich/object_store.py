@@ -22,13 +22,26 @@
 
 
 from io import BytesIO
+import collections
 import errno
+import heapq
 from itertools import chain
 import os
 import stat
 import sys
 import tempfile
+import time
 
+from dulwich.bitmap import (
+    load_pack_bitmap,
+    write_pack_bitmap,
+    )
+from dulwich.commit_graph import (
+    COMMIT_GRAPH_FILENAME,
+    compute_generation,
+    load_commit_graph,
+    write_commit_graph,
+    )
 from dulwich.diff_tree import (
     tree_changes,
     walk_trees,
@@ -37,6 +50,7 @@ from dulwich.errors import (
     NotTreeError,
     )
 from dulwich.file import GitFile
+from dulwich.lru_cache import LRUSizeCache
 from dulwich.objects import (
     Commit,
     ShaFile,
@@ -49,11 +63,22 @@ from dulwich.objects import (
     S_ISGITLINK,
     object_class,
     )
+from dulwich.midx import (
+    MULTI_PACK_INDEX_FILENAME,
+    load_multi_pack_index,
+    write_multi_pack_index,
+    )
 from dulwich.pack import (
+    DEFAULT_COMPRESSION_LEVEL,
+    DEFAULT_SHARED_DELTA_BASE_CACHE_SIZE,
+    DeltaBaseCache,
+    OFS_DELTA,
+    REF_DELTA,
     Pack,
     PackData,
     PackInflater,
     iter_sha1,
+    write_pack_data,
     write_pack_header,
     write_pack_index_v2,
     write_pack_object,
@@ -66,10 +91,80 @@ from dulwich.pack import (
 INFODIR = 'info'
 PACKDIR = 'pack'
 
+# Approximate number of bytes of commit metadata to cache per object store.
+DEFAULT_COMMIT_CACHE_SIZE = 16 * 1024 * 1024
+
+# Number of objects retrieved with a single get_many call when walking or
+# sending objects.
+_OBJECT_BATCH_SIZE = 1000
+
+
+def _compute_commit_metadata_size(value):
+    """Estimate the memory used by a CommitCache entry."""
+    (tree, parents, commit_time) = value
+    # The key, tree and parents, plus the tuple and int objects.
+    return 40 * (2 + len(parents)) + 200
+
+
+class CommitCache(LRUSizeCache):
+    """Cache of the tree, parents and commit time of commits, by SHA1.
+
+    The use of the cache is tracked in the hits and misses counters.
+    """
+
+    def __init__(self, max_size=DEFAULT_COMMIT_CACHE_SIZE):
+        """Create a new CommitCache.
+
+        :param max_size: Approximate maximum number of bytes of memory to use
+        """
+        self.hits = 0
+        self.misses = 0
+        super(CommitCache, self).__init__(
+            max_size, compute_size=_compute_commit_metadata_size)
+
+    def get(self, key, default=None):
+        node = self._cache.get(key, None)
+        if node is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._record_access(node)
+        return node.value
+
+    def stats(self):
+        """Return statistics about this cache.
+
+        :return: Dictionary with the hits and misses counters, the number of
+            cached commits and the approximate current and maximum size of the
+            cache in bytes
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'commits': len(self),
+            'size': self._value_size,
+            'max_size': self._max_size,
+            }
+
 
 class BaseObjectStore(object):
     """Object store interface."""
 
+    # Created lazily, so that subclasses don't need to call __init__.
+    _commit_cache = None
+
+    # zlib compression levels for objects written to packs and loose
+    # objects, like git's pack.compression and core.loosecompression.
+    pack_compression_level = DEFAULT_COMPRESSION_LEVEL
+    loose_compression_level = DEFAULT_COMPRESSION_LEVEL
+
+    @property
+    def commit_cache(self):
+        """Cache of the tree, parents and commit time of commits."""
+        if self._commit_cache is None:
+            self._commit_cache = CommitCache()
+        return self._commit_cache
+
     def determine_wants_all(self, refs):
         return [sha for (ref, sha) in refs.items()
                 if not sha in self and not ref.endswith(b"^{}") and
@@ -116,6 +211,38 @@ class BaseObjectStore(object):
         type_num, uncomp = self.get_raw(sha)
         return ShaFile.from_raw_string(type_num, uncomp, sha=sha)
 
+    def iter_raw(self, shas):
+        """Obtain the raw contents of a set of objects.
+
+        The objects are yielded in whatever order they can be retrieved in
+        most cheaply, which is not necessarily the order of shas.
+
+        :param shas: Iterable over the SHA1s of the objects, either hex or
+            binary
+        :return: Iterator over (hex SHA1, numeric type, chunks) tuples
+        :raise KeyError: If one of the objects is not present; this may
+            happen after some of the other objects have been yielded
+        """
+        for sha in shas:
+            type_num, raw = self.get_raw(sha)
+            if len(sha) == 20:
+                sha = sha_to_hex(sha)
+            yield sha, type_num, [raw]
+
+    def get_many(self, shas):
+        """Obtain a set of objects.
+
+        Like iter_raw, the objects are yielded in whatever order they can be
+        retrieved in most cheaply.
+
+        :param shas: Iterable over the SHA1s of the objects, either hex or
+            binary
+        :return: Iterator over ShaFile objects
+        :raise KeyError: If one of the objects is not present
+        """
+        for sha, type_num, chunks in self.iter_raw(shas):
+            yield ShaFile.from_raw_chunks(type_num, chunks, sha=sha)
+
     def __iter__(self):
         """Iterate over the SHAs that are present in this store."""
         raise NotImplementedError(self.__iter__)
@@ -163,8 +290,7 @@ class BaseObjectStore(object):
                 yield entry
 
     def find_missing_objects(self, haves, wants, progress=None,
-                             get_tagged=None,
-                             get_parents=lambda commit: commit.parents):
+                             get_tagged=None, get_parents=None):
         """Find the missing objects required for a set of revisions.
 
         :param haves: Iterable over SHAs already in common.
@@ -173,12 +299,28 @@ class BaseObjectStore(object):
             updated progress strings.
         :param get_tagged: Function that returns a dict of pointed-to sha -> tag
             sha for including tags.
-        :param get_parents: Optional function for getting the parents of a commit.
+        :param get_parents: Optional function for getting the parents of a
+            commit. If not given, the parents recorded in the commits are
+            used, which allows pack bitmaps to be used.
         :return: Iterator over (sha, path) pairs.
         """
+        if get_parents is None:
+            missing = self._find_missing_objects_bitmap(
+                haves, wants, progress, get_tagged)
+            if missing is not None:
+                return iter(missing)
         finder = MissingObjectFinder(self, haves, wants, progress, get_tagged, get_parents=get_parents)
         return iter(finder.next, None)
 
+    def _find_missing_objects_bitmap(self, haves, wants, progress=None,
+                                     get_tagged=None):
+        """Find the missing objects for a set of revisions using bitmaps.
+
+        :return: List of (sha, path) pairs, or None if bitmaps can not be
+            used to find all missing objects.
+        """
+        return None
+
     def find_common_revisions(self, graphwalker):
         """Find which revisions this store has in common using graphwalker.
 
@@ -203,6 +345,71 @@ class BaseObjectStore(object):
         """
         return self.iter_shas(self.find_missing_objects(have, want, progress))
 
+    def iter_pack_records(self, shas):
+        """Iterate over the records for a pack containing a set of objects.
+
+        :param shas: Iterable over the SHA1s of the objects to include
+        :return: Iterator over records, as taken by write_pack_data
+        """
+        for sha in shas:
+            type_num, raw = self.get_raw(sha)
+            if len(sha) == 40:
+                sha = hex_to_sha(sha)
+            yield type_num, sha, None, raw
+
+    def _get_commit_metadata(self, sha):
+        """Return the tree, parents and commit time of a commit.
+
+        They are taken from the commit cache if possible.
+
+        :param sha: SHA of the commit
+        :return: Tuple with the tree, a tuple with the parents and the commit
+            time
+        """
+        metadata = self.commit_cache.get(sha)
+        if metadata is None:
+            commit = self[sha]
+            # The parents are shared by all users of the cache, so don't
+            # store a list that can be modified.
+            metadata = (commit.tree, tuple(commit.parents), commit.commit_time)
+            self.commit_cache.add(sha, metadata)
+        return metadata
+
+    def get_parents(self, sha):
+        """Return the parents of a commit.
+
+        :param sha: SHA of the commit
+        :return: List of SHAs of the parents
+        """
+        return list(self._get_commit_metadata(sha)[1])
+
+    def get_commit_time(self, sha):
+        """Return the commit time of a commit.
+
+        :param sha: SHA of the commit
+        :return: Commit time, in seconds since the epoch
+        """
+        return self._get_commit_metadata(sha)[2]
+
+    def get_commit_tree(self, sha):
+        """Return the tree of a commit.
+
+        :param sha: SHA of the commit
+        :return: SHA of the tree
+        """
+        return self._get_commit_metadata(sha)[0]
+
+    def get_generation(self, sha):
+        """Return the generation number of a commit, if known.
+
+        The generation number is one for commits without parents, and one
+        more than the largest generation number of the parents otherwise.
+
+        :param sha: SHA of the commit
+        :return: Generation number, or None if it is not known
+        """
+        return None
+
     def peel_sha(self, sha):
         """Peel all tags from a SHA.
 
@@ -218,30 +425,34 @@ class BaseObjectStore(object):
             obj = self[sha]
         return obj
 
-    def _collect_ancestors(self, heads, common=set(),
-                           get_parents=lambda commit: commit.parents):
+    def _collect_ancestors(self, heads, common=set(), get_parents=None):
         """Collect all ancestors of heads up to (excluding) those in common.
 
         :param heads: commits to start from
         :param common: commits to end at, or empty set to walk repository
             completely
-        :param get_parents: Optional function for getting the parents of a commit.
+        :param get_parents: Optional function for getting the parents of a
+            commit. If not given, the parents are looked up with get_parents
+            on this object store, which avoids parsing the commits if possible.
         :return: a tuple (A, B) where A - all commits reachable
             from heads but not present in common, B - common (shared) elements
             that are directly reachable from heads
         """
+        if get_parents is None:
+            get_commit_parents = self.get_parents
+        else:
+            def get_commit_parents(sha):
+                return get_parents(self[sha])
         bases = set()
         commits = set()
-        queue = []
-        queue.extend(heads)
+        queue = collections.deque(heads)
         while queue:
-            e = queue.pop(0)
+            e = queue.popleft()
             if e in common:
                 bases.add(e)
             elif e not in commits:
                 commits.add(e)
-                cmt = self[e]
-                queue.extend(get_parents(cmt))
+                queue.extend(get_commit_parents(e))
         return (commits, bases)
 
     def close(self):
@@ -252,7 +463,14 @@ class BaseObjectStore(object):
 class PackBasedObjectStore(BaseObjectStore):
 
     def __init__(self):
+        super(PackBasedObjectStore, self).__init__()
         self._pack_cache = {}
+        # (name, pack) tuples in the order in which to look for objects in the
+        # packs, most recently hit first.
+        self._pack_order = []
+        self._pack_order_stale = True
+        # Number of lookups that found an object in a pack, by pack name.
+        self.pack_hits = {}
 
     @property
     def alternates(self):
@@ -263,16 +481,22 @@ class PackBasedObjectStore(BaseObjectStore):
 
         This does not check alternates.
         """
-        for pack in self.packs:
-            if sha in pack:
-                return True
-        return False
+        try:
+            self._find_pack(sha)
+        except KeyError:
+            return False
+        return True
 
     def __contains__(self, sha):
         """Check if a particular object is present by SHA1.
 
         This method makes no distinction between loose and packed objects.
         """
+        if self._contains(sha):
+            return True
+        return self._refresh_on_miss() and self._contains(sha)
+
+    def _contains(self, sha):
         if self.contains_packed(sha) or self.contains_loose(sha):
             return True
         for alternate in self.alternates:
@@ -280,19 +504,160 @@ class PackBasedObjectStore(BaseObjectStore):
                 return True
         return False
 
+    def _refresh_on_miss(self):
+        """Called when an object was not found.
+
+        :return: Whether the store was refreshed, i.e. whether it is worth
+            looking for the object again
+        """
+        return False
+
+    def _find_pack(self, sha):
+        """Find the pack an object is stored in.
+
+        :param sha: SHA of the object, either hex or binary
+        :return: Tuple with the pack and the offset of the object in it
+        :raise KeyError: If the object is not in any of the packs
+        """
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        for i, (name, pack) in enumerate(self._ordered_packs()):
+            try:
+                offset = pack.index.object_index(sha)
+            except KeyError:
+                continue
+            self._record_pack_hit(i)
+            return pack, offset
+        raise KeyError(sha)
+
+    def _find_packs(self, shas):
+        """Find the packs a set of objects is stored in.
+
+        Rather than looking up the objects one by one, each pack is asked
+        for all objects not found in the packs before it at once.
+
+        :param shas: Iterable over SHAs
+        :return: Tuple with a list of (pack, objects) tuples, where objects
+            is a dictionary mapping offsets in the pack to SHAs, and a list of
+            the SHAs that are not in any of the packs
+        """
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        return self._search_packs(list(shas))
+
+    def _search_packs(self, remaining, skip=()):
+        """Look for objects in the packs, in the order of _ordered_packs.
+
+        :param remaining: List of SHAs
+        :param skip: Names of packs not to look in
+        :return: Tuple like the one returned by _find_packs
+        """
+        packed = []
+        # Recording a hit moves a pack to the front, which leaves the
+        # positions of the packs after it unchanged.
+        for i, (name, pack) in enumerate(list(self._ordered_packs())):
+            if not remaining:
+                break
+            if name in skip:
+                continue
+            found = pack.index.lookup_many(remaining)
+            if found:
+                self._record_pack_hit(i)
+                packed.append(
+                    (pack, dict((offset, sha)
+                                for (sha, offset) in found.items())))
+                remaining = [sha for sha in remaining if sha not in found]
+        return packed, remaining
+
+    def _invalidate_pack_order(self):
+        """Note that packs were added to or removed from the pack cache."""
+        self._pack_order_stale = True
+
+    def _ordered_packs(self):
+        """Return the packs in the order in which to look for objects.
+
+        Like C git, the packs objects were most recently found in are tried
+        first, since objects that are looked up together tend to be stored
+        together. Packs that are new to the cache come before all others.
+
+        :return: List of (name, pack) tuples
+        """
+        if self._pack_order_stale:
+            order = [(name, pack) for (name, pack) in self._pack_order
+                     if self._pack_cache.get(name) is pack]
+            known = set(name for (name, pack) in order)
+            new = [(name, pack) for (name, pack)
+                   in sorted(self._pack_cache.items()) if name not in known]
+            self._pack_order = new + order
+            self.pack_hits = dict((name, self.pack_hits.get(name, 0))
+                                  for name in self._pack_cache)
+            self._pack_order_stale = False
+        return self._pack_order
+
+    def _record_pack_hit(self, index):
+        """Record that an object was found in a pack.
+
+        :param index: Index of the pack in the list returned by
+            _ordered_packs; it is moved to the front of the list
+        """
+        name, pack = self._pack_order[index]
+        self.pack_hits[name] = self.pack_hits.get(name, 0) + 1
+        if index:
+            del self._pack_order[index]
+            self._pack_order.insert(0, (name, pack))
+
     def _pack_cache_stale(self):
         """Check whether the pack cache is stale."""
         raise NotImplementedError(self._pack_cache_stale)
 
+    def _get_pack_bitmap(self):
+        """Return the PackBitmap of the packs in this store, if any."""
+        return None
+
+    def _find_missing_objects_bitmap(self, haves, wants, progress=None,
+                                     get_tagged=None):
+        bitmap = self._get_pack_bitmap()
+        if bitmap is None:
+            return None
+        # Like MissingObjectFinder, ignore haves that are not in this store.
+        haves = [sha for sha in haves if sha in self]
+        try:
+            want_bits = bitmap.find_reachable(wants, self.__getitem__)
+            have_bits = bitmap.find_reachable(haves, self.__getitem__)
+        except KeyError:
+            # Not all objects involved are in the pack with the bitmap.
+            return None
+        missing_bits = want_bits & ~have_bits
+        missing = [(sha, None) for sha in bitmap.iter_shas(missing_bits)]
+        tagged = get_tagged and get_tagged() or {}
+        if tagged:
+            missing_shas = set(sha for (sha, path) in missing)
+            for sha, tag_sha in sorted(tagged.items()):
+                if sha not in missing_shas or tag_sha in missing_shas:
+                    continue
+                try:
+                    if have_bits >> bitmap.position(tag_sha) & 1:
+                        continue
+                except KeyError:
+                    if tag_sha in haves:
+                        continue
+                missing.append((tag_sha, None))
+                missing_shas.add(tag_sha)
+        if progress is not None:
+            progress("counting objects: %d, done.\n" % len(missing))
+        return missing
+
     def _add_known_pack(self, base_name, pack):
         """Add a newly appeared pack to the cache by path.
 
         """
         self._pack_cache[base_name] = pack
+        self._invalidate_pack_order()
 
     def close(self):
         pack_cache = self._pack_cache
         self._pack_cache = {}
+        self._invalidate_pack_order()
         while pack_cache:
             (name, pack) = pack_cache.popitem()
             pack.close()
@@ -352,6 +717,14 @@ class PackBasedObjectStore(BaseObjectStore):
         :param name: sha for the object.
         :return: tuple with numeric type and object contents.
         """
+        try:
+            return self._get_raw(name)
+        except KeyError:
+            if not self._refresh_on_miss():
+                raise
+        return self._get_raw(name)
+
+    def _get_raw(self, name):
         if len(name) == 40:
             sha = hex_to_sha(name)
             hexsha = name
@@ -360,11 +733,12 @@ class PackBasedObjectStore(BaseObjectStore):
             hexsha = None
         else:
             raise AssertionError("Invalid object name %r" % name)
-        for pack in self.packs:
-            try:
-                return pack.get_raw(sha)
-            except KeyError:
-                pass
+        try:
+            pack, offset = self._find_pack(sha)
+        except KeyError:
+            pass
+        else:
+            return pack.get_raw_at(offset)
         if hexsha is None:
             hexsha = sha_to_hex(name)
         ret = self._get_loose_object(hexsha)
@@ -377,6 +751,92 @@ class PackBasedObjectStore(BaseObjectStore):
                 pass
         raise KeyError(hexsha)
 
+    def iter_raw(self, shas):
+        """Obtain the raw contents of a set of objects.
+
+        Packed objects are retrieved pack by pack, in the order in which they
+        are stored, which keeps reads sequential and lets objects in the same
+        delta chain share the delta base cache. Loose objects and objects in
+        alternates follow.
+
+        :param shas: Iterable over the SHA1s of the objects, either hex or
+            binary
+        :return: Iterator over (hex SHA1, numeric type, chunks) tuples
+        :raise KeyError: If one of the objects is not present; this is raised
+            after all other objects have been yielded
+        """
+        packed, others = self._find_packs(
+            sha_to_hex(sha) if len(sha) == 20 else sha for sha in shas)
+        for pack, by_offset in packed:
+            for offset in sorted(by_offset):
+                type_num, chunks = pack.get_raw_chunks_at(offset)
+                yield by_offset[offset], type_num, chunks
+        missing = []
+        for sha in others:
+            obj = self._get_loose_object(sha)
+            if obj is None:
+                missing.append(sha)
+            else:
+                yield sha, obj.type_num, obj.as_raw_chunks()
+        for alternate in self.alternates:
+            if not missing:
+                break
+            present = set(sha for sha in missing if sha in alternate)
+            for item in alternate.iter_raw(present):
+                yield item
+            missing = [sha for sha in missing if sha not in present]
+        if missing and self._refresh_on_miss():
+            for sha in missing:
+                type_num, raw = self._get_raw(sha)
+                yield sha, type_num, [raw]
+        elif missing:
+            raise KeyError(missing[0])
+
+    def iter_pack_records(self, shas):
+        """Iterate over the records for a pack containing a set of objects.
+
+        Objects stored in one of the packs of this store are copied as they
+        are stored, without decompressing and recompressing them. Deltas are
+        kept if their base is copied from the same pack; all other objects are
+        sent whole.
+
+        :param shas: Iterable over the SHA1s of the objects to include
+        :return: Iterator over records, as taken by write_pack_data
+        """
+        packed, others = self._find_packs(
+            hex_to_sha(sha) if len(sha) == 40 else sha for sha in shas)
+        for pack, by_offset in packed:
+            shas = set(by_offset.values())
+            # Copy in pack order, so delta bases are written before the
+            # objects depending on them and their deltas can use offsets.
+            for offset in sorted(by_offset):
+                sha = by_offset[offset]
+                unpacked = pack.get_unpacked_object(sha, include_comp=True)
+                if unpacked.pack_type_num == OFS_DELTA:
+                    base = by_offset.get(offset - unpacked.delta_base)
+                    if base is not None:
+                        # Refer to the base by SHA; write_pack_data turns
+                        # that back into an offset in the new pack.
+                        unpacked.pack_type_num = REF_DELTA
+                        unpacked.delta_base = base
+                        unpacked.crc32 = None
+                elif unpacked.pack_type_num == REF_DELTA:
+                    if unpacked.delta_base in shas:
+                        base = unpacked.delta_base
+                    else:
+                        base = None
+                else:
+                    yield unpacked
+                    continue
+                if base is not None:
+                    yield unpacked
+                else:
+                    type_num, raw = pack.get_raw(sha)
+                    yield type_num, sha, None, raw
+        for sha in others:
+            type_num, raw = self.get_raw(sha)
+            yield type_num, sha, None, raw
+
     def add_objects(self, objects):
         """Add a set of objects to this object store.
 
@@ -388,7 +848,8 @@ class PackBasedObjectStore(BaseObjectStore):
             return
         f, commit, abort = self.add_pack()
         try:
-            write_pack_objects(f, objects)
+            write_pack_objects(
+                f, objects, compression_level=self.pack_compression_level)
         except:
             abort()
             raise
@@ -396,33 +857,152 @@ class PackBasedObjectStore(BaseObjectStore):
             return commit()
 
 
+def _get_compression_level(config, section, name, default):
+    """Read a zlib compression level from a configuration.
+
+    :param config: Config to read from
+    :param section: Section of the setting
+    :param name: Name of the setting
+    :param default: Level to return if the setting is not present
+    :raise ValueError: if the setting is not a valid compression level
+    """
+    try:
+        value = config.get(section, name)
+    except KeyError:
+        return default
+    level = int(value)
+    if level < -1 or level > 9:
+        raise ValueError("bad zlib compression level %r" % value)
+    return level
+
+
+def _geometric_rollup(sizes, factor):
+    """Find the packs to merge to restore a geometric progression of packs.
+
+    Like git repack --geometric, the smallest packs are merged so that each
+    of the remaining packs has at least factor times as many objects as the
+    next smaller one.
+
+    :param sizes: List of (number of objects, name) tuples
+    :param factor: Factor between the sizes of subsequent packs
+    :return: List with the names of the packs to merge
+    """
+    sizes = sorted(sizes)
+    split = len(sizes) - 1
+    while split > 0 and sizes[split][0] >= factor * sizes[split - 1][0]:
+        split -= 1
+    if split <= 0:
+        return []
+    # The packs up to split break the progression, but the merged pack can
+    # break it with the next larger packs in turn.
+    total = sum(count for (count, name) in sizes[:split + 1])
+    for count, name in sizes[split + 1:]:
+        if count >= factor * total:
+            break
+        total += count
+        split += 1
+    return [name for (count, name) in sizes[:split + 1]]
+
+
 class DiskObjectStore(PackBasedObjectStore):
     """Git-style object store that exists on disk."""
 
-    def __init__(self, path):
+    def __init__(self, path,
+                 delta_base_cache_size=DEFAULT_SHARED_DELTA_BASE_CACHE_SIZE,
+                 index_processes=None, refresh_interval=0,
+                 refresh_on_miss=True,
+                 pack_compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 loose_compression_level=DEFAULT_COMPRESSION_LEVEL):
         """Open an object store.
 
         :param path: Path of the object store.
+        :param delta_base_cache_size: Maximum number of bytes of resolved
+            objects to cache, for all packs (and alternates) together.
+        :param index_processes: Number of worker processes to resolve deltas
+            in when indexing packs that are added, like git's index-pack
+            --threads. None or 1 to index them in the current process.
+        :param refresh_interval: Number of seconds for which to assume that
+            packs and loose objects have not been added or removed by others,
+            before checking their directories again. 0 to check on every
+            access, None to only check when refresh is called.
+        :param refresh_on_miss: Whether to refresh the store and look again
+            before deciding that an object is missing. This keeps lookups of
+            objects added by others correct if refresh_interval is not 0.
+        :param pack_compression_level: zlib compression level for objects
+            written to packs, from 0 (none) to 9 (best), or -1 for the zlib
+            default
+        :param loose_compression_level: zlib compression level for loose
+            objects
         """
         super(DiskObjectStore, self).__init__()
+        self.pack_compression_level = pack_compression_level
+        self.loose_compression_level = loose_compression_level
         self.path = path
+        self.index_processes = index_processes
+        self.refresh_interval = refresh_interval
+        self.refresh_on_miss = refresh_on_miss
         self.pack_dir = os.path.join(self.path, PACKDIR)
         self._pack_cache_time = 0
+        # Number of calls to refresh, and the number at the time of the last
+        # check of the pack directory with the time of that check.
+        self._refresh_count = 0
+        self._pack_cache_checked = None
         self._pack_cache = {}
+        self._midx = None
+        self._bitmap = None
+        self._bitmap_pack = None
+        self._commit_graph = None
+        self._commit_graph_loaded = False
+        # Generation numbers of commits that are not in the commit-graph.
+        self._generations = {}
+        # Listings of the loose object fan-out directories, by directory
+        # path, as tuples with the mtime of the directory, a set of names,
+        # when the directory was last checked and whether the set is known to
+        # be complete.
+        self._loose_listings = {}
         self._alternates = None
+        self.delta_base_cache = DeltaBaseCache(delta_base_cache_size)
 
     def __repr__(self):
         return "<%s(%r)>" % (self.__class__.__name__, self.path)
 
+    @classmethod
+    def from_config(cls, path, config):
+        """Open an object store with the settings from a configuration.
+
+        core.compression sets the compression level for both packs and loose
+        objects; pack.compression and core.loosecompression override it.
+
+        :param path: Path of the object store.
+        :param config: Config to read the settings from
+        """
+        level = _get_compression_level(
+            config, (b'core', ), b'compression', DEFAULT_COMPRESSION_LEVEL)
+        return cls(path,
+            pack_compression_level=_get_compression_level(
+                config, (b'pack', ), b'compression', level),
+            loose_compression_level=_get_compression_level(
+                config, (b'core', ), b'loosecompression', level))
+
     @property
     def alternates(self):
         if self._alternates is not None:
             return self._alternates
         self._alternates = []
         for path in self._read_alternate_paths():
-            self._alternates.append(DiskObjectStore(path))
+            self._alternates.append(self._open_alternate(path))
         return self._alternates
 
+    def _open_alternate(self, path):
+        # Lookups that miss are retried by this store, so alternates don't
+        # need to.
+        alternate = DiskObjectStore(
+            path, refresh_interval=self.refresh_interval,
+            refresh_on_miss=False)
+        # Alternates count towards the delta base cache limit of this store.
+        alternate.delta_base_cache = self.delta_base_cache
+        return alternate
+
     def _read_alternate_paths(self):
         try:
             f = GitFile(os.path.join(self.path, "info", "alternates"),
@@ -463,7 +1043,7 @@ class DiskObjectStore(PackBasedObjectStore):
 
         if not os.path.isabs(path):
             path = os.path.join(self.path, path)
-        self.alternates.append(DiskObjectStore(path))
+        self.alternates.append(self._open_alternate(path))
 
     def _update_pack_cache(self):
         try:
@@ -485,12 +1065,387 @@ class DiskObjectStore(PackBasedObjectStore):
         # Open newly appeared pack files
         for f in pack_files:
             if f not in self._pack_cache:
-                self._pack_cache[f] = Pack(os.path.join(self.pack_dir, f))
+                self._pack_cache[f] = Pack(
+                    os.path.join(self.pack_dir, f),
+                    delta_base_cache=self.delta_base_cache)
         # Remove disappeared pack files
-        for f in set(self._pack_cache) - pack_files:
+        removed = set(self._pack_cache) - pack_files
+        for f in removed:
             self._pack_cache.pop(f).close()
+        if removed:
+            # Objects may have been removed with them.
+            self.commit_cache.clear()
+        self._invalidate_pack_order()
+
+        if self._bitmap is not None:
+            self._bitmap.close()
+            self._bitmap = None
+        # The commit-graph is usually rewritten when packs are, so check
+        # again the next time it is needed.
+        self._close_commit_graph()
+        # Like C git, use the bitmap of a single pack.
+        self._bitmap_pack = None
+        for f in sorted(pack_files):
+            if f + ".bitmap" in pack_dir_contents:
+                self._bitmap_pack = f
+                break
+
+        if self._midx is not None:
+            self._midx.close()
+            self._midx = None
+        if MULTI_PACK_INDEX_FILENAME in pack_dir_contents:
+            self._midx = load_multi_pack_index(
+                os.path.join(self.pack_dir, MULTI_PACK_INDEX_FILENAME))
+            self._midx_packs = set(
+                name[:-len(".idx")] for name in self._midx.pack_names)
+
+    def _find_pack(self, sha):
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        midx = self._midx
+        if midx is None:
+            return super(DiskObjectStore, self)._find_pack(sha)
+        covered = self._midx_packs
+        try:
+            name, offset = midx.object_index(sha)
+        except KeyError:
+            pass
+        else:
+            name = name[:-len(".idx")]
+            pack = self._pack_cache.get(name)
+            if pack is not None:
+                self.pack_hits[name] = self.pack_hits.get(name, 0) + 1
+                return pack, offset
+            # The multi-pack-index is out of date; ignore it.
+            covered = set()
+        for i, (name, pack) in enumerate(self._ordered_packs()):
+            if name in covered:
+                continue
+            try:
+                offset = pack.index.object_index(sha)
+            except KeyError:
+                continue
+            self._record_pack_hit(i)
+            return pack, offset
+        raise KeyError(sha)
+
+    def _find_packs(self, shas):
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        midx = self._midx
+        if midx is None:
+            return self._search_packs(list(shas))
+        covered = self._midx_packs
+        found = {}
+        remaining = []
+        for sha in shas:
+            try:
+                name, offset = midx.object_index(sha)
+            except KeyError:
+                remaining.append(sha)
+                continue
+            name = name[:-len(".idx")]
+            pack = self._pack_cache.get(name)
+            if pack is None:
+                # The multi-pack-index is out of date; ignore it.
+                covered = set()
+                remaining.append(sha)
+                continue
+            found.setdefault(name, (pack, {}))[1][offset] = sha
+        for name in found:
+            self.pack_hits[name] = self.pack_hits.get(name, 0) + 1
+        packed, remaining = self._search_packs(remaining, covered)
+        return [found[name] for name in sorted(found)] + packed, remaining
+
+    def close(self):
+        super(DiskObjectStore, self).close()
+        if self._midx is not None:
+            self._midx.close()
+            self._midx = None
+        if self._bitmap is not None:
+            self._bitmap.close()
+            self._bitmap = None
+        self._close_commit_graph()
+
+    def _close_commit_graph(self):
+        if self._commit_graph is not None:
+            self._commit_graph.close()
+            self._commit_graph = None
+        self._commit_graph_loaded = False
+        self._generations = {}
+
+    def _get_commit_graph(self):
+        """Return the commit-graph of this object store, if any."""
+        if not self._commit_graph_loaded:
+            try:
+                self._commit_graph = load_commit_graph(os.path.join(
+                    self.path, INFODIR, COMMIT_GRAPH_FILENAME))
+            except (OSError, IOError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            self._commit_graph_loaded = True
+        return self._commit_graph
+
+    def get_parents(self, sha):
+        commit_graph = self._get_commit_graph()
+        if commit_graph is not None:
+            try:
+                return commit_graph.get_parents(sha)
+            except KeyError:
+                pass
+        return super(DiskObjectStore, self).get_parents(sha)
+
+    def get_commit_time(self, sha):
+        commit_graph = self._get_commit_graph()
+        if commit_graph is not None:
+            try:
+                return commit_graph.get_commit_time(sha)
+            except KeyError:
+                pass
+        return super(DiskObjectStore, self).get_commit_time(sha)
+
+    def get_commit_tree(self, sha):
+        commit_graph = self._get_commit_graph()
+        if commit_graph is not None:
+            try:
+                return commit_graph.get_tree(sha)
+            except KeyError:
+                pass
+        return super(DiskObjectStore, self).get_commit_tree(sha)
+
+    def _lookup_generation(self, sha):
+        # Looking up parents can reload the pack cache, which closes the
+        # commit-graph.
+        commit_graph = self._get_commit_graph()
+        if commit_graph is None:
+            return None
+        try:
+            generation = commit_graph.get_generation(sha)
+        except KeyError:
+            return None
+        if generation is None:
+            # The commit-graph doesn't record generation numbers, so those
+            # of the descendants of this commit can't be computed cheaply.
+            raise KeyError(sha)
+        return generation
+
+    def get_generation(self, sha):
+        commit_graph = self._get_commit_graph()
+        if commit_graph is None:
+            # Computing generation numbers would mean parsing all history.
+            return super(DiskObjectStore, self).get_generation(sha)
+        try:
+            return commit_graph.get_generation(sha)
+        except KeyError:
+            pass
+        # Commits added since the commit-graph was written usually only have
+        # a few ancestors that are not in it.
+        try:
+            return compute_generation(
+                sha, self.get_parents, self._generations,
+                self._lookup_generation)
+        except KeyError:
+            return None
+
+    def write_commit_graph(self, heads):
+        """Write a commit-graph for the commits reachable from a set of heads.
+
+        :param heads: SHAs of the commits (or tags) to start from, e.g. the
+            values of all refs. SHAs of other objects are ignored.
+        :return: Number of commits in the commit-graph
+        """
+        commits = {}
+        todo = list(heads)
+        while todo:
+            sha = todo.pop()
+            if sha in commits:
+                continue
+            obj = self.peel_sha(sha)
+            if not isinstance(obj, Commit):
+                continue
+            commits[obj.id] = obj
+            todo.extend(obj.parents)
+        with GitFile(os.path.join(self.path, INFODIR, COMMIT_GRAPH_FILENAME),
+                     'wb') as f:
+            write_commit_graph(f, commits.values())
+        self._close_commit_graph()
+        return len(commits)
+
+    def _get_pack_bitmap(self):
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        if self._bitmap is None and self._bitmap_pack is not None:
+            pack = self._pack_cache[self._bitmap_pack]
+            bitmap = load_pack_bitmap(
+                os.path.join(self.pack_dir, self._bitmap_pack + ".bitmap"),
+                pack.index)
+            if bitmap.pack_checksum != pack.index.get_pack_checksum():
+                # The bitmap is for an older version of the pack.
+                bitmap.close()
+                self._bitmap_pack = None
+            else:
+                self._bitmap = bitmap
+        return self._bitmap
+
+    def write_pack_bitmap(self, pack, commits):
+        """Write a bitmap for a pack in this object store.
+
+        :param pack: Pack to write the bitmap for
+        :param commits: SHAs of the commits to store the reachable objects of,
+            e.g. the branch heads. Commits that can reach objects outside the
+            pack are skipped.
+        :return: Number of commits a bitmap was written for
+        """
+        path = pack._basename + ".bitmap"
+        with GitFile(path, 'wb') as f:
+            num_bitmaps, sha = write_pack_bitmap(f, pack, commits)
+        self._update_pack_cache()
+        return num_bitmaps
+
+    def write_multi_pack_index(self):
+        """Write a multi-pack-index for the packs in this object store.
+
+        Objects that are in several packs are looked up in the most recently
+        modified of those packs.
+
+        :return: Number of packs in the multi-pack-index
+        """
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        pack_names = sorted(
+            self._pack_cache,
+            key=lambda name: os.stat(
+                os.path.join(self.pack_dir, name + ".pack")).st_mtime,
+            reverse=True)
+        path = os.path.join(self.pack_dir, MULTI_PACK_INDEX_FILENAME)
+        if not pack_names:
+            if os.path.exists(path):
+                os.remove(path)
+                self._update_pack_cache()
+            return 0
+        with GitFile(path, 'wb') as f:
+            write_multi_pack_index(
+                f, [(name + ".idx", self._pack_cache[name].index)
+                    for name in pack_names])
+        self._update_pack_cache()
+        return len(pack_names)
+
+    def repack(self, geometric=None):
+        """Merge packs and loose objects into a single new pack.
+
+        Packs with a .keep file, as created by Pack.keep, are left alone.
+        Objects are copied as they are stored, without recompressing them,
+        and deltas are kept if their base is copied from the same pack.
+
+        The new pack is moved in before the packs and loose objects it
+        replaces are removed, so the objects remain available throughout.
+        Stores that have the old packs open can keep reading them until they
+        notice the new pack, on platforms that allow removing open files.
+
+        :param geometric: Factor for an incremental repack, like git repack
+            --geometric: only the smallest packs are merged, so that each
+            pack has at least this many times as many objects as the next
+            smaller one. None to merge all packs.
+        :return: The new pack, or None if there was nothing to merge
+        """
+        self._update_pack_cache()
+        candidates = dict(
+            (name, pack) for (name, pack) in self._pack_cache.items()
+            if not os.path.exists(pack._basename + ".keep"))
+        if geometric is None:
+            names = list(candidates)
+        else:
+            names = _geometric_rollup(
+                [(len(pack), name) for (name, pack) in candidates.items()],
+                geometric)
+        loose = list(self._iter_loose_objects())
+        if not loose and len(names) < 2:
+            return None
+        shas = set(loose)
+        for name in names:
+            shas.update(candidates[name])
+
+        fd, path = tempfile.mkstemp(dir=self.pack_dir, suffix=".pack")
+        f = os.fdopen(fd, 'wb')
+        written = False
+        try:
+            entries, pack_sha = write_pack_data(
+                f, len(shas), self.iter_pack_records(shas),
+                compression_level=self.pack_compression_level)
+            f.flush()
+            os.fsync(fd)
+            written = True
+        finally:
+            f.close()
+            if not written:
+                os.remove(path)
+        entries = sorted((sha, offset, crc32)
+                         for (sha, (offset, crc32)) in entries.items())
+        basename = self._get_pack_basepath(entries)
+        if os.path.exists(basename + ".pack"):
+            # One of the packs had all of the objects already.
+            os.remove(path)
+        else:
+            with GitFile(basename + ".idx", "wb") as f:
+                write_pack_index_v2(f, entries, pack_sha)
+            os.rename(path, basename + ".pack")
+
+        new_name = os.path.basename(basename)
+        for name in names:
+            if name == new_name:
+                continue
+            self._pack_cache.pop(name).close()
+            for ext in (".pack", ".idx", ".bitmap"):
+                try:
+                    os.remove(candidates[name]._basename + ext)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        for sha in loose:
+            self._remove_loose_object(sha)
+        outdated_midx = self._midx is not None
+        self._update_pack_cache()
+        if outdated_midx:
+            self.write_multi_pack_index()
+        return self._pack_cache[new_name]
+
+    def refresh(self):
+        """Look for packs and loose objects added or removed by others.
+
+        The directories are checked again on the next access, regardless of
+        the refresh interval.
+        """
+        self._refresh_count += 1
+        if self._alternates is not None:
+            for alternate in self._alternates:
+                alternate.refresh()
+
+    def _refresh_on_miss(self):
+        if not self.refresh_on_miss or self.refresh_interval == 0:
+            # Every access checks the directories already.
+            return False
+        self.refresh()
+        return True
+
+    def _needs_check(self, checked):
+        """Check whether a directory has to be checked for changes again.
+
+        :param checked: Tuple with the refresh count and the time of the last
+            check, or None if it was never checked
+        """
+        if checked is None or self.refresh_interval == 0:
+            return True
+        refresh_count, when = checked
+        if refresh_count != self._refresh_count:
+            return True
+        if self.refresh_interval is None:
+            return False
+        return time.time() - when >= self.refresh_interval
 
     def _pack_cache_stale(self):
+        if not self._needs_check(self._pack_cache_checked):
+            return False
+        self._pack_cache_checked = (self._refresh_count, time.time())
         try:
             return os.stat(self.pack_dir).st_mtime > self._pack_cache_time
         except OSError as e:
@@ -509,7 +1464,62 @@ class DiskObjectStore(PackBasedObjectStore):
             for rest in os.listdir(os.path.join(self.path, base)):
                 yield (base+rest).encode(sys.getfilesystemencoding())
 
+    def _list_loose_dir(self, dir):
+        """List the loose objects in a fan-out directory.
+
+        Listings are cached until the mtime of the directory changes, which
+        is checked as often as refresh_interval says. Given the granularity
+        of mtimes, a file added in the same second as the directory was
+        listed could go unnoticed, so a listing of a directory modified less
+        than a second before is not known to be complete. Such a listing is
+        listed again once the directory is older.
+
+        :param dir: Path of the fan-out directory
+        :return: Tuple with a set with the names of the files in the
+            directory and whether the set is known to be complete
+        """
+        listing = self._loose_listings.get(dir)
+        if listing is not None and not self._needs_check(listing[2]):
+            return listing[1], listing[3]
+        checked = (self._refresh_count, time.time())
+        try:
+            mtime = os.stat(dir).st_mtime
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                self._loose_listings.pop(dir, None)
+                return set(), True
+            raise
+        complete = checked[1] - mtime >= 1
+        if (listing is not None and listing[0] == mtime and
+                (listing[3] or not complete)):
+            self._loose_listings[dir] = (mtime, listing[1], checked,
+                                         listing[3])
+            return listing[1], listing[3]
+        try:
+            names = set(os.listdir(dir))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                self._loose_listings.pop(dir, None)
+                return set(), True
+            raise
+        self._loose_listings[dir] = (mtime, names, checked, complete)
+        return names, complete
+
+    def contains_loose(self, sha):
+        """Check if a particular object is present by SHA1 and is loose.
+
+        This does not check alternates.
+        """
+        path = self._get_shafile_path(sha)
+        dir, name = os.path.split(path)
+        names, complete = self._list_loose_dir(dir)
+        if name in names:
+            return True
+        return not complete and os.path.exists(path)
+
     def _get_loose_object(self, sha):
+        if not self.contains_loose(sha):
+            return None
         path = self._get_shafile_path(sha)
         try:
             return ShaFile.from_path(path)
@@ -519,7 +1529,12 @@ class DiskObjectStore(PackBasedObjectStore):
             raise
 
     def _remove_loose_object(self, sha):
-        os.remove(self._get_shafile_path(sha))
+        path = self._get_shafile_path(sha)
+        os.remove(path)
+        dir, name = os.path.split(path)
+        listing = self._loose_listings.get(dir)
+        if listing is not None:
+            listing[1].discard(name)
 
     def _get_pack_basepath(self, entries):
         suffix = iter_sha1(entry[0] for entry in entries)
@@ -558,7 +1573,9 @@ class DiskObjectStore(PackBasedObjectStore):
             assert len(ext_sha) == 20
             type_num, data = self.get_raw(ext_sha)
             offset = f.tell()
-            crc32 = write_pack_object(f, type_num, data, sha=new_sha)
+            crc32 = write_pack_object(
+                f, type_num, data, sha=new_sha,
+                compression_level=self.pack_compression_level)
             entries.append((ext_sha, offset, crc32))
         pack_sha = new_sha.digest()
         f.write(pack_sha)
@@ -578,7 +1595,8 @@ class DiskObjectStore(PackBasedObjectStore):
             index_file.abort()
 
         # Add the pack to the store and return it.
-        final_pack = Pack(pack_base_name)
+        final_pack = Pack(pack_base_name,
+                          delta_base_cache=self.delta_base_cache)
         final_pack.check_length_and_checksum()
         self._add_known_pack(pack_base_name, final_pack)
         return final_pack
@@ -599,7 +1617,9 @@ class DiskObjectStore(PackBasedObjectStore):
         """
         fd, path = tempfile.mkstemp(dir=self.path, prefix='tmp_pack_')
         with os.fdopen(fd, 'w+b') as f:
-            indexer = PackIndexer(f, resolve_ext_ref=self.get_raw)
+            indexer = PackIndexer(f, resolve_ext_ref=self.get_raw,
+                                  processes=self.index_processes,
+                                  filename=path)
             copier = PackStreamCopier(read_all, read_some, f,
                                       delta_iter=indexer)
             copier.verify()
@@ -614,12 +1634,12 @@ class DiskObjectStore(PackBasedObjectStore):
         :param path: Path to the pack file.
         """
         with PackData(path) as p:
-            entries = p.sorted_entries()
+            entries = p.sorted_entries(processes=self.index_processes)
             basename = self._get_pack_basepath(entries)
             with GitFile(basename+".idx", "wb") as f:
                 write_pack_index_v2(f, entries, p.get_stored_checksum())
         os.rename(path, basename + ".pack")
-        final_pack = Pack(basename)
+        final_pack = Pack(basename, delta_base_cache=self.delta_base_cache)
         self._add_known_pack(basename, final_pack)
         return final_pack
 
@@ -660,7 +1680,10 @@ class DiskObjectStore(PackBasedObjectStore):
         if os.path.exists(path):
             return # Already there, no need to write again
         with GitFile(path, 'wb') as f:
-            f.write(obj.as_legacy_object())
+            f.write(obj.as_legacy_object(self.loose_compression_level))
+        listing = self._loose_listings.get(dir)
+        if listing is not None:
+            listing[1].add(os.path.basename(path))
 
     @classmethod
     def init(cls, path):
@@ -680,6 +1703,7 @@ class MemoryObjectStore(BaseObjectStore):
     def __init__(self):
         super(MemoryObjectStore, self).__init__()
         self._data = {}
+        self._generations = {}
 
     def _to_hexsha(self, sha):
         if len(sha) == 40:
@@ -721,6 +1745,17 @@ class MemoryObjectStore(BaseObjectStore):
     def __delitem__(self, name):
         """Delete an object from this store, for testing only."""
         del self._data[self._to_hexsha(name)]
+        self.commit_cache.clear()
+        self._generations.clear()
+
+    def get_generation(self, sha):
+        # All commits are in memory, so computing the generation numbers is
+        # cheap; they are cached as they never change.
+        try:
+            return compute_generation(
+                self._to_hexsha(sha), self.get_parents, self._generations)
+        except KeyError:
+            return None
 
     def add_object(self, obj):
         """Add a single object to this object store.
@@ -774,7 +1809,8 @@ class MemoryObjectStore(BaseObjectStore):
         for ext_sha in indexer.ext_refs():
             assert len(ext_sha) == 20
             type_num, data = self.get_raw(ext_sha)
-            write_pack_object(f, type_num, data, sha=new_sha)
+            write_pack_object(f, type_num, data, sha=new_sha,
+                              compression_level=self.pack_compression_level)
         pack_sha = new_sha.digest()
         f.write(pack_sha)
 
@@ -843,9 +1879,22 @@ class ObjectStoreIterator(ObjectIterator):
         self._shas = []
 
     def __iter__(self):
-        """Yield tuple with next object and path."""
+        """Yield tuple with next object and path.
+
+        The objects are retrieved from the store in batches, and within a
+        batch in whatever order the store can retrieve them in most cheaply.
+        """
+        batch = {}
         for sha, path in self.itershas():
-            yield self.store[sha], path
+            if len(sha) == 20:
+                sha = sha_to_hex(sha)
+            batch[sha] = path
+            if len(batch) >= _OBJECT_BATCH_SIZE:
+                for o in self.store.get_many(batch):
+                    yield o, batch[o.id]
+                batch = {}
+        for o in self.store.get_many(batch):
+            yield o, batch[o.id]
 
     def iterobjects(self):
         """Iterate over just the objects."""
@@ -904,16 +1953,78 @@ def _collect_filetree_revs(obj_store, tree_sha, kset):
 
     :param obj_store: Object store to get objects by SHA from
     :param tree_sha: tree reference to walk
-    :param kset: set to fill with references to files and directories
+    :param kset: set to fill with binary SHAs of files and directories
     """
     filetree = obj_store[tree_sha]
     for name, mode, sha in filetree.iteritems():
-        if not S_ISGITLINK(mode) and sha not in kset:
-            kset.add(sha)
+        if S_ISGITLINK(mode):
+            continue
+        binsha = hex_to_sha(sha)
+        if binsha not in kset:
+            kset.add(binsha)
             if stat.S_ISDIR(mode):
                 _collect_filetree_revs(obj_store, sha, kset)
 
 
+_INTERESTING = 1
+_UNINTERESTING = 2
+
+
+def _walk_missing_commits(obj_store, have_commits, want_commits):
+    """Find the commits reachable from wants but not from haves.
+
+    Rather than collecting all ancestors of the haves first, wants and haves
+    are walked together in order of decreasing generation number. The walk
+    stops as soon as only commits reachable from the haves are left, so the
+    history below the wants is never visited.
+
+    :param obj_store: Object store to get parents and generation numbers from
+    :param have_commits: SHA1s of commits not to send
+    :param want_commits: SHA1s of commits to send
+    :return: a tuple (A, B) as returned by BaseObjectStore._collect_ancestors,
+        or None if the generation number of one of the commits is not known
+    """
+    flags = {}
+    queue = []
+    # Number of queued commits that are only reachable from the wants.
+    pending = 0
+    heads = ([(sha, _UNINTERESTING) for sha in have_commits] +
+             [(sha, _INTERESTING) for sha in want_commits])
+    missing = set()
+    common = set()
+    while True:
+        for sha, flag in heads:
+            old = flags.get(sha)
+            if old is None:
+                generation = obj_store.get_generation(sha)
+                if generation is None:
+                    return None
+                heapq.heappush(queue, (-generation, sha))
+                flags[sha] = flag
+                if flag == _INTERESTING:
+                    pending += 1
+            elif not old & flag:
+                flags[sha] = old | flag
+                if old == _INTERESTING:
+                    pending -= 1
+        if not pending:
+            common.update(sha for (generation, sha) in queue
+                          if flags[sha] & _INTERESTING)
+            return (missing, common)
+        # All children of a commit have a higher generation number, so its
+        # flags are final by the time it is popped.
+        sha = heapq.heappop(queue)[1]
+        flag = flags[sha]
+        if flag == _INTERESTING:
+            pending -= 1
+            missing.add(sha)
+        else:
+            if flag & _INTERESTING:
+                common.add(sha)
+            flag = _UNINTERESTING
+        heads = [(parent, flag) for parent in obj_store.get_parents(sha)]
+
+
 def _split_commits_and_tags(obj_store, lst, ignore_unknown=False):
     """Split object id list into three lists with commit, tag, and other SHAs.
 
@@ -964,11 +2075,12 @@ class MissingObjectFinder(object):
     :param get_tagged: Function that returns a dict of pointed-to sha -> tag
         sha for including tags.
     :param get_parents: Optional function for getting the parents of a commit.
+        If not given, the object store is asked for the parents.
     :param tagged: dict of pointed-to sha -> tag sha for including tags
     """
 
     def __init__(self, object_store, haves, wants, progress=None,
-                 get_tagged=None, get_parents=lambda commit: commit.parents):
+                 get_tagged=None, get_parents=None):
         self.object_store = object_store
         self._get_parents = get_parents
         # process Commits and Tags differently
@@ -980,36 +2092,52 @@ class MissingObjectFinder(object):
             _split_commits_and_tags(object_store, haves, True))
         want_commits, want_tags, want_others = (
             _split_commits_and_tags(object_store, wants, False))
-        # all_ancestors is a set of commits that shall not be sent
-        # (complete repository up to 'haves')
-        all_ancestors = object_store._collect_ancestors(
-            have_commits, get_parents=self._get_parents)[0]
-        # all_missing - complete set of commits between haves and wants
-        # common - commits from all_ancestors we hit into while
+        # missing_commits - complete set of commits between haves and wants
+        # common_commits - commits reachable from haves we hit into while
         # traversing parent hierarchy of wants
-        missing_commits, common_commits = object_store._collect_ancestors(
-            want_commits, all_ancestors, get_parents=self._get_parents)
+        found = None
+        if get_parents is None:
+            found = _walk_missing_commits(
+                object_store, have_commits, want_commits)
+        if found is None:
+            # all_ancestors is a set of commits that shall not be sent
+            # (complete repository up to 'haves')
+            all_ancestors = object_store._collect_ancestors(
+                have_commits, get_parents=self._get_parents)[0]
+            found = object_store._collect_ancestors(
+                want_commits, all_ancestors, get_parents=self._get_parents)
+        missing_commits, common_commits = found
+        # Binary SHAs of the objects that are done with, either because they
+        # have been sent or because the target has them already.
         self.sha_done = set()
         # Now, fill sha_done with commits and revisions of
         # files and directories known to be both locally
         # and on target. Thus these commits and files
         # won't get selected for fetch
         for h in common_commits:
-            self.sha_done.add(h)
-            cmt = object_store[h]
-            _collect_filetree_revs(object_store, cmt.tree, self.sha_done)
+            self.sha_done.add(hex_to_sha(h))
+            _collect_filetree_revs(object_store,
+                                   object_store.get_commit_tree(h),
+                                   self.sha_done)
         # record tags we have as visited, too
         for t in have_tags:
-            self.sha_done.add(t)
+            self.sha_done.add(hex_to_sha(t))
 
         missing_tags = want_tags.difference(have_tags)
         missing_others = want_others.difference(have_others)
         # in fact, what we 'want' is commits, tags, and others
         # we've found missing
         wants = missing_commits.union(missing_tags)
-        wants = wants.union(missing_others)
+        wants = list(wants.union(missing_others))
 
-        self.objects_to_send = set([(w, None, False) for w in wants])
+        # Objects are sent in the order they are found, which is also the
+        # order in which they are retrieved.
+        self.objects_to_send = collections.deque(
+            [(w, None, False) for w in wants])
+        # Objects retrieved ahead of being sent, by SHA1; at most one batch.
+        self._retrieved = {}
+        # SHA1s of the objects to walk that have not been retrieved yet.
+        self._to_retrieve = collections.deque(wants)
 
         if progress is None:
             self.progress = lambda x: None
@@ -1018,18 +2146,63 @@ class MissingObjectFinder(object):
         self._tagged = get_tagged and get_tagged() or {}
 
     def add_todo(self, entries):
-        self.objects_to_send.update([e for e in entries
-                                     if not e[0] in self.sha_done])
+        entries = [e for e in entries if not self.is_done(e[0])]
+        self.objects_to_send.extend(entries)
+        self._to_retrieve.extend(
+            sha for (sha, name, leaf) in entries if not leaf)
+
+    def is_done(self, sha):
+        """Check whether an object has been sent or is known to the target.
+
+        :param sha: Hex SHA1 of the object
+        """
+        return hex_to_sha(sha) in self.sha_done
+
+    def _retrieve(self, sha):
+        """Retrieve an object to send, along with others that are pending.
+
+        Rather than retrieving the objects to walk one by one, up to
+        _OBJECT_BATCH_SIZE of them are retrieved at once with get_many.
+        """
+        try:
+            return self._retrieved.pop(sha)
+        except KeyError:
+            pass
+        # Objects are walked in the order they were queued in, so whatever is
+        # left of the previous batch will not be asked for anymore.
+        self._retrieved.clear()
+        batch = set([sha])
+        pending = self._to_retrieve
+        while pending and len(batch) < _OBJECT_BATCH_SIZE:
+            other = pending.popleft()
+            if other not in self._retrieved and not self.is_done(other):
+                batch.add(other)
+        try:
+            for o in self.object_store.get_many(batch):
+                self._retrieved[o.id] = o
+        except KeyError:
+            # Retrieve the rest one by one, so that a missing object only
+            # causes an error once it is needed.
+            for other in batch:
+                if other in self._retrieved:
+                    continue
+                try:
+                    self._retrieved[other] = self.object_store[other]
+                except KeyError:
+                    if other == sha:
+                        raise
+        return self._retrieved.pop(sha)
 
     def next(self):
         while True:
             if not self.objects_to_send:
                 return None
-            (sha, name, leaf) = self.objects_to_send.pop()
-            if sha not in self.sha_done:
+            (sha, name, leaf) = self.objects_to_send.popleft()
+            if not self.is_done(sha):
                 break
+            self._retrieved.pop(sha, None)
         if not leaf:
-            o = self.object_store[sha]
+            o = self._retrieve(sha)
             if isinstance(o, Commit):
                 self.add_todo([(o.tree, "", False)])
             elif isinstance(o, Tree):
@@ -1038,9 +2211,11 @@ class MissingObjectFinder(object):
                                if not S_ISGITLINK(m)])
             elif isinstance(o, Tag):
                 self.add_todo([(o.object[1], None, False)])
+        else:
+            self._retrieved.pop(sha, None)
         if sha in self._tagged:
             self.add_todo([(self._tagged[sha], None, True)])
-        self.sha_done.add(sha)
+        self.sha_done.add(hex_to_sha(sha))
         self.progress("counting objects: %d\r" % len(self.sha_done))
         return (sha, name)
 
@@ -151,6 +151,21 @@ def serializable_property(name, docstring=None):
     return property(get, set, doc=docstring)
 
 
+def _header_property(name, docstring=None):
+    """A serializable_property for a field that is available before parsing.
+
+    Reading the property does not require the object to be fully parsed.
+    """
+    def set(obj, value):
+        obj._ensure_parsed()
+        setattr(obj, "_"+name, value)
+        obj._needs_serialization = True
+
+    def get(obj):
+        return getattr(obj, "_"+name)
+    return property(get, set, doc=docstring)
+
+
 def object_class(type):
     """Get the object class corresponding to the given type.
 
@@ -252,30 +267,33 @@ class ShaFile(object):
             raise ObjectFormatException("Invalid object header, no \\0")
         self.set_raw_string(text[header_end+1:])
 
-    def as_legacy_object_chunks(self):
+    def as_legacy_object_chunks(self, compression_level=-1):
         """Return chunks representing the object in the experimental format.
 
+        :param compression_level: zlib compression level, from 0 (none) to 9
+            (best), or -1 for the zlib default
         :return: List of strings
         """
-        compobj = zlib.compressobj()
+        compobj = zlib.compressobj(compression_level)
         yield compobj.compress(self._header())
         for chunk in self.as_raw_chunks():
             yield compobj.compress(chunk)
         yield compobj.flush()
 
-    def as_legacy_object(self):
+    def as_legacy_object(self, compression_level=-1):
         """Return string representing the object in the experimental format.
+
+        :param compression_level: zlib compression level; see
+            as_legacy_object_chunks
         """
-        return b''.join(self.as_legacy_object_chunks())
+        return b''.join(self.as_legacy_object_chunks(compression_level))
 
     def as_raw_chunks(self):
         """Return chunks with serialization of the object.
 
         :return: List of strings, not necessarily one per line
         """
-        if self._needs_parsing:
-            self._ensure_parsed()
-        elif self._needs_serialization:
+        if self._needs_serialization:
             self._chunked_text = self._serialize()
             self._needs_serialization = False
         return self._chunked_text
@@ -447,6 +465,7 @@ class ShaFile(object):
         old_sha = self.id
         try:
             self._deserialize(self.as_raw_chunks())
+            self._needs_parsing = False
             self._sha = None
             new_sha = self.id
         except Exception as e:
@@ -1015,6 +1034,40 @@ def format_timezone(offset, unnecessary_negative_timezone=False):
     return ('%c%02d%02d' % (sign, offset / 3600, (offset / 60) % 60)).encode('ascii')
 
 
+def parse_commit_header(chunks):
+    """Parse the tree, parents and commit time of a commit object from chunks.
+
+    This only looks at the header lines up to and including the committer,
+    which makes it a lot cheaper than parse_commit.
+
+    :param chunks: Chunks to parse
+    :return: Tuple of (tree, parents, commit_time)
+    """
+    text = b''.join(chunks)
+    tree = None
+    parents = []
+    commit_time = None
+    start = 0
+    while start < len(text):
+        end = text.find(b'\n', start)
+        if end < 0:
+            end = len(text)
+        field, _, value = text[start:end].partition(b' ')
+        if not field:
+            # Empty line indicates end of headers
+            break
+        if field == _TREE_HEADER:
+            tree = value
+        elif field == _PARENT_HEADER:
+            parents.append(value)
+        elif field == _COMMITTER_HEADER:
+            committer, timetext, timezonetext = value.rsplit(b' ', 2)
+            commit_time = int(timetext)
+            break
+        start = end + 1
+    return tree, parents, commit_time
+
+
 def parse_commit(chunks):
     """Parse a commit object from chunks.
 
@@ -1089,6 +1142,23 @@ class Commit(ShaFile):
             raise NotCommitError(path)
         return commit
 
+    def set_raw_chunks(self, chunks, sha=None):
+        """Set the contents of this commit from a list of chunks.
+
+        Only the tree, parents and commit time are parsed right away, as they
+        are all that is needed to walk history; the rest of the commit is
+        parsed when it is first accessed.
+        """
+        self._chunked_text = chunks
+        (self._tree, self._parents, self._commit_time) = (
+            parse_commit_header(chunks))
+        if sha is None:
+            self._sha = None
+        else:
+            self._sha = FixedSha(sha)
+        self._needs_parsing = True
+        self._needs_serialization = False
+
     def _deserialize(self, chunks):
         (self._tree, self._parents, author_info, commit_info, self._encoding,
                 self._mergetag, self._gpgsig, self._message, self._extra) = (
@@ -1174,12 +1244,11 @@ class Commit(ShaFile):
         chunks.append(self._message)
         return chunks
 
-    tree = serializable_property(
+    tree = _header_property(
         "tree", "Tree that is the state of this commit")
 
     def _get_parents(self):
         """Return a list of parents of this commit."""
-        self._ensure_parsed()
         return self._parents
 
     def _set_parents(self, value):
@@ -1211,7 +1280,7 @@ class Commit(ShaFile):
     message = serializable_property(
         "message", "The commit message")
 
-    commit_time = serializable_property("commit_time",
+    commit_time = _header_property("commit_time",
         "The timestamp of the commit. As the number of seconds since the epoch.")
 
     commit_timezone = serializable_property("commit_timezone",
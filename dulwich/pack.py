@@ -37,10 +37,12 @@ from io import BytesIO, UnsupportedOperation
 from collections import (
     deque,
     )
-import difflib
 import struct
 
 from itertools import chain
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
 try:
     from itertools import imap, izip
 except ImportError:
@@ -48,8 +50,22 @@ except ImportError:
     imap = map
     izip = zip
 
+try:
+    _buffer = buffer
+except NameError:
+    # Python3
+    def _buffer(data, offset, size):
+        return memoryview(data)[offset:offset+size]
+
 import os
 import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    # Python2
+    import Queue as queue
 
 try:
     import mmap
@@ -94,6 +110,15 @@ DELTA_TYPES = (OFS_DELTA, REF_DELTA)
 
 DEFAULT_PACK_DELTA_WINDOW_SIZE = 10
 
+# zlib compression level to use by default, like git's core.compression:
+# -1 for the zlib default, 0 for no compression up to 9 for the best.
+DEFAULT_COMPRESSION_LEVEL = -1
+
+# Size of the chunks iter_pack_data produces, and the number of chunks it
+# produces ahead of its consumer.
+DEFAULT_PACK_CHUNK_SIZE = 64 * 1024
+DEFAULT_PACK_PIPELINE_DEPTH = 16
+
 
 def take_msb_bytes(read, crc32=None):
     """Read bytes marked with most significant bit.
@@ -274,23 +299,33 @@ def load_pack_index(path):
         return load_pack_index_file(path, f)
 
 
-def _load_file_contents(f, size=None):
+def _map_file_contents(f, size=None):
+    """Memory-map the contents of a file, if possible.
+
+    :param f: File-like object
+    :param size: Optional size of the file
+    :return: A read-only mmap object, or None if the file can not be mapped
+    """
+    if not has_mmap:
+        return None
     try:
         fd = f.fileno()
     except (UnsupportedOperation, AttributeError):
-        fd = None
+        return None
+    if size is None:
+        size = os.fstat(fd).st_size
+    try:
+        return mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+    except (mmap.error, OverflowError, ValueError):
+        # Perhaps a socket, or too large for the address space?
+        return None
+
+
+def _load_file_contents(f, size=None):
     # Attempt to use mmap if possible
-    if fd is not None:
-        if size is None:
-            size = os.fstat(fd).st_size
-        if has_mmap:
-            try:
-                contents = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
-            except mmap.error:
-                # Perhaps a socket?
-                pass
-            else:
-                return contents, size
+    contents = _map_file_contents(f, size)
+    if contents is not None:
+        return contents, len(contents)
     contents = f.read()
     size = len(contents)
     return contents, size
@@ -398,6 +433,40 @@ class PackIndex(object):
         """
         raise NotImplementedError(self._object_index)
 
+    def lookup_many(self, shas):
+        """Look up the offsets of a number of objects at once.
+
+        :param shas: Iterable over SHAs, either hex or binary
+        :return: Dictionary mapping the SHAs of the objects that are in this
+            index, as given, to their offsets in the packfile
+        """
+        ret = {}
+        for sha in shas:
+            try:
+                ret[sha] = self.object_index(sha)
+            except KeyError:
+                pass
+        return ret
+
+    def object_crc32(self, sha):
+        """Return the CRC32 checksum stored for an object.
+
+        :param sha: SHA of the object, either hex or binary
+        :return: CRC32 of the packed object, or None if the index does not
+            store checksums
+        :raise KeyError: If the object is not in this index
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        return self._object_crc32(sha)
+
+    def _object_crc32(self, sha):
+        """See object_crc32.
+
+        :param sha: A *binary* SHA string. (20 characters long)_
+        """
+        raise NotImplementedError(self._object_crc32)
+
     def objects_sha1(self):
         """Return the hex SHA1 over all the shas of all objects in this pack.
 
@@ -421,7 +490,7 @@ class MemoryPackIndex(PackIndex):
         """
         self._by_sha = {}
         for name, idx, crc32 in entries:
-            self._by_sha[name] = idx
+            self._by_sha[name] = (idx, crc32)
         self._entries = entries
         self._pack_checksum = pack_checksum
 
@@ -434,6 +503,9 @@ class MemoryPackIndex(PackIndex):
     def _object_index(self, sha):
         return self._by_sha[sha][0]
 
+    def _object_crc32(self, sha):
+        return self._by_sha[sha][1]
+
     def _itersha(self):
         return iter(self._by_sha)
 
@@ -521,11 +593,7 @@ class FilePackIndex(PackIndex):
             yield self._unpack_entry(i)
 
     def _read_fan_out_table(self, start_offset):
-        ret = []
-        for i in range(0x100):
-            fanout_entry = self._contents[start_offset+i*4:start_offset+(i+1)*4]
-            ret.append(struct.unpack('>L', fanout_entry)[0])
-        return ret
+        return list(unpack_from('>256L', self._contents, start_offset))
 
     def check(self):
         """Check that the stored checksum matches the actual checksum."""
@@ -555,10 +623,12 @@ class FilePackIndex(PackIndex):
         """
         return bytes(self._contents[-20:])
 
-    def _object_index(self, sha):
-        """See object_index.
+    def _object_position(self, sha):
+        """Find the position of an object in this index.
 
         :param sha: A *binary* SHA string. (20 characters long)_
+        :return: Index of the entry for the object
+        :raise KeyError: If the object is not in this index
         """
         assert len(sha) == 20
         idx = ord(sha[:1])
@@ -570,7 +640,64 @@ class FilePackIndex(PackIndex):
         i = bisect_find_sha(start, end, sha, self._unpack_name)
         if i is None:
             raise KeyError(sha)
-        return self._unpack_offset(i)
+        return i
+
+    def lookup_many(self, shas):
+        """Look up the offsets of a number of objects at once.
+
+        The SHAs are looked up in sorted order, so that each search only has
+        to cover the part of the name table after the previous match, within
+        the range given by the fan-out table.
+
+        :param shas: Iterable over SHAs, either hex or binary
+        :return: Dictionary mapping the SHAs of the objects that are in this
+            index, as given, to their offsets in the packfile
+        """
+        queries = []
+        for sha in shas:
+            if len(sha) == 40:
+                queries.append((hex_to_sha(sha), sha))
+            else:
+                queries.append((sha, sha))
+        queries.sort()
+        fan_out_table = self._fan_out_table
+        unpack_name = self._unpack_name
+        ret = {}
+        position = 0
+        for binsha, sha in queries:
+            idx = ord(binsha[:1])
+            if idx == 0:
+                start = 0
+            else:
+                start = fan_out_table[idx-1]
+            start = max(start, position)
+            end = fan_out_table[idx]
+            # Find the first name that is not smaller than the SHA.
+            while start < end:
+                i = (start + end) // 2
+                if unpack_name(i) < binsha:
+                    start = i + 1
+                else:
+                    end = i
+            position = start
+            if (start < fan_out_table[idx] and
+                    unpack_name(start) == binsha):
+                ret[sha] = self._unpack_offset(start)
+        return ret
+
+    def _object_index(self, sha):
+        """See object_index.
+
+        :param sha: A *binary* SHA string. (20 characters long)_
+        """
+        return self._unpack_offset(self._object_position(sha))
+
+    def _object_crc32(self, sha):
+        """See object_crc32.
+
+        :param sha: A *binary* SHA string. (20 characters long)_
+        """
+        return self._unpack_crc32_checksum(self._object_position(sha))
 
 
 class PackIndex1(FilePackIndex):
@@ -617,6 +744,15 @@ class PackIndex2(FilePackIndex):
         self._pack_offset_largetable_offset = (self._pack_offset_table_offset +
                                           4 * len(self))
 
+    @property
+    def sha_table(self):
+        """The sorted table of binary SHAs, 20 bytes each.
+
+        This is a view on the index contents rather than a copy; it can not be
+        used after the index is closed.
+        """
+        return _buffer(self._contents, self._name_table_offset, 20 * len(self))
+
     def _unpack_entry(self, i):
         return (self._unpack_name(i), self._unpack_offset(i),
                 self._unpack_crc32_checksum(i))
@@ -735,6 +871,69 @@ def _compute_object_size(value):
     return chunks_length(obj)
 
 
+# Default size of the delta base cache of a single pack.
+DEFAULT_DELTA_BASE_CACHE_SIZE = 20 * 1024 * 1024
+
+# Default size of a delta base cache shared by all packs of an object store;
+# the same as the default for core.deltaBaseCacheLimit in C git.
+DEFAULT_SHARED_DELTA_BASE_CACHE_SIZE = 96 * 1024 * 1024
+
+
+class DeltaBaseCache(LRUSizeCache):
+    """Cache of resolved objects, which can be shared between packs.
+
+    Keys are (PackData, offset) tuples. The use of the cache is tracked in
+    the hits, misses and evictions counters.
+    """
+
+    def __init__(self, max_size=DEFAULT_DELTA_BASE_CACHE_SIZE):
+        """Create a new DeltaBaseCache.
+
+        :param max_size: Maximum number of bytes of objects to keep
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        super(DeltaBaseCache, self).__init__(
+            max_size, compute_size=_compute_object_size)
+
+    def get(self, key, default=None):
+        node = self._cache.get(key, None)
+        if node is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._record_access(node)
+        return node.value
+
+    def cleanup(self):
+        count = len(self._cache)
+        super(DeltaBaseCache, self).cleanup()
+        self.evictions += count - len(self._cache)
+
+    def remove_pack_data(self, data):
+        """Remove the objects of a pack from the cache.
+
+        :param data: PackData to remove the objects of
+        """
+        for key in [key for key in self._cache if key[0] is data]:
+            self._remove_node(self._cache[key])
+
+    def stats(self):
+        """Return statistics about this cache.
+
+        :return: Dictionary with the hits, misses and evictions counters and
+            the current and maximum size of the cache in bytes
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': self._value_size,
+            'max_size': self._max_size,
+            }
+
+
 class PackStreamReader(object):
     """Class to read a pack stream.
 
@@ -974,16 +1173,25 @@ class PackData(object):
     Currently there are no integrity checks done. Also no attempt is made to
     try and detect the delta case, or a request for an object at the wrong
     position.  It will all just throw a zlib or KeyError.
+
+    If the underlying file can be memory-mapped, random access reads
+    decompress directly from the mapped pack rather than seeking and reading
+    the file.
     """
 
-    def __init__(self, filename, file=None, size=None):
+    def __init__(self, filename, file=None, size=None, use_mmap=True,
+                 delta_base_cache=None):
         """Create a PackData object representing the pack in the given filename.
 
         The file must exist and stay readable until the object is disposed of. It
         must also stay the same size. It will be mapped whenever needed.
 
-        Currently there is a restriction on the size of the pack as the python
-        mmap implementation is flawed.
+        :param use_mmap: Whether to memory-map the pack for random access reads,
+            if possible. Falls back to regular file reads if the file can not
+            be mapped (e.g. because it is not a real file, or because the pack
+            is too large for the address space).
+        :param delta_base_cache: DeltaBaseCache to keep resolved objects in;
+            by default a cache private to this pack is used.
         """
         self._filename = filename
         self._size = size
@@ -992,9 +1200,15 @@ class PackData(object):
             self._file = GitFile(self._filename, 'rb')
         else:
             self._file = file
+        self._contents = None
+        if use_mmap:
+            self._contents = _map_file_contents(self._file, size)
+            if self._contents is not None and self._size is None:
+                self._size = len(self._contents)
         (version, self._num_objects) = read_pack_header(self._file.read)
-        self._offset_cache = LRUSizeCache(1024*1024*20,
-            compute_size=_compute_object_size)
+        if delta_base_cache is None:
+            delta_base_cache = DeltaBaseCache()
+        self._delta_base_cache = delta_base_cache
         self.pack = None
 
     @property
@@ -1010,6 +1224,11 @@ class PackData(object):
         return cls(filename=path)
 
     def close(self):
+        # A shared cache would otherwise keep this object alive.
+        self._delta_base_cache.remove_pack_data(self)
+        if self._contents is not None:
+            self._contents.close()
+            self._contents = None
         self._file.close()
 
     def __enter__(self):
@@ -1041,7 +1260,6 @@ class PackData(object):
 
     def get_ref(self, sha):
         """Get the object for a ref SHA, only looking in this pack."""
-        # TODO: cache these results
         if self.pack is None:
             raise KeyError(sha)
         try:
@@ -1051,7 +1269,12 @@ class PackData(object):
         if offset:
             type, obj = self.get_object_at(offset)
         elif self.pack is not None and self.pack.resolve_ext_ref:
-            type, obj = self.pack.resolve_ext_ref(sha)
+            # External objects are cached by SHA rather than by offset.
+            cached = self._delta_base_cache.get((self, sha))
+            if cached is None:
+                cached = self.pack.resolve_ext_ref(sha)
+                self._delta_base_cache.add((self, sha), cached)
+            type, obj = cached
         else:
             raise KeyError(sha)
         return offset, type, obj
@@ -1059,6 +1282,10 @@ class PackData(object):
     def resolve_object(self, offset, type, obj, get_ref=None):
         """Resolve an object, possibly resolving deltas when necessary.
 
+        The delta chain is followed down to the first base that is either
+        cached or not a delta, after which the deltas are applied one after
+        the other. Every object resolved along the way is cached.
+
         :return: Tuple with object type and contents.
         """
         if type not in DELTA_TYPES:
@@ -1066,27 +1293,32 @@ class PackData(object):
 
         if get_ref is None:
             get_ref = self.get_ref
-        if type == OFS_DELTA:
-            (delta_offset, delta) = obj
-            # TODO: clean up asserts and replace with nicer error messages
-            assert isinstance(offset, int) or isinstance(offset, long)
-            assert isinstance(delta_offset, int) or isinstance(offset, long)
-            base_offset = offset-delta_offset
-            type, base_obj = self.get_object_at(base_offset)
-            assert isinstance(type, int)
-        elif type == REF_DELTA:
-            (basename, delta) = obj
-            assert isinstance(basename, bytes) and len(basename) == 20
-            base_offset, type, base_obj = get_ref(basename)
-            assert isinstance(type, int)
-        type, base_chunks = self.resolve_object(base_offset, type, base_obj)
-        chunks = apply_delta(base_chunks, delta)
-        # TODO(dborowitz): This can result in poor performance if large base
-        # objects are separated from deltas in the pack. We should reorganize
-        # so that we apply deltas to all objects in a chain one after the other
-        # to optimize cache performance.
-        if offset is not None:
-            self._offset_cache[offset] = type, chunks
+        # Offsets and deltas of the objects still to be resolved, starting
+        # with the one requested.
+        delta_stack = []
+        base_offset = offset
+        while type in DELTA_TYPES:
+            delta_offset = base_offset
+            if type == OFS_DELTA:
+                (relative_offset, delta) = obj
+                # TODO: clean up asserts and replace with nicer error messages
+                assert (isinstance(relative_offset, int) or
+                        isinstance(relative_offset, long))
+                base_offset = delta_offset - relative_offset
+                type, obj = self.get_object_at(base_offset)
+                assert isinstance(type, int)
+            elif type == REF_DELTA:
+                (basename, delta) = obj
+                assert isinstance(basename, bytes) and len(basename) == 20
+                base_offset, type, obj = get_ref(basename)
+                assert isinstance(type, int)
+            delta_stack.append((delta_offset, delta))
+
+        chunks = obj
+        for delta_offset, delta in reversed(delta_stack):
+            chunks = apply_delta(chunks, delta)
+            if delta_offset is not None:
+                self._delta_base_cache.add((self, delta_offset), (type, chunks))
         return type, chunks
 
     def iterobjects(self, progress=None, compute_crc32=True):
@@ -1117,31 +1349,36 @@ class PackData(object):
             yield unpacked
             self._file.seek(-len(unused), SEEK_CUR)  # Back up over unused data.
 
-    def iterentries(self, progress=None):
+    def iterentries(self, progress=None, processes=None):
         """Yield entries summarizing the contents of this pack.
 
         :param progress: Progress function, called with current and total
             object count.
+        :param processes: Number of worker processes to resolve deltas in;
+            see DeltaChainIterator. The entries are not yielded in pack
+            order if this is more than 1.
         :return: iterator of tuples with (sha, offset, crc32)
         """
         num_objects = self._num_objects
         resolve_ext_ref = (
             self.pack.resolve_ext_ref if self.pack is not None else None)
         indexer = PackIndexer.for_pack_data(
-            self, resolve_ext_ref=resolve_ext_ref)
+            self, resolve_ext_ref=resolve_ext_ref, processes=processes)
         for i, result in enumerate(indexer):
             if progress is not None:
                 progress(i, num_objects)
             yield result
 
-    def sorted_entries(self, progress=None):
+    def sorted_entries(self, progress=None, processes=None):
         """Return entries in this pack, sorted by SHA.
 
         :param progress: Progress function, called with current and total
             object count
+        :param processes: Number of worker processes to resolve deltas in;
+            see DeltaChainIterator.
         :return: List of tuples with (sha, offset, crc32)
         """
-        ret = list(self.iterentries(progress=progress))
+        ret = list(self.iterentries(progress=progress, processes=processes))
         ret.sort()
         return ret
 
@@ -1184,6 +1421,8 @@ class PackData(object):
 
     def get_stored_checksum(self):
         """Return the expected checksum stored in this pack."""
+        if self._contents is not None:
+            return self._contents[-20:]
         self._file.seek(-20, SEEK_END)
         return self._file.read(20)
 
@@ -1201,15 +1440,60 @@ class PackData(object):
         and then the packfile can be asked directly for that object using this
         function.
         """
-        try:
-            return self._offset_cache[offset]
-        except KeyError:
-            pass
-        assert offset >= self._header_size
-        self._file.seek(offset)
-        unpacked, _ = unpack_object(self._file.read)
+        cached = self._delta_base_cache.get((self, offset))
+        if cached is not None:
+            return cached
+        unpacked = self.get_unpacked_object_at(offset)
         return (unpacked.pack_type_num, unpacked._obj())
 
+    def get_unpacked_object_at(self, offset, include_comp=False):
+        """Read the object stored at an offset, without resolving deltas.
+
+        :param offset: Offset of the object in the pack
+        :param include_comp: If True, include the compressed data as it is
+            stored in the pack, so it can be copied to another pack as-is.
+        :return: UnpackedObject with offset, pack_type_num, delta_base,
+            decomp_chunks, decomp_len and, if include_comp is True,
+            comp_chunks set
+        """
+        assert offset >= self._header_size
+        if self._contents is not None:
+            unpacked, _ = self._unpack_mapped(
+                offset, include_comp=include_comp)
+        else:
+            self._file.seek(offset)
+            unpacked, _ = unpack_object(
+                self._file.read, include_comp=include_comp)
+        unpacked.offset = offset
+        return unpacked
+
+    def _unpack_mapped(self, offset, include_comp=False, **kwargs):
+        """Unpack the object at offset from the memory-mapped pack.
+
+        Compressed data is handed to zlib as zero-copy slices of the map,
+        unless it is to be included in the result; those chunks have to
+        outlive the map. Keyword arguments are passed on to unpack_object.
+        """
+        contents = self._contents
+        # Current read position; a list so the closures below can update it.
+        pos = [offset]
+
+        def read_all(size):
+            start = pos[0]
+            pos[0] += size
+            return contents[start:start+size]
+
+        if include_comp:
+            read_some = read_all
+        else:
+            def read_some(size):
+                start = pos[0]
+                pos[0] += size
+                return _buffer(contents, start, size)
+
+        return unpack_object(read_all, read_some, include_comp=include_comp,
+                             **kwargs)
+
 
 class DeltaChainIterator(object):
     """Abstract iterator over pack data based on delta chains.
@@ -1235,9 +1519,26 @@ class DeltaChainIterator(object):
     _compute_crc32 = False
     _include_comp = False
 
-    def __init__(self, file_obj, resolve_ext_ref=None):
+    def __init__(self, file_obj, resolve_ext_ref=None, processes=None,
+                 filename=None):
+        """Create a new delta chain iterator.
+
+        :param file_obj: File object to read the pack from
+        :param resolve_ext_ref: Function to look up objects outside the pack
+            by SHA, for thin packs
+        :param processes: Number of worker processes to resolve delta chains
+            in, like git's index-pack --threads. None or 1 to resolve them
+            in the current process. Results then have to be picklable, and
+            are not produced in chain order.
+        :param filename: Path of the pack file, for the worker processes to
+            open; required if processes is more than 1
+        """
+        if processes is not None and processes > 1 and filename is None:
+            raise ValueError('a filename is required to use processes')
         self._file = file_obj
         self._resolve_ext_ref = resolve_ext_ref
+        self._processes = processes
+        self._filename = filename
         self._pending_ofs = defaultdict(list)
         self._pending_ref = defaultdict(list)
         self._full_ofs = []
@@ -1245,8 +1546,9 @@ class DeltaChainIterator(object):
         self._ext_refs = []
 
     @classmethod
-    def for_pack_data(cls, pack_data, resolve_ext_ref=None):
-        walker = cls(None, resolve_ext_ref=resolve_ext_ref)
+    def for_pack_data(cls, pack_data, resolve_ext_ref=None, processes=None):
+        walker = cls(None, resolve_ext_ref=resolve_ext_ref,
+                     processes=processes, filename=pack_data._filename)
         walker.set_pack_data(pack_data)
         for unpacked in pack_data._iter_unpacked():
             walker.record(unpacked)
@@ -1267,6 +1569,10 @@ class DeltaChainIterator(object):
         self._file = pack_data._file
 
     def _walk_all_chains(self):
+        if self._processes is not None and self._processes > 1:
+            for result in self._walk_all_chains_parallel():
+                yield result
+            return
         for offset, type_num in self._full_ofs:
             for result in self._follow_chain(offset, type_num, None):
                 yield result
@@ -1301,6 +1607,78 @@ class DeltaChainIterator(object):
 
         self._ensure_no_pending()
 
+    def _walk_all_chains_parallel(self):
+        """Walk the delta chains in worker processes.
+
+        Each chain starting at a full object in the pack is resolved by a
+        single worker, which has its own copy of the pending deltas. Chains
+        starting at external refs are resolved in a second round, once it is
+        known which of the pending REF_DELTA bases are not in the pack.
+        """
+        # The workers open the file by name; make sure they see all of it.
+        self._file.flush()
+        pool = multiprocessing.Pool(
+            self._processes, _init_chain_worker,
+            (self.__class__, self._filename, self._pending_ofs,
+             self._pending_ref))
+        seen = set()
+        shas = set()
+        completed = False
+        try:
+            work = [(offset, type_num, None)
+                    for (offset, type_num) in self._full_ofs]
+            for result in self._run_chain_workers(pool, work, seen, shas):
+                yield result
+            if not self._resolve_ext_ref:
+                self._ensure_no_pending()
+            else:
+                work = []
+                ext_refs = []
+                for base_sha, pending in sorted(self._pending_ref.items()):
+                    try:
+                        type_num, chunks = self._resolve_ext_ref(base_sha)
+                    except KeyError:
+                        # Not an external ref, but may depend on one.
+                        continue
+                    ext_refs.append(base_sha)
+                    work.extend((offset, type_num, chunks)
+                                for offset in pending)
+                for result in self._run_chain_workers(pool, work, seen, shas):
+                    yield result
+                for base_sha in ext_refs:
+                    self._pending_ref.pop(base_sha, None)
+                    # Bases that turned out to be in the pack after all are
+                    # not external refs.
+                    if base_sha not in shas:
+                        self._ext_refs.append(base_sha)
+                self._ensure_no_pending()
+            completed = True
+        finally:
+            if completed:
+                # Let the workers exit by themselves, so they close the pack.
+                pool.close()
+            else:
+                # Failed or abandoned by the caller; the workers' pack files
+                # are closed when they are killed.
+                pool.terminate()
+            pool.join()
+        assert not self._pending_ofs
+
+    def _run_chain_workers(self, pool, work, seen, shas):
+        chunksize = max(1, min(256, len(work) // (self._processes * 4)))
+        for results in pool.imap_unordered(
+                _walk_chain_worker, work, chunksize):
+            for offset, sha, result in results:
+                # Objects that are a delta against an object that is in the
+                # pack several times are resolved once for every copy.
+                if offset in seen:
+                    continue
+                seen.add(offset)
+                shas.add(sha)
+                self._pending_ofs.pop(offset, None)
+                self._pending_ref.pop(sha, None)
+                yield result
+
     def _result(self, unpacked):
         return unpacked
 
@@ -1320,17 +1698,22 @@ class DeltaChainIterator(object):
         return unpacked
 
     def _follow_chain(self, offset, obj_type_num, base_chunks):
+        for unpacked in self._follow_chain_unpacked(
+                offset, obj_type_num, base_chunks):
+            yield self._result(unpacked)
+
+    def _follow_chain_unpacked(self, offset, obj_type_num, base_chunks):
         # Unlike PackData.get_object_at, there is no need to cache offsets as
         # this approach by design inflates each object exactly once.
         unpacked = self._resolve_object(offset, obj_type_num, base_chunks)
-        yield self._result(unpacked)
+        yield unpacked
 
         pending = chain(self._pending_ofs.pop(unpacked.offset, []),
                         self._pending_ref.pop(unpacked.sha(), []))
         for new_offset in pending:
-            for new_result in self._follow_chain(
+            for new_unpacked in self._follow_chain_unpacked(
               new_offset, unpacked.obj_type_num, unpacked.obj_chunks):
-                yield new_result
+                yield new_unpacked
 
     def __iter__(self):
         return self._walk_all_chains()
@@ -1339,6 +1722,56 @@ class DeltaChainIterator(object):
         return self._ext_refs
 
 
+# The DeltaChainIterator of a worker process of a parallel delta chain walk,
+# and the offsets of the objects that worker has resolved so far.
+_chain_worker_walker = None
+_chain_worker_done = None
+
+
+def _init_chain_worker(cls, filename, pending_ofs, pending_ref):
+    """Set up a worker process for DeltaChainIterator.
+
+    :param cls: DeltaChainIterator subclass to resolve objects with
+    :param filename: Path of the pack file
+    :param pending_ofs: Dictionary mapping base offsets to the offsets of the
+        OFS_DELTA objects against them
+    :param pending_ref: Dictionary mapping base SHAs to the offsets of the
+        REF_DELTA objects against them
+    """
+    global _chain_worker_walker, _chain_worker_done
+    f = open(filename, 'rb')
+    # Run when the worker exits after the pool is closed.
+    multiprocessing.util.Finalize(None, f.close, exitpriority=0)
+    _chain_worker_walker = cls(f)
+    _chain_worker_done = set()
+    _chain_worker_walker._pending_ofs = pending_ofs
+    _chain_worker_walker._pending_ref = pending_ref
+
+
+def _walk_chain_worker(args):
+    """Resolve a delta chain in a worker process.
+
+    :param args: Tuple with the offset of the first object of the chain, its
+        object type and the chunks of its delta base, or None if it is not a
+        delta
+    :return: List of (offset, binary SHA, result) tuples for the objects in
+        the chain, with result what the iterator would yield for the object
+    """
+    offset, obj_type_num, base_chunks = args
+    if offset in _chain_worker_done:
+        # Already resolved as part of another chain, e.g. a REF_DELTA against
+        # an object that is both in the pack and an external ref.
+        return []
+    walker = _chain_worker_walker
+    results = []
+    for unpacked in walker._follow_chain_unpacked(
+            offset, obj_type_num, base_chunks):
+        _chain_worker_done.add(unpacked.offset)
+        results.append(
+            (unpacked.offset, unpacked.sha(), walker._result(unpacked)))
+    return results
+
+
 class PackIndexer(DeltaChainIterator):
     """Delta chain iterator that yields index entries."""
 
@@ -1441,30 +1874,54 @@ def pack_object_header(type_num, delta_base, size):
     return bytearray(header)
 
 
-def write_pack_object(f, type, object, sha=None):
+def write_pack_object(f, type, object, sha=None,
+                      compression_level=DEFAULT_COMPRESSION_LEVEL):
     """Write pack object to a file.
 
     :param f: File to write to
     :param type: Numeric type of the object
     :param object: Object to write
+    :param compression_level: zlib compression level, from 0 (none) to 9
+        (best), or -1 for the zlib default
     :return: Tuple with offset at which the object was written, and crc32
     """
     if type in DELTA_TYPES:
         delta_base, object = object
     else:
         delta_base = None
-    header = bytes(pack_object_header(type, delta_base, len(object)))
-    comp_data = zlib.compress(object)
-    crc32 = 0
-    for data in (header, comp_data):
+    return write_compressed_pack_object(
+        f, type, delta_base, len(object),
+        [zlib.compress(object, compression_level)], sha=sha)
+
+
+def write_compressed_pack_object(f, type, delta_base, size, comp_chunks,
+                                 sha=None, crc32=None):
+    """Write an already compressed pack object to a file.
+
+    :param f: File to write to
+    :param type: Numeric type of the object
+    :param delta_base: Delta base offset or SHA, or None for whole objects
+    :param size: Uncompressed size of the object
+    :param comp_chunks: zlib-compressed object data, as list of chunks
+    :param crc32: CRC32 of the resulting entry, if already known
+    :return: crc32 of the written entry
+    """
+    header = bytes(pack_object_header(type, delta_base, size))
+    chunks = [header] + list(comp_chunks)
+    compute_crc32 = (crc32 is None)
+    if compute_crc32:
+        crc32 = 0
+    for data in chunks:
         f.write(data)
         if sha is not None:
             sha.update(data)
-        crc32 = binascii.crc32(data, crc32)
+        if compute_crc32:
+            crc32 = binascii.crc32(data, crc32)
     return crc32 & 0xffffffff
 
 
-def write_pack(filename, objects, deltify=None, delta_window_size=None):
+def write_pack(filename, objects, deltify=None, delta_window_size=None,
+               compression_level=DEFAULT_COMPRESSION_LEVEL):
     """Write a new pack data file.
 
     :param filename: Path to the new pack file (without .pack extension)
@@ -1472,11 +1929,13 @@ def write_pack(filename, objects, deltify=None, delta_window_size=None):
         Should provide __len__
     :param window_size: Delta window size
     :param deltify: Whether to deltify pack objects
+    :param compression_level: zlib compression level; see write_pack_object
     :return: Tuple with checksum of pack file and index file
     """
     with GitFile(filename + '.pack', 'wb') as f:
         entries, data_sum = write_pack_objects(f, objects,
-            delta_window_size=delta_window_size, deltify=deltify)
+            delta_window_size=delta_window_size, deltify=deltify,
+            compression_level=compression_level)
     entries = [(k, v[0], v[1]) for (k, v) in entries.items()]
     entries.sort()
     with GitFile(filename + '.idx', 'wb') as f:
@@ -1490,11 +1949,139 @@ def write_pack_header(f, num_objects):
     f.write(struct.pack(b'>L', num_objects))  # Number of objects in pack
 
 
-def deltify_pack_objects(objects, window_size=None):
+def _deltify_sorted_objects(entries, window_size, window_memory, window=()):
+    """Generate deltas for objects that have already been sorted.
+
+    :param entries: Iterable over (type_num, sha, raw) tuples
+    :param window_size: Window size
+    :param window_memory: Memory limit for the window, or None
+    :param window: Iterable over (type_num, sha, raw) tuples for the objects
+        preceding entries, which are only used to fill the window
+    :return: Iterator over type_num, object id, delta_base, content
+    """
+    # Window of (type_num, sha, delta index, size) tuples, most recent first.
+    # Each base is indexed once, when it enters the window.
+    possible_bases = deque()
+    window_used = 0
+
+    for (type_num, sha, raw), search in chain(
+            ((entry, False) for entry in window),
+            ((entry, True) for entry in entries)):
+        if search:
+            winner = raw
+            winner_base = None
+            for (base_type_num, base_sha, base_index,
+                 base_size) in possible_bases:
+                if base_type_num != type_num:
+                    continue
+                delta = base_index.create_delta(raw)
+                if len(delta) < len(winner):
+                    winner_base = base_sha
+                    winner = delta
+            yield type_num, sha, winner_base, winner
+        if window_size <= 0:
+            continue
+        index = DeltaIndex(raw)
+        size = sys.getsizeof(index)
+        possible_bases.appendleft((type_num, sha, index, size))
+        window_used += size
+        while len(possible_bases) > window_size or (
+                window_memory and window_used > window_memory and
+                len(possible_bases) > 1):
+            window_used -= possible_bases.pop()[3]
+
+
+def _deltify_batch(args):
+    """Search for deltas in a batch of sorted objects.
+
+    This runs in a worker process of deltify_pack_objects.
+
+    :param args: Tuple with a list of (type_num, sha, raw) tuples for the
+        objects preceding the batch in the window, a list of such tuples for
+        the batch, the window size and the window memory limit
+    :return: List with a (delta_base, delta) tuple for each entry; both are
+        None for entries that are not stored as a delta.
+    """
+    window, entries, window_size, window_memory = args
+    ret = []
+    for type_num, sha, delta_base, content in _deltify_sorted_objects(
+            entries, window_size, window_memory, window):
+        if delta_base is None:
+            ret.append((None, None))
+        else:
+            ret.append((delta_base, content))
+    return ret
+
+
+def _deltify_batches(magic, window_size, window_memory):
+    """Split sorted objects into batches of at most one window.
+
+    :return: Iterator over (start, end) ranges of indexes into magic
+    """
+    start = 0
+    while start < len(magic):
+        end = start + 1
+        size = -magic[start][2]
+        while (end < len(magic) and end - start < window_size and
+               not (window_memory and size >= window_memory)):
+            size -= magic[end][2]
+            end += 1
+        yield start, end
+        start = end
+
+
+def _deltify_parallel(magic, window_size, window_memory, processes):
+    """Search for deltas in batches of magic in worker processes.
+
+    Each batch is sent along with the objects preceding it, which rebuild
+    the delta window the batch starts with, so the result is the same as
+    when searching in a single process. At most two batches per worker are
+    in flight at any time.
+    """
+
+    def raw_entries(start, end):
+        return [(type_num, sha, o.as_raw_string())
+                for (type_num, path, neg_length, sha, o) in magic[start:end]]
+
+    batches = _deltify_batches(magic, window_size, window_memory)
+    pending = deque()
+    pool = multiprocessing.Pool(processes)
+    try:
+        while True:
+            for start, end in batches:
+                work = (raw_entries(max(0, start - window_size), start),
+                        raw_entries(start, end), window_size, window_memory)
+                pending.append(
+                    (start, end, pool.apply_async(_deltify_batch, (work,))))
+                if len(pending) >= 2 * processes:
+                    break
+            if not pending:
+                break
+            start, end, results = pending.popleft()
+            for (type_num, path, neg_length, sha, o), (delta_base, delta) in (
+                    izip(magic[start:end], results.get())):
+                if delta_base is None:
+                    yield type_num, sha, None, o.as_raw_string()
+                else:
+                    yield type_num, sha, delta_base, delta
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def deltify_pack_objects(objects, window_size=None, window_memory=None,
+                         processes=None):
     """Generate deltas for pack objects.
 
     :param objects: An iterable of (object, path) tuples to deltify.
     :param window_size: Window size; None for default
+    :param window_memory: Maximum amount of memory (in bytes) to use for the
+        objects in the window and their delta indexes, like git's
+        pack.windowMemory; None or 0 for no limit. The most recently added
+        object is always kept, regardless of this limit.
+    :param processes: Number of worker processes to search for deltas in,
+        like git's pack.threads; None or 1 to search in the current process.
+        The result does not depend on the number of processes.
     :return: Iterator over type_num, object id, delta_base, content
         delta_base is None for full text entries
     """
@@ -1502,31 +2089,25 @@ def deltify_pack_objects(objects, window_size=None):
         window_size = DEFAULT_PACK_DELTA_WINDOW_SIZE
     # Build a list of objects ordered by the magic Linus heuristic
     # This helps us find good objects to diff against us
+    # The SHA breaks ties, so that the order (and hence the output) is
+    # deterministic.
     magic = []
     for obj, path in objects:
-        magic.append((obj.type_num, path, -obj.raw_length(), obj))
+        magic.append((obj.type_num, path, -obj.raw_length(), obj.sha().digest(),
+                      obj))
     magic.sort()
 
-    possible_bases = deque()
-
-    for type_num, path, neg_length, o in magic:
-        raw = o.as_raw_string()
-        winner = raw
-        winner_base = None
-        for base in possible_bases:
-            if base.type_num != type_num:
-                continue
-            delta = create_delta(base.as_raw_string(), raw)
-            if len(delta) < len(winner):
-                winner_base = base.sha().digest()
-                winner = delta
-        yield type_num, o.sha().digest(), winner_base, winner
-        possible_bases.appendleft(o)
-        while len(possible_bases) > window_size:
-            possible_bases.pop()
+    if processes is not None and processes > 1:
+        return _deltify_parallel(magic, window_size, window_memory, processes)
+    return _deltify_sorted_objects(
+        ((type_num, sha, o.as_raw_string())
+         for (type_num, path, neg_length, sha, o) in magic),
+        window_size, window_memory)
 
 
-def write_pack_objects(f, objects, delta_window_size=None, deltify=False):
+def write_pack_objects(f, objects, delta_window_size=None, deltify=False,
+                       delta_window_memory=None, delta_processes=None,
+                       compression_level=DEFAULT_COMPRESSION_LEVEL):
     """Write a new pack data file.
 
     :param f: File to write to
@@ -1535,46 +2116,246 @@ def write_pack_objects(f, objects, delta_window_size=None, deltify=False):
     :param window_size: Sliding window size for searching for deltas;
                         Set to None for default window size.
     :param deltify: Whether to deltify objects
+    :param delta_window_memory: Memory limit for the delta window, in bytes;
+        None for no limit.
+    :param delta_processes: Number of processes to search for deltas in;
+        see deltify_pack_objects.
+    :param compression_level: zlib compression level; see write_pack_object
     :return: Dict mapping id -> (offset, crc32 checksum), pack checksum
     """
     if deltify:
-        pack_contents = deltify_pack_objects(objects, delta_window_size)
+        pack_contents = deltify_pack_objects(
+            objects, delta_window_size, window_memory=delta_window_memory,
+            processes=delta_processes)
     else:
         pack_contents = (
             (o.type_num, o.sha().digest(), None, o.as_raw_string())
             for (o, path) in objects)
 
-    return write_pack_data(f, len(objects), pack_contents)
+    return write_pack_data(f, len(objects), pack_contents,
+                           compression_level=compression_level)
 
 
-def write_pack_data(f, num_records, records):
+def _compress_record(record, compression_level):
+    """Compress the data of a record, as taken by write_pack_data.
+
+    :return: List of zlib-compressed chunks, or None for UnpackedObjects,
+        which are compressed already
+    """
+    if isinstance(record, UnpackedObject):
+        return None
+    return [zlib.compress(record[3], compression_level)]
+
+
+def _compress_records(records, workers=None,
+                      compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """Compress the data of records, possibly in several threads.
+
+    :param records: Iterator over records, as taken by write_pack_data
+    :param workers: Number of threads to compress in; None or 1 to compress
+        in the current thread
+    :param compression_level: zlib compression level
+    :return: Iterator over (record, comp_chunks) tuples, in the order of
+        records
+    """
+    if workers is None or workers <= 1:
+        for record in records:
+            yield record, _compress_record(record, compression_level)
+        return
+    # zlib releases the GIL, so threads compress in parallel. Only a few
+    # records per thread are compressed ahead, to bound memory use.
+    pool = multiprocessing.pool.ThreadPool(workers)
+    pending = deque()
+    try:
+        for record in records:
+            pending.append((record, pool.apply_async(
+                _compress_record, (record, compression_level))))
+            if len(pending) >= workers * 4:
+                record, result = pending.popleft()
+                yield record, result.get()
+        while pending:
+            record, result = pending.popleft()
+            yield record, result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_pack_data(f, num_records, records, workers=None,
+                    compression_level=DEFAULT_COMPRESSION_LEVEL):
     """Write a new pack data file.
 
     :param f: File to write to
     :param num_records: Number of records
-    :param records: Iterator over type_num, object_id, delta_base, raw
+    :param records: Iterator over type_num, object_id, delta_base, raw.
+        Objects can also be passed as UnpackedObjects with comp_chunks set,
+        as returned by Pack.get_unpacked_object; their compressed data is
+        copied to the new pack as-is.
+    :param workers: Number of threads to compress objects in, like git's
+        pack.threads; None or 1 to compress them in the current thread. The
+        pack is the same either way.
+    :param compression_level: zlib compression level for the objects that
+        are not compressed already; see write_pack_object
     :return: Dict mapping id -> (offset, crc32 checksum), pack checksum
     """
     # Write the pack
     entries = {}
     f = SHA1Writer(f)
     write_pack_header(f, num_records)
-    for type_num, object_id, delta_base, raw in records:
+    for record, comp_chunks in _compress_records(
+            records, workers, compression_level):
         offset = f.offset()
+        if isinstance(record, UnpackedObject):
+            entries[record.sha()] = (
+                offset, _write_unpacked_object(f, record, offset, entries))
+            continue
+        type_num, object_id, delta_base, raw = record
         if delta_base is not None:
             try:
                 base_offset, base_crc32 = entries[delta_base]
             except KeyError:
                 type_num = REF_DELTA
-                raw = (delta_base, raw)
             else:
                 type_num = OFS_DELTA
-                raw = (offset - base_offset, raw)
-        crc32 = write_pack_object(f, type_num, raw)
+                delta_base = offset - base_offset
+        crc32 = write_compressed_pack_object(
+            f, type_num, delta_base, len(raw), comp_chunks)
         entries[object_id] = (offset, crc32)
     return entries, f.write_sha()
 
 
+def _write_unpacked_object(f, unpacked, offset, entries):
+    """Copy an object read from another pack to a pack being written.
+
+    :param f: SHA1Writer for the new pack
+    :param unpacked: UnpackedObject with comp_chunks set. Deltas must be
+        against a base SHA (REF_DELTA), as offsets in the source pack are
+        meaningless here.
+    :param offset: Offset at which the object is written
+    :param entries: Dict mapping id -> (offset, crc32) of the objects written
+        so far
+    :return: crc32 of the written entry
+    """
+    type_num = unpacked.pack_type_num
+    delta_base = unpacked.delta_base
+    # The stored CRC32 only still applies if the header doesn't change.
+    crc32 = unpacked.crc32
+    if type_num == REF_DELTA and delta_base in entries:
+        base_offset, base_crc32 = entries[delta_base]
+        type_num = OFS_DELTA
+        delta_base = offset - base_offset
+        crc32 = None
+    elif type_num == OFS_DELTA:
+        raise AssertionError('OFS_DELTA objects can not be copied as-is')
+    return write_compressed_pack_object(
+        f, type_num, delta_base, unpacked.decomp_len, unpacked.comp_chunks,
+        crc32=crc32)
+
+
+class _PipelineStopped(Exception):
+    """Raised in the producer when the consumer of a pipeline has stopped."""
+
+
+class _ChunkQueueWriter(object):
+    """File-like object that puts the data written to it on a queue in chunks.
+
+    :param chunks: Queue to put the chunks on
+    :param chunk_size: Size of the chunks; only the last one can be smaller
+    :param stopped: Event that is set once the chunks are no longer wanted
+    """
+
+    def __init__(self, chunks, chunk_size, stopped):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._stopped = stopped
+        self._buf = []
+        self._buflen = 0
+
+    def write(self, data):
+        self._buf.append(data)
+        self._buflen += len(data)
+        if self._buflen < self._chunk_size:
+            return
+        data = b''.join(self._buf)
+        end = len(data) - len(data) % self._chunk_size
+        for i in range(0, end, self._chunk_size):
+            self.put(data[i:i + self._chunk_size])
+        self._buf = [data[end:]]
+        self._buflen = len(data) - end
+
+    def flush(self):
+        data = b''.join(self._buf)
+        self._buf = []
+        self._buflen = 0
+        if data:
+            self.put(data)
+
+    def put(self, chunk):
+        """Put a chunk on the queue, waiting for space if necessary."""
+        while not self._stopped.is_set():
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+        raise _PipelineStopped()
+
+
+def iter_pack_data(num_records, records, chunk_size=DEFAULT_PACK_CHUNK_SIZE,
+                   depth=DEFAULT_PACK_PIPELINE_DEPTH, workers=None,
+                   compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """Generate the contents of a new pack file.
+
+    The records are retrieved, compressed and written to the pack in a
+    background thread, so that this overlaps with whatever the caller does
+    with the chunks, such as sending them over the network. zlib releases
+    the GIL while compressing.
+
+    :param num_records: Number of records
+    :param records: Iterator over records, as taken by write_pack_data
+    :param chunk_size: Size of the chunks to produce; only the last one can
+        be smaller
+    :param depth: Maximum number of chunks to produce ahead of the caller
+    :param workers: Number of threads to compress objects in; see
+        write_pack_data
+    :param compression_level: zlib compression level; see write_pack_object
+    :return: Iterator over chunks of the pack file
+    """
+    chunks = queue.Queue(depth)
+    stopped = threading.Event()
+    errors = []
+
+    def produce():
+        f = _ChunkQueueWriter(chunks, chunk_size, stopped)
+        try:
+            write_pack_data(f, num_records, records, workers=workers,
+                            compression_level=compression_level)
+            f.flush()
+        except _PipelineStopped:
+            return
+        except Exception as e:
+            errors.append(e)
+        try:
+            f.put(None)
+        except _PipelineStopped:
+            pass
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        stopped.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
 def write_pack_index_v1(f, entries, pack_checksum):
     """Write a new pack index file.
 
@@ -1632,49 +2413,199 @@ def _encode_copy_operation(start, length):
     return bytearray([op] + scratch)
 
 
-def create_delta(base_buf, target_buf):
-    """Use python difflib to work out how to transform base_buf to target_buf.
+# Size of the blocks of the base buffer that are indexed when creating deltas.
+# Matches shorter than this are never found, and are emitted as inserts.
+_DELTA_BLOCK_SIZE = 16
+
+# Minimum length of a common prefix of the base and target that is copied
+# rather than inserted.
+_DELTA_MIN_PREFIX_LEN = 4
+
+# Maximum number of base offsets that are kept for identical blocks. Without
+# a limit, highly repetitive bases would make delta creation quadratic.
+_DELTA_MAX_BLOCK_OFFSETS = 64
+
+
+def _build_delta_index(base_buf):
+    """Index the blocks of a delta base buffer.
+
+    :param base_buf: Base buffer
+    :return: Dictionary mapping the contents of each aligned block in base_buf
+        to a list of the (ascending) offsets it appears at.
+    """
+    index = {}
+    for offset in range(0, len(base_buf) - _DELTA_BLOCK_SIZE + 1,
+                        _DELTA_BLOCK_SIZE):
+        block = base_buf[offset:offset+_DELTA_BLOCK_SIZE]
+        offsets = index.setdefault(block, [])
+        if len(offsets) < _DELTA_MAX_BLOCK_OFFSETS:
+            offsets.append(offset)
+    return index
+
+
+def _match_length(base_buf, base_offset, target_buf, target_offset,
+                  known=0):
+    """Find the length of the common run of two buffers at given offsets.
+
+    :param known: Number of bytes known to match already
+    :return: Length of the match
+    """
+    max_len = min(len(base_buf) - base_offset, len(target_buf) - target_offset)
+    length = known
+    step = _DELTA_BLOCK_SIZE
+    # Compare increasingly large slices, then narrow down on a mismatch.
+    while length < max_len:
+        step = min(step, max_len - length)
+        start = length
+        if (base_buf[base_offset+start:base_offset+start+step] ==
+                target_buf[target_offset+start:target_offset+start+step]):
+            length += step
+            step *= 2
+        elif step > 1:
+            step //= 2
+        else:
+            break
+    return length
+
+
+def _encode_insert_operations(out_buf, data):
+    """Encode insert operations for a buffer.
+
+    :param out_buf: bytearray to append the operations to
+    :param data: Data to insert
+    """
+    s = len(data)
+    o = 0
+    while s > 127:
+        out_buf.append(127)
+        out_buf += data[o:o+127]
+        s -= 127
+        o += 127
+    if s:
+        out_buf.append(s)
+        out_buf += data[o:o+s]
+
+
+def _encode_copy_operations(out_buf, start, length):
+    """Encode copy operations for a range of the base buffer.
+
+    :param out_buf: bytearray to append the operations to
+    :param start: Offset in the base buffer
+    :param length: Length of the range to copy
+    """
+    while length > 0:
+        to_copy = min(length, _MAX_COPY_LEN)
+        out_buf += _encode_copy_operation(start, to_copy)
+        start += to_copy
+        length -= to_copy
+
 
+def _create_delta_from_index(index, base_buf, target_buf):
+    """Create a delta using an index created by _build_delta_index.
+
+    :param index: Index of base_buf
     :param base_buf: Base buffer
     :param target_buf: Target buffer
+    :return: Delta, as bytes
     """
-    assert isinstance(base_buf, bytes)
-    assert isinstance(target_buf, bytes)
     out_buf = bytearray()
     # write delta header
     out_buf += _delta_encode_size(len(base_buf))
     out_buf += _delta_encode_size(len(target_buf))
     # write out delta opcodes
-    seq = difflib.SequenceMatcher(a=base_buf, b=target_buf)
-    for opcode, i1, i2, j1, j2 in seq.get_opcodes():
-        # Git patch opcodes don't care about deletes!
-        #if opcode == 'replace' or opcode == 'delete':
-        #    pass
-        if opcode == 'equal':
-            # If they are equal, unpacker will use data from base_buf
-            # Write out an opcode that says what range to use
-            copy_start = i1
-            copy_len = i2 - i1
-            while copy_len > 0:
-                to_copy = min(copy_len, _MAX_COPY_LEN)
-                out_buf += _encode_copy_operation(copy_start, to_copy)
-                copy_start += to_copy
-                copy_len -= to_copy
-        if opcode == 'replace' or opcode == 'insert':
-            # If we are replacing a range or adding one, then we just
-            # output it to the stream (prefixed by its size)
-            s = j2 - j1
-            o = j1
-            while s > 127:
-                out_buf.append(127)
-                out_buf += bytearray(target_buf[o:o+127])
-                s -= 127
-                o += 127
-            out_buf.append(s)
-            out_buf += bytearray(target_buf[o:o+s])
+    target_len = len(target_buf)
+    # The block index can not find matches shorter than a block, so check
+    # for a common prefix separately; this matters for small objects.
+    i = _match_length(base_buf, 0, target_buf, 0)
+    if i >= _DELTA_MIN_PREFIX_LEN:
+        _encode_copy_operations(out_buf, 0, i)
+    else:
+        i = 0
+    insert_start = i
+    while i + _DELTA_BLOCK_SIZE <= target_len:
+        offsets = index.get(target_buf[i:i+_DELTA_BLOCK_SIZE])
+        if offsets is None:
+            i += 1
+            continue
+        copy_start = None
+        copy_len = 0
+        for offset in offsets:
+            length = _match_length(base_buf, offset, target_buf, i,
+                                   _DELTA_BLOCK_SIZE)
+            if length > copy_len:
+                copy_start = offset
+                copy_len = length
+        # Extend the match backwards into data that would otherwise be
+        # inserted.
+        while (i > insert_start and copy_start > 0 and
+               base_buf[copy_start-1:copy_start] == target_buf[i-1:i]):
+            i -= 1
+            copy_start -= 1
+            copy_len += 1
+        _encode_insert_operations(out_buf, target_buf[insert_start:i])
+        _encode_copy_operations(out_buf, copy_start, copy_len)
+        i += copy_len
+        insert_start = i
+    _encode_insert_operations(out_buf, target_buf[insert_start:])
     return bytes(out_buf)
 
 
+class DeltaIndex(object):
+    """Index of a delta base buffer.
+
+    Indexing the base is a significant part of the cost of creating a delta,
+    so a DeltaIndex should be kept around when several targets are compared
+    against the same base.
+    """
+
+    def __init__(self, base_buf):
+        """Create a new DeltaIndex.
+
+        :param base_buf: Base buffer
+        """
+        assert isinstance(base_buf, bytes)
+        self._base_buf = base_buf
+        self._index = _build_delta_index(base_buf)
+        self._size = None
+
+    def create_delta(self, target_buf):
+        """Work out how to transform the base buffer to target_buf.
+
+        :param target_buf: Target buffer
+        :return: Delta, as bytes
+        """
+        assert isinstance(target_buf, bytes)
+        return _create_delta_from_index(self._index, self._base_buf,
+                                        target_buf)
+
+    def __sizeof__(self):
+        # Include the base buffer, which is kept alive by the index.
+        if self._size is None:
+            size = (object.__sizeof__(self) + sys.getsizeof(self._base_buf) +
+                    sys.getsizeof(self._index))
+            for block, offsets in self._index.items():
+                size += sys.getsizeof(block) + sys.getsizeof(offsets)
+            self._size = size
+        return self._size
+
+
+def create_delta(base_buf, target_buf):
+    """Work out how to transform base_buf to target_buf.
+
+    Aligned blocks of the base buffer are indexed, after which the target is
+    scanned for occurrences of those blocks. Matches are extended as far as
+    possible in both directions and emitted as copy operations; everything
+    else is inserted literally.
+
+    :param base_buf: Base buffer
+    :param target_buf: Target buffer
+    """
+    assert isinstance(base_buf, bytes)
+    assert isinstance(target_buf, bytes)
+    return _create_delta_from_index(
+        _build_delta_index(base_buf), base_buf, target_buf)
+
+
 def apply_delta(src_buf, delta):
     """Based on the similar function in git's patch-delta.c.
 
@@ -1781,13 +2712,22 @@ def write_pack_index_v2(f, entries, pack_checksum):
 class Pack(object):
     """A Git pack object."""
 
-    def __init__(self, basename, resolve_ext_ref=None):
+    def __init__(self, basename, resolve_ext_ref=None, delta_base_cache=None):
+        """Open a pack.
+
+        :param basename: Path to the pack files, without extension
+        :param resolve_ext_ref: Optional function to look up objects outside
+            this pack, for thin packs
+        :param delta_base_cache: Optional DeltaBaseCache to share with other
+            packs; see PackData
+        """
         self._basename = basename
         self._data = None
         self._idx = None
         self._idx_path = self._basename + '.idx'
         self._data_path = self._basename + '.pack'
-        self._data_load = lambda: PackData(self._data_path)
+        self._data_load = lambda: PackData(
+            self._data_path, delta_base_cache=delta_base_cache)
         self._idx_load = lambda: load_pack_index(self._idx_path)
         self.resolve_ext_ref = resolve_ext_ref
 
@@ -1890,9 +2830,47 @@ class Pack(object):
 
     def get_raw(self, sha1):
         offset = self.index.object_index(sha1)
+        return self.get_raw_at(offset)
+
+    def get_raw_at(self, offset):
+        """Return the type and contents of the object at an offset.
+
+        :param offset: Offset of the object in the pack
+        :return: Tuple with numeric type and object contents
+        """
+        type_num, chunks = self.get_raw_chunks_at(offset)
+        return type_num, b''.join(chunks)
+
+    def get_raw_chunks_at(self, offset):
+        """Return the type and contents of the object at an offset as chunks.
+
+        :param offset: Offset of the object in the pack
+        :return: Tuple with numeric type and list of chunks
+        """
         obj_type, obj = self.data.get_object_at(offset)
         type_num, chunks = self.data.resolve_object(offset, obj_type, obj)
-        return type_num, b''.join(chunks)
+        # The chunks may be shared with the delta base cache.
+        return type_num, list(chunks)
+
+    def get_unpacked_object(self, sha1, include_comp=False):
+        """Read an object as it is stored in this pack.
+
+        Deltas are not resolved.
+
+        :param sha1: SHA of the object, either hex or binary
+        :param include_comp: If True, include the compressed data
+        :return: UnpackedObject, as returned by
+            PackData.get_unpacked_object_at, with its SHA and the CRC32
+            stored in the index (None for v1 indexes) set
+        """
+        offset = self.index.object_index(sha1)
+        unpacked = self.data.get_unpacked_object_at(
+            offset, include_comp=include_comp)
+        if len(sha1) == 40:
+            sha1 = hex_to_sha(sha1)
+        unpacked._sha = sha1
+        unpacked.crc32 = self.index.object_crc32(sha1)
+        return unpacked
 
     def __getitem__(self, sha1):
         """Retrieve the specified SHA1."""
@@ -1938,7 +2916,25 @@ class Pack(object):
         return keepfile_name
 
 
+# Hold on to the pure-python implementations for testing
+_create_delta_py = create_delta
+_DeltaIndex_py = DeltaIndex
+_read_zlib_chunks_py = read_zlib_chunks
+_unpack_object_py = unpack_object
+try:
+    from dulwich._pack import (
+        apply_delta,
+        bisect_find_sha,
+        create_delta,
+        DeltaIndex,
+        )
+except ImportError:
+    pass
 try:
-    from dulwich._pack import apply_delta, bisect_find_sha
+    from dulwich._pack import (
+        read_zlib_chunks,
+        unpack_object,
+        )
 except ImportError:
+    # The extension was built without zlib.
     pass
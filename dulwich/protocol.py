@@ -45,6 +45,10 @@ SIDE_BAND_CHANNEL_PROGRESS = 2
 # fatal error message just before stream aborts
 SIDE_BAND_CHANNEL_FATAL = 3
 
+# a pktline can be a max of 65520. a sideband line can therefore be
+# 65520-5 = 65515
+SIDE_BAND_CHUNK_SIZE = 65515
+
 CAPABILITY_DELETE_REFS = b'delete-refs'
 CAPABILITY_INCLUDE_TAG = b'include-tag'
 CAPABILITY_MULTI_ACK = b'multi_ack'
@@ -231,12 +235,11 @@ class Protocol(object):
         :param channel: An int specifying the channel to write to.
         :param blob: A blob of data (as a string) to send on this channel.
         """
-        # a pktline can be a max of 65520. a sideband line can therefore be
-        # 65520-5 = 65515
         # WTF: Why have the len in ASCII, but the channel in binary.
         while blob:
-            self.write_pkt_line(bytes(bytearray([channel])) + blob[:65515])
-            blob = blob[65515:]
+            self.write_pkt_line(
+                bytes(bytearray([channel])) + blob[:SIDE_BAND_CHUNK_SIZE])
+            blob = blob[SIDE_BAND_CHUNK_SIZE:]
 
     def send_cmd(self, cmd, *args):
         """Send a command and some arguments to a git server.
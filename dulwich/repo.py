@@ -271,10 +271,15 @@ class BaseRepo(object):
             haves = []  # TODO: filter the haves commits from iter_shas.
                         # the specific commits aren't missing.
 
-        def get_parents(commit):
-            if commit.id in shallows:
-                return []
-            return self.get_parents(commit.id, commit)
+        if shallows or self._graftpoints:
+            def get_parents(commit):
+                if commit.id in shallows:
+                    return []
+                return self.get_parents(commit.id, commit)
+        else:
+            # Leave it to the object store to follow the parents stored in
+            # the commits, so that it can use pack bitmaps.
+            get_parents = None
 
         return self.object_store.iter_shas(
           self.object_store.find_missing_objects(
@@ -347,7 +352,7 @@ class BaseRepo(object):
             return self._graftpoints[sha]
         except KeyError:
             if commit is None:
-                commit = self[sha]
+                return self.object_store.get_parents(sha)
             return commit.parents
 
     def get_config(self):
@@ -429,7 +434,9 @@ class BaseRepo(object):
         if isinstance(include, str):
             include = [include]
 
-        kwargs['get_parents'] = lambda commit: self.get_parents(commit.id, commit)
+        if self._graftpoints:
+            kwargs['get_parents'] = lambda commit: self.get_parents(
+                commit.id, commit)
 
         return Walker(self.object_store, include, *args, **kwargs)
 
@@ -656,8 +663,9 @@ class Repo(BaseRepo):
                 "No git repository was found at %(path)s" % dict(path=root)
             )
         self.path = root
-        object_store = DiskObjectStore(os.path.join(self.controldir(),
-                                                    OBJECTDIR))
+        object_store = DiskObjectStore.from_config(
+            os.path.join(self.controldir(), OBJECTDIR),
+            self.get_config_stack())
         refs = DiskRefsContainer(self.controldir())
         BaseRepo.__init__(self, object_store, refs)
 
@@ -63,8 +63,11 @@ from dulwich.objects import (
     Commit,
     valid_hexsha,
     )
+from dulwich.object_store import (
+    ObjectStoreIterator,
+    )
 from dulwich.pack import (
-    write_pack_objects,
+    iter_pack_data,
     )
 from dulwich.protocol import (
     BufferedPktLineWriter,
@@ -87,11 +90,11 @@ from dulwich.protocol import (
     MULTI_ACK,
     MULTI_ACK_DETAILED,
     Protocol,
-    ProtocolFile,
     ReceivableProtocol,
     SIDE_BAND_CHANNEL_DATA,
     SIDE_BAND_CHANNEL_PROGRESS,
     SIDE_BAND_CHANNEL_FATAL,
+    SIDE_BAND_CHUNK_SIZE,
     SINGLE_ACK,
     TCP_GIT_PORT,
     ZERO_SHA,
@@ -330,8 +333,25 @@ class UploadPackHandler(Handler):
         self._processing_have_lines = False
 
         self.progress(b"dul-daemon says what\n")
-        self.progress(("counting objects: %d, done.\n" % len(objects_iter)).encode('ascii'))
-        write_pack_objects(ProtocolFile(None, write), objects_iter)
+        # The objects have been enumerated (but not retrieved, apart from
+        # commits and trees) by now, so the number of objects is known.
+        num_objects = len(objects_iter)
+        self.progress(("counting objects: %d, done.\n" % num_objects).encode('ascii'))
+        if isinstance(objects_iter, ObjectStoreIterator):
+            # Copy objects from the packs they are stored in where possible,
+            # rather than recompressing (and re-deltifying) them.
+            records = objects_iter.store.iter_pack_records(
+                sha for (sha, path) in objects_iter.itershas())
+        else:
+            records = ((o.type_num, o.sha().digest(), None, o.as_raw_string())
+                       for (o, path) in objects_iter)
+        # Retrieve and compress objects while earlier ones are being sent,
+        # in chunks that fill up a side-band packet.
+        compression_level = self.repo.object_store.pack_compression_level
+        for chunk in iter_pack_data(num_objects, records,
+                                    chunk_size=SIDE_BAND_CHUNK_SIZE,
+                                    compression_level=compression_level):
+            write(chunk)
         self.progress(b"how was that, then?\n")
         # we are done
         self.proto.write_pkt_line(None)
@@ -384,14 +404,6 @@ def _find_shallow(store, heads, depth):
         considered shallow and unshallow according to the arguments. Note that
         these sets may overlap if a commit is reachable along multiple paths.
     """
-    parents = {}
-    def get_parents(sha):
-        result = parents.get(sha, None)
-        if not result:
-            result = store[sha].parents
-            parents[sha] = result
-        return result
-
     todo = []  # stack of (sha, depth)
     for head_sha in heads:
         obj = store.peel_sha(head_sha)
@@ -405,28 +417,40 @@ def _find_shallow(store, heads, depth):
         if cur_depth < depth:
             not_shallow.add(sha)
             new_depth = cur_depth + 1
-            todo.extend((p, new_depth) for p in get_parents(sha))
+            todo.extend((p, new_depth) for p in store.get_parents(sha))
         else:
             shallow.add(sha)
 
     return shallow, not_shallow
 
 
-def _want_satisfied(store, haves, want, earliest):
-    o = store[want]
-    pending = collections.deque([o])
+def _want_satisfied(store, haves, want, earliest, min_generation=None):
+    if want in haves:
+        return True
+    if store[want].type_name != b"commit":
+        # non-commit wants have no ancestors that could be haves
+        return False
+    pending = collections.deque([want])
+    seen = set(pending)
     while pending:
-        commit = pending.popleft()
-        if commit.id in haves:
+        sha = pending.popleft()
+        if sha in haves:
             return True
-        if commit.type_name != b"commit":
-            # non-commit wants are assumed to be satisfied
-            continue
-        for parent in commit.parents:
-            parent_obj = store[parent]
+        for parent in store.get_parents(sha):
+            if parent in seen:
+                continue
+            seen.add(parent)
+            generation = None
+            if min_generation is not None:
+                generation = store.get_generation(parent)
+            if generation is not None:
+                # A have can only be reached from commits with at least
+                # its generation number.
+                if generation >= min_generation:
+                    pending.append(parent)
             # TODO: handle parents with later commit times than children
-            if parent_obj.commit_time >= earliest:
-                pending.append(parent_obj)
+            elif store.get_commit_time(parent) >= earliest:
+                pending.append(parent)
     return False
 
 
@@ -440,13 +464,16 @@ def _all_wants_satisfied(store, haves, wants):
         in the current interface they are determined outside this class.
     """
     haves = set(haves)
+    min_generation = None
     if haves:
-        earliest = min([store[h].commit_time for h in haves])
+        earliest = min([store.get_commit_time(h) for h in haves])
+        generations = [store.get_generation(h) for h in haves]
+        if None not in generations:
+            min_generation = min(generations)
     else:
         earliest = 0
-    unsatisfied_wants = set()
     for want in wants:
-        if not _want_satisfied(store, haves, want, earliest):
+        if not _want_satisfied(store, haves, want, earliest, min_generation):
             return False
 
     return True
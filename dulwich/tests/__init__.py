@@ -115,8 +115,10 @@ class BlackboxTestCase(TestCase):
 
 def self_test_suite():
     names = [
+        'bitmap',
         'blackbox',
         'client',
+        'commit_graph',
         'config',
         'diff_tree',
         'fastexport',
@@ -126,6 +128,7 @@ def self_test_suite():
         'hooks',
         'index',
         'lru_cache',
+        'midx',
         'objects',
         'objectspec',
         'object_store',
@@ -26,14 +26,31 @@ import re
 import shutil
 import tempfile
 
+from dulwich.bitmap import (
+    load_pack_bitmap,
+    )
+from dulwich.midx import (
+    load_multi_pack_index,
+    )
+from dulwich.object_store import (
+    DiskObjectStore,
+    MemoryObjectStore,
+    )
 from dulwich.pack import (
     write_pack,
     )
 from dulwich.objects import (
     Blob,
     )
+from dulwich.repo import (
+    Repo,
+    )
 from dulwich.tests import (
-    SkipTest,
+    TestCase,
+    )
+from dulwich.tests.utils import (
+    build_commit_graph,
+    make_object,
     )
 from dulwich.tests.test_pack import (
     a_sha,
@@ -123,22 +140,16 @@ class TestPack(PackTests):
         # (new_blob_2), so let's verify that actually happens:
         self.assertIn(b'chain length = 2', output)
 
-    # This test is SUPER slow: over 80 seconds on a 2012-era
-    # laptop. This is because SequenceMatcher is worst-case quadratic
-    # on the input size. It's impractical to produce deltas for
-    # objects this large, but it's still worth doing the right thing
-    # when it happens.
     def test_delta_large_object(self):
         # This tests an object set that will have a copy operation
         # 2**25 in size. This is a copy large enough that it requires
         # two copy operations in git's binary delta format.
-        raise SkipTest('skipping slow, large test')
         orig_pack = self.get_pack(pack1_sha)
         orig_blob = orig_pack[a_sha]
         new_blob = Blob()
-        new_blob.data = 'big blob' + ('x' * 2 ** 25)
+        new_blob.data = b'big blob' + (b'x' * 2 ** 25)
         new_blob_2 = Blob()
-        new_blob_2.data = new_blob.data + 'y'
+        new_blob_2.data = new_blob.data + b'y'
         all_to_pack = list(orig_pack.pack_tuples()) + [(new_blob, None),
                                                        (new_blob_2, None)]
         pack_path = os.path.join(self._tempdir, "pack_with_deltas")
@@ -153,3 +164,98 @@ class TestPack(PackTests):
         self.assertEqual(
             4, got_non_delta,
             'Expected 4 non-delta objects, got %d' % got_non_delta)
+
+
+class TestMultiPackIndex(TestCase):
+    """Compatibility tests for multi-pack-index files."""
+
+    def setUp(self):
+        require_git_version((2, 21, 0))
+        super(TestMultiPackIndex, self).setUp()
+        self._tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tempdir)
+        self.repo = Repo.init(self._tempdir)
+        self.addCleanup(self.repo.object_store.close)
+        self.store = self.repo.object_store
+        self.blobs = [make_object(Blob, data=data)
+                      for data in (b'yummy data', b'more yummy data',
+                                   b'even more yummy data')]
+        self.store.add_objects([(self.blobs[0], None),
+                                (self.blobs[1], None)])
+        self.store.add_objects([(self.blobs[1], None),
+                                (self.blobs[2], None)])
+
+    def test_git_reads_midx(self):
+        self.store.write_multi_pack_index()
+        run_git_or_fail(['multi-pack-index', 'verify'], cwd=self._tempdir)
+        for blob in self.blobs:
+            self.assertEqual(blob.data, run_git_or_fail(
+                ['cat-file', 'blob', blob.id.decode('ascii')],
+                cwd=self._tempdir))
+
+    def test_read_git_midx(self):
+        run_git_or_fail(['multi-pack-index', 'write'], cwd=self._tempdir)
+        path = os.path.join(self.store.pack_dir, 'multi-pack-index')
+        with load_multi_pack_index(path) as midx:
+            midx.check()
+            self.assertEqual(sorted(blob.id for blob in self.blobs),
+                             sorted(midx))
+        store = DiskObjectStore(self.store.path)
+        self.addCleanup(store.close)
+        for blob in self.blobs:
+            self.assertEqual(blob, store[blob.id])
+
+
+class TestPackBitmap(TestCase):
+    """Compatibility tests for pack bitmap files."""
+
+    def setUp(self):
+        require_git_version((2, 0, 0))
+        super(TestPackBitmap, self).setUp()
+        self._tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tempdir)
+        self.repo = Repo.init(self._tempdir)
+        self.addCleanup(self.repo.object_store.close)
+        self.store = self.repo.object_store
+        source = MemoryObjectStore()
+        blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii'))
+                 for i in range(3)]
+        self.commits = build_commit_graph(
+            source, [[1], [2, 1], [3, 1], [4, 2, 3]], trees={
+                1: [(b'a', blobs[0])],
+                2: [(b'a', blobs[1]), (b'd/b', blobs[0])],
+                3: [(b'a', blobs[2])],
+                4: [(b'a', blobs[2]), (b'd/b', blobs[1])],
+                })
+        self.pack = self.store.add_objects(
+            [(source[sha], None) for sha in source])
+        self.repo.refs[b'refs/heads/master'] = self.commits[-1].id
+
+    def _git_objects(self, haves, wants):
+        output = run_git_or_fail(
+            ['rev-list', '--objects'] + [w.decode('ascii') for w in wants] +
+            ['^' + h.decode('ascii') for h in haves], cwd=self._tempdir)
+        return set(line[:40] for line in output.splitlines())
+
+    def test_git_reads_bitmap(self):
+        self.assertEqual(2, self.store.write_pack_bitmap(
+            self.pack, [self.commits[1].id, self.commits[3].id]))
+        run_git_or_fail(['rev-list', '--test-bitmap', 'master'],
+                        cwd=self._tempdir)
+
+    def test_read_git_bitmap(self):
+        run_git_or_fail(['repack', '-a', '-d', '-b'], cwd=self._tempdir)
+        store = DiskObjectStore(self.store.path)
+        self.addCleanup(store.close)
+        pack, = store.packs
+        with load_pack_bitmap(pack._basename + '.bitmap', pack.index) as bitmap:
+            bitmap.check()
+            self.assertIn(self.commits[-1].id, bitmap)
+        c1, c2, c3, c4 = self.commits
+        self.assertIsNot(None, store._get_pack_bitmap())
+        for haves, wants in [([], [c4.id]), ([c2.id], [c4.id]),
+                             ([c1.id], [c3.id])]:
+            self.assertEqual(
+                self._git_objects(haves, wants),
+                set(sha for (sha, path) in
+                    store._find_missing_objects_bitmap(haves, wants)))
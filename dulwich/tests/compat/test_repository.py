@@ -24,6 +24,9 @@ from io import BytesIO
 from itertools import chain
 import os
 
+from dulwich.object_store import (
+    DiskObjectStore,
+    )
 from dulwich.objects import (
     hex_to_sha,
     )
@@ -35,6 +38,7 @@ from dulwich.tests.utils import (
     )
 
 from dulwich.tests.compat.utils import (
+    require_git_version,
     run_git_or_fail,
     import_repo,
     CompatTestCase,
@@ -123,3 +127,29 @@ class ObjectStoreTestCase(CompatTestCase):
     def test_all_objects(self):
         expected_shas = self._get_all_shas()
         self.assertShasMatch(expected_shas, iter(self._repo.object_store))
+
+    def _get_all_commits(self):
+        output = self._run_git(['rev-list', '--all'])
+        return output.splitlines()
+
+    def test_git_reads_commit_graph(self):
+        require_git_version((2, 18, 0))
+        store = self._repo.object_store
+        commits = self._get_all_commits()
+        self.assertEqual(len(commits), store.write_commit_graph(
+            self._repo.refs.as_dict().values()))
+        self._run_git(['commit-graph', 'verify'])
+
+    def test_read_git_commit_graph(self):
+        require_git_version((2, 18, 0))
+        self._run_git(['commit-graph', 'write', '--reachable'])
+        store = DiskObjectStore(self._repo.object_store.path)
+        self.addCleanup(store.close)
+        for sha in self._get_all_commits():
+            commit = store[sha]
+            self.assertEqual(commit.parents, store.get_parents(sha))
+            self.assertEqual(commit.commit_time, store.get_commit_time(sha))
+            self.assertEqual(
+                1 + max([0] + [store.get_generation(p)
+                               for p in commit.parents]),
+                store.get_generation(sha))
@@ -0,0 +1,200 @@
+# test_bitmap.py -- Tests for pack bitmap files
+# Copyright (C) 2015 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# or (at your option) any later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for pack bitmap files."""
+
+from io import BytesIO
+import shutil
+import tempfile
+
+from dulwich.bitmap import (
+    PackBitmap,
+    iter_bits,
+    read_ewah,
+    write_ewah,
+    write_pack_bitmap,
+    )
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.object_store import (
+    DiskObjectStore,
+    MemoryObjectStore,
+    MissingObjectFinder,
+    )
+from dulwich.objects import (
+    Blob,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+from dulwich.tests.utils import (
+    build_commit_graph,
+    make_object,
+    make_tag,
+    )
+
+
+class EWAHTests(TestCase):
+
+    def roundtrip(self, bitmap):
+        f = BytesIO()
+        write_ewah(f, bitmap)
+        contents = f.getvalue()
+        self.assertEqual((bitmap, len(contents)), read_ewah(contents, 0))
+        return contents
+
+    def test_empty(self):
+        self.roundtrip(0)
+
+    def test_literals(self):
+        self.roundtrip(0x123456789)
+        self.roundtrip((1 << 200) | 5)
+
+    def test_runs(self):
+        # A run of 1000 empty words and one literal word.
+        contents = self.roundtrip(1 << 64000 | 1 << 64001)
+        self.assertEqual(8 + 2 * 8 + 4, len(contents))
+        # A run of clean words with all bits set.
+        contents = self.roundtrip((1 << 6400) - 1)
+        self.assertEqual(8 + 8 + 4, len(contents))
+
+    def test_offset(self):
+        f = BytesIO()
+        f.write(b'junk')
+        write_ewah(f, 42)
+        write_ewah(f, 1 << 100)
+        contents = f.getvalue()
+        bitmap, offset = read_ewah(contents, 4)
+        self.assertEqual(42, bitmap)
+        self.assertEqual((1 << 100, len(contents)), read_ewah(contents, offset))
+
+    def test_iter_bits(self):
+        self.assertEqual([], list(iter_bits(0)))
+        self.assertEqual([0, 3, 64, 1000],
+                         list(iter_bits(1 | 8 | 1 << 64 | 1 << 1000)))
+
+
+class PackBitmapTests(TestCase):
+
+    def setUp(self):
+        super(PackBitmapTests, self).setUp()
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        self.store = DiskObjectStore.init(self.store_dir)
+        self.addCleanup(self.store.close)
+        source = MemoryObjectStore()
+        blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii'))
+                 for i in range(4)]
+        self.commits = build_commit_graph(
+            source, [[1], [2, 1], [3, 1], [4, 2, 3]], trees={
+                1: [(b'a', blobs[0])],
+                2: [(b'a', blobs[1]), (b'd/b', blobs[0])],
+                3: [(b'a', blobs[2])],
+                4: [(b'a', blobs[3]), (b'd/b', blobs[1])],
+                })
+        self.tag = make_tag(self.commits[1])
+        source.add_object(self.tag)
+        self.source = source
+        self.pack = self.store.add_objects(
+            [(source[sha], None) for sha in source])
+
+    def reachable(self, shas):
+        finder = MissingObjectFinder(self.source, [], shas)
+        return set(sha for (sha, path) in iter(finder.next, None))
+
+    def make_bitmap(self, commits):
+        f = BytesIO()
+        num_bitmaps, sha = write_pack_bitmap(
+            f, self.pack, [c.id for c in commits])
+        contents = f.getvalue()
+        self.assertEqual(sha, contents[-20:])
+        bitmap = PackBitmap('pack.bitmap', self.pack.index,
+                            file=BytesIO(contents), contents=contents,
+                            size=len(contents))
+        self.assertEqual(num_bitmaps, len(bitmap))
+        return bitmap
+
+    def test_get_bitmap(self):
+        c1, c2, c3, c4 = self.commits
+        bitmap = self.make_bitmap([c4, c2])
+        self.assertEqual(self.pack.index.get_pack_checksum(),
+                         bitmap.pack_checksum)
+        self.assertIn(c2.id, bitmap)
+        self.assertIn(c4.id, bitmap)
+        self.assertNotIn(c1.id, bitmap)
+        for c in (c2, c4):
+            self.assertEqual(self.reachable([c.id]),
+                             set(bitmap.iter_shas(bitmap.get_bitmap(c.id))))
+        self.assertRaises(KeyError, bitmap.get_bitmap, c3.id)
+
+    def test_type_bitmaps(self):
+        bitmap = self.make_bitmap([])
+        self.assertEqual(set(c.id for c in self.commits),
+                         set(bitmap.iter_shas(bitmap.commits)))
+        self.assertEqual([self.tag.id], list(bitmap.iter_shas(bitmap.tags)))
+        self.assertEqual(4, len(list(bitmap.iter_shas(bitmap.blobs))))
+
+    def test_find_reachable(self):
+        c1, c2, c3, c4 = self.commits
+        bitmap = self.make_bitmap([c2])
+        fetched = []
+
+        def get_object(sha):
+            fetched.append(sha)
+            return self.store[sha]
+        reachable = bitmap.find_reachable([c4.id, self.tag.id], get_object)
+        self.assertEqual(self.reachable([c4.id, self.tag.id]),
+                         set(bitmap.iter_shas(reachable)))
+        # Nothing reachable from c2 had to be retrieved.
+        self.assertNotIn(c2.id, fetched)
+        self.assertNotIn(c1.id, fetched)
+        self.assertEqual(0, bitmap.find_reachable([], get_object))
+
+    def test_find_reachable_not_in_pack(self):
+        bitmap = self.make_bitmap([])
+        self.assertRaises(KeyError, bitmap.find_reachable, [b'1' * 40],
+                          self.store.__getitem__)
+
+    def test_skip_incomplete(self):
+        # Commits that can reach objects outside of the pack don't get a
+        # bitmap.
+        c5, = build_commit_graph(self.source, [[5]], trees={
+            5: [(b'a', make_object(Blob, data=b'other'))]})
+        pack = self.store.add_objects(
+            [(c5, None), (self.source[c5.tree], None)])
+        f = BytesIO()
+        self.assertEqual(0, write_pack_bitmap(f, pack, [c5.id])[0])
+
+    def test_check(self):
+        f = BytesIO()
+        write_pack_bitmap(f, self.pack, [self.commits[-1].id])
+        contents = f.getvalue()
+        bitmap = PackBitmap('pack.bitmap', self.pack.index,
+                            file=BytesIO(contents), contents=contents,
+                            size=len(contents))
+        bitmap.check()
+        contents = contents[:-1] + b'\x00'
+        bitmap = PackBitmap('pack.bitmap', self.pack.index,
+                            file=BytesIO(contents), contents=contents,
+                            size=len(contents))
+        self.assertRaises(ChecksumMismatch, bitmap.check)
+
+    def test_not_bitmap(self):
+        self.assertRaises(AssertionError, PackBitmap, 'foo', self.pack.index,
+                          file=BytesIO(), contents=b'PACK' + b'\x00' * 40)
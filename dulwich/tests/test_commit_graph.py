@@ -0,0 +1,152 @@
+# test_commit_graph.py -- Tests for commit-graph files
+# Copyright (C) 2015 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# or (at your option) any later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for commit-graph files."""
+
+from io import BytesIO
+import os
+import shutil
+import tempfile
+
+from dulwich.commit_graph import (
+    CommitGraph,
+    load_commit_graph,
+    write_commit_graph,
+    )
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.object_store import (
+    MemoryObjectStore,
+    )
+from dulwich.objects import (
+    Tree,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+from dulwich.tests.utils import (
+    build_commit_graph,
+    clear_commit_graph_generations,
+    make_commit,
+    make_object,
+    )
+
+
+class CommitGraphTests(TestCase):
+
+    def setUp(self):
+        super(CommitGraphTests, self).setUp()
+        self.store = MemoryObjectStore()
+        self.commits = build_commit_graph(
+            self.store, [[1], [2, 1], [3, 1], [4, 2, 3], [5], [6, 4, 5, 2]])
+
+    def make_commit_graph(self, commits):
+        f = BytesIO()
+        sha = write_commit_graph(f, commits)
+        contents = f.getvalue()
+        self.assertEqual(sha, contents[-20:])
+        return CommitGraph('commit-graph', file=BytesIO(contents),
+                           contents=contents, size=len(contents))
+
+    def test_empty(self):
+        graph = self.make_commit_graph([])
+        self.assertEqual(0, len(graph))
+        self.assertEqual([], list(graph))
+        self.assertRaises(KeyError, graph.get_parents, b'1' * 40)
+
+    def test_commits(self):
+        graph = self.make_commit_graph(self.commits)
+        self.assertEqual(6, len(graph))
+        self.assertEqual(sorted(c.id for c in self.commits), list(graph))
+        for commit in self.commits:
+            self.assertIn(commit.id, graph)
+            self.assertEqual(commit.parents, graph.get_parents(commit.id))
+            self.assertEqual(commit.tree, graph.get_tree(commit.id))
+            self.assertEqual(commit.commit_time,
+                             graph.get_commit_time(commit.id))
+        self.assertNotIn(b'1' * 40, graph)
+
+    def test_binary_sha(self):
+        graph = self.make_commit_graph(self.commits)
+        commit = self.commits[3]
+        self.assertEqual(commit.parents,
+                         graph.get_parents(commit.sha().digest()))
+
+    def test_generations(self):
+        graph = self.make_commit_graph(self.commits)
+        self.assertEqual([1, 2, 2, 3, 1, 4],
+                         [graph.get_generation(c.id) for c in self.commits])
+
+    def test_no_generations(self):
+        f = BytesIO()
+        write_commit_graph(f, self.commits)
+        contents = clear_commit_graph_generations(f.getvalue())
+        graph = CommitGraph('commit-graph', file=BytesIO(contents),
+                            contents=contents, size=len(contents))
+        graph.check()
+        for commit in self.commits:
+            self.assertEqual(None, graph.get_generation(commit.id))
+            self.assertEqual(commit.parents, graph.get_parents(commit.id))
+            self.assertEqual(commit.commit_time,
+                             graph.get_commit_time(commit.id))
+
+    def test_large_commit_time(self):
+        commit = make_commit(commit_time=2**33 + 42, parents=[])
+        graph = self.make_commit_graph([commit])
+        self.assertEqual(2**33 + 42, graph.get_commit_time(commit.id))
+
+    def test_long_history(self):
+        tree = make_object(Tree)
+        commits = [make_commit(tree=tree.id, parents=[], commit_time=0)]
+        for i in range(1, 2000):
+            commits.append(make_commit(
+                tree=tree.id, parents=[commits[-1].id], commit_time=i))
+        graph = self.make_commit_graph(reversed(commits))
+        self.assertEqual(2000, graph.get_generation(commits[-1].id))
+
+    def test_missing_parent(self):
+        self.assertRaises(ValueError, self.make_commit_graph,
+                          self.commits[1:])
+
+    def test_check(self):
+        f = BytesIO()
+        write_commit_graph(f, self.commits)
+        contents = f.getvalue()
+        graph = CommitGraph('commit-graph', file=BytesIO(contents),
+                            contents=contents, size=len(contents))
+        graph.check()
+        contents = contents[:-1] + b'\x00'
+        graph = CommitGraph('commit-graph', file=BytesIO(contents),
+                            contents=contents, size=len(contents))
+        self.assertRaises(ChecksumMismatch, graph.check)
+
+    def test_not_commit_graph(self):
+        self.assertRaises(AssertionError, CommitGraph, 'foo',
+                          file=BytesIO(), contents=b'PACK' + b'\x00' * 28)
+
+    def test_load(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'commit-graph')
+        with open(path, 'wb') as f:
+            sha = write_commit_graph(f, self.commits)
+        with load_commit_graph(path) as graph:
+            self.assertEqual(sha, graph.get_stored_checksum())
+            self.assertEqual(self.commits[5].parents,
+                             graph.get_parents(self.commits[5].id))
@@ -0,0 +1,147 @@
+# test_midx.py -- Tests for multi-pack-index files
+# Copyright (C) 2015 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# or (at your option) any later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for multi-pack-index files."""
+
+from io import BytesIO
+import os
+import shutil
+import tempfile
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.midx import (
+    MultiPackIndex,
+    load_multi_pack_index,
+    write_multi_pack_index,
+    )
+from dulwich.pack import (
+    MemoryPackIndex,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+
+
+def _sha(c):
+    return c * 20
+
+
+class MultiPackIndexTests(TestCase):
+
+    def make_midx(self, pack_indexes):
+        f = BytesIO()
+        write_multi_pack_index(f, pack_indexes)
+        contents = f.getvalue()
+        return MultiPackIndex('multi-pack-index', file=BytesIO(contents),
+                              contents=contents, size=len(contents))
+
+    def test_empty(self):
+        midx = self.make_midx([('pack-1.idx', MemoryPackIndex([]))])
+        self.assertEqual(0, len(midx))
+        self.assertEqual(['pack-1.idx'], midx.pack_names)
+        self.assertEqual([], list(midx.iterentries()))
+        self.assertRaises(KeyError, midx.object_index, _sha(b'\x01'))
+
+    def test_single_pack(self):
+        midx = self.make_midx([('pack-1.idx', MemoryPackIndex([
+            (_sha(b'\x01'), 12, None),
+            (_sha(b'\xfe'), 42, None),
+            ]))])
+        self.assertEqual(2, len(midx))
+        self.assertEqual(('pack-1.idx', 12), midx.object_index(_sha(b'\x01')))
+        self.assertEqual(('pack-1.idx', 42),
+                         midx.object_index(b'fe' * 20))
+        self.assertRaises(KeyError, midx.object_index, _sha(b'\x00'))
+        self.assertRaises(KeyError, midx.object_index, _sha(b'\xff'))
+        self.assertIn(_sha(b'\xfe'), midx)
+        self.assertNotIn(_sha(b'\x02'), midx)
+        self.assertEqual([b'01' * 20, b'fe' * 20], list(midx))
+
+    def test_multiple_packs(self):
+        midx = self.make_midx([
+            ('pack-2.idx', MemoryPackIndex([
+                (_sha(b'\x01'), 12, None),
+                (_sha(b'\x03'), 24, None),
+                ])),
+            ('pack-1.idx', MemoryPackIndex([
+                (_sha(b'\x02'), 12, None),
+                (_sha(b'\x03'), 36, None),
+                ])),
+            ])
+        # Pack names are sorted.
+        self.assertEqual(['pack-1.idx', 'pack-2.idx'], midx.pack_names)
+        self.assertEqual([
+            (_sha(b'\x01'), 'pack-2.idx', 12),
+            (_sha(b'\x02'), 'pack-1.idx', 12),
+            # Objects in several packs are taken from the first pack given.
+            (_sha(b'\x03'), 'pack-2.idx', 24),
+            ], list(midx.iterentries()))
+
+    def test_large_offsets(self):
+        midx = self.make_midx([('pack-1.idx', MemoryPackIndex([
+            (_sha(b'\x01'), 2**31, None),
+            (_sha(b'\x02'), 2**31 - 1, None),
+            (_sha(b'\x03'), 2**40, None),
+            ]))])
+        self.assertEqual(('pack-1.idx', 2**31),
+                         midx.object_index(_sha(b'\x01')))
+        self.assertEqual(('pack-1.idx', 2**31 - 1),
+                         midx.object_index(_sha(b'\x02')))
+        self.assertEqual(('pack-1.idx', 2**40),
+                         midx.object_index(_sha(b'\x03')))
+
+    def test_missing_large_offsets(self):
+        f = BytesIO()
+        write_multi_pack_index(f, [('pack-1.idx', MemoryPackIndex([
+            (_sha(b'\x01'), 2**31, None)]))])
+        # Hide the large offsets chunk by renaming it in the chunk table.
+        contents = f.getvalue().replace(b'LOFF', b'XOFF', 1)
+        self.assertRaises(ValueError, MultiPackIndex, 'multi-pack-index',
+                          file=BytesIO(contents), contents=contents,
+                          size=len(contents))
+
+    def test_check(self):
+        f = BytesIO()
+        write_multi_pack_index(f, [('pack-1.idx', MemoryPackIndex([
+            (_sha(b'\x01'), 12, None)]))])
+        contents = f.getvalue()
+        midx = MultiPackIndex('multi-pack-index', file=BytesIO(contents),
+                              contents=contents, size=len(contents))
+        midx.check()
+        contents = contents[:-1] + b'\x00'
+        midx = MultiPackIndex('multi-pack-index', file=BytesIO(contents),
+                              contents=contents, size=len(contents))
+        self.assertRaises(ChecksumMismatch, midx.check)
+
+    def test_not_midx(self):
+        self.assertRaises(AssertionError, MultiPackIndex, 'foo',
+                          file=BytesIO(), contents=b'PACK' + b'\x00' * 28)
+
+    def test_load(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'multi-pack-index')
+        with open(path, 'wb') as f:
+            sha = write_multi_pack_index(f, [
+                ('pack-1.idx', MemoryPackIndex([(_sha(b'\x01'), 12, None)]))])
+        with load_multi_pack_index(path) as midx:
+            self.assertEqual(sha, midx.get_stored_checksum())
+            self.assertEqual(('pack-1.idx', 12),
+                             midx.object_index(_sha(b'\x01')))
@@ -16,8 +16,10 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
+from dulwich import object_store
 from dulwich.object_store import (
     MemoryObjectStore,
+    MissingObjectFinder,
     )
 from dulwich.objects import (
     Blob,
@@ -247,3 +249,102 @@ class MOFTagsTest(MissingObjectFinderTest):
         self.assertMissingMatch([], [self._tag_of_tag_of_blob.id],
                                 [self._tag_of_tag_of_blob.id,
                                  self._tag_of_blob.id, self.f1_1_id])
+
+    def test_tagged_not_retained(self):
+        # The tag is queued both as a want and as a tag of the commit.
+        finder = MissingObjectFinder(
+            self.store, [], [self.cmt(1).id, self._normal_tag.id],
+            get_tagged=lambda: {self.cmt(1).id: self._normal_tag.id})
+        self.assertEqual(
+            set([self.cmt(1).id, self.cmt(1).tree, self.f1_1_id,
+                 self._normal_tag.id]),
+            set(sha for (sha, path) in iter(finder.next, None)))
+        self.assertEqual({}, finder._retrieved)
+
+
+class MOFLongHistoryTest(MissingObjectFinderTest):
+
+    def setUp(self):
+        super(MOFLongHistoryTest, self).setUp()
+        blobs = [make_object(Blob, data=('f1-%d' % i).encode('ascii'))
+                 for i in range(20)]
+        commit_spec = [[1]] + [[i, i - 1] for i in range(2, 21)]
+        trees = dict((i, [(b'f1', blobs[i - 1])]) for i in range(1, 21))
+        self.commits = build_commit_graph(self.store, commit_spec, trees)
+        self.blobs = blobs
+
+    def test_history_not_walked(self):
+        # Generation numbers are cached once computed.
+        self.store.get_generation(self.cmt(20).id)
+        walked = []
+        get_parents = self.store.get_parents
+
+        def record_parents(sha):
+            walked.append(sha)
+            return get_parents(sha)
+        self.store.get_parents = record_parents
+        self.assertMissingMatch([self.cmt(18).id], [self.cmt(20).id], [
+            self.cmt(20).id, self.cmt(19).id,
+            self.cmt(20).tree, self.cmt(19).tree,
+            self.blobs[19].id, self.blobs[18].id])
+        self.assertEqual(
+            set([self.cmt(20).id, self.cmt(19).id]),
+            set(walked))
+
+    def test_get_parents(self):
+        finder = MissingObjectFinder(
+            self.store, [self.cmt(18).id], [self.cmt(20).id],
+            get_parents=lambda commit: commit.parents)
+        self.assertEqual(
+            set([self.cmt(20).id, self.cmt(19).id, self.cmt(20).tree,
+                 self.cmt(19).tree, self.blobs[19].id, self.blobs[18].id]),
+            set(sha for (sha, path) in iter(finder.next, None)))
+
+    def test_binary_sha_done(self):
+        finder = MissingObjectFinder(
+            self.store, [self.cmt(19).id], [self.cmt(20).id])
+        self.assertEqual(
+            set([self.cmt(19).sha().digest(),
+                 self.blobs[18].sha().digest()]),
+            finder.sha_done)
+        self.assertTrue(finder.is_done(self.blobs[18].id))
+        self.assertFalse(finder.is_done(self.blobs[19].id))
+
+    def test_missing_object_in_batch(self):
+        del self.store._data[self.cmt(19).tree]
+        finder = MissingObjectFinder(
+            self.store, [self.cmt(18).id], [self.cmt(20).id])
+        finder.add_todo([(self.cmt(20).tree, "", False),
+                         (self.cmt(19).tree, "", False)])
+        # The trees of both commits are retrieved at once.
+        self.assertEqual(
+            self.store[self.cmt(20).tree],
+            finder._retrieve(self.cmt(20).tree))
+        self.assertRaises(KeyError, finder._retrieve, self.cmt(19).tree)
+
+
+class MOFManyTreesTest(MissingObjectFinderTest):
+
+    def setUp(self):
+        super(MOFManyTreesTest, self).setUp()
+        blobs = [make_object(Blob, data=('f-%d' % i).encode('ascii'))
+                 for i in range(30)]
+        trees = {1: [(('d%d/f' % i).encode('ascii'), blob)
+                     for (i, blob) in enumerate(blobs)]}
+        self.commits = build_commit_graph(self.store, [[1]], trees)
+
+    def test_retrieved_bounded(self):
+        self.addCleanup(setattr, object_store, '_OBJECT_BATCH_SIZE',
+                        object_store._OBJECT_BATCH_SIZE)
+        object_store._OBJECT_BATCH_SIZE = 4
+        finder = MissingObjectFinder(self.store, [], [self.cmt(1).id])
+        sent = []
+        while True:
+            entry = finder.next()
+            if entry is None:
+                break
+            sent.append(entry[0])
+            self.assertTrue(len(finder._retrieved) <= 4)
+        # The commit, the root tree, 30 subtrees and 30 blobs.
+        self.assertEqual(62, len(set(sent)))
+        self.assertEqual({}, finder._retrieved)
@@ -24,6 +24,9 @@ import os
 import shutil
 import tempfile
 
+from dulwich.config import (
+    ConfigDict,
+    )
 from dulwich.index import (
     commit_tree,
     )
@@ -37,13 +40,20 @@ from dulwich.objects import (
     TreeEntry,
     )
 from dulwich.object_store import (
+    CommitCache,
     DiskObjectStore,
     MemoryObjectStore,
     ObjectStoreGraphWalker,
+    _geometric_rollup,
     tree_lookup_path,
     )
 from dulwich.pack import (
+    OFS_DELTA,
     REF_DELTA,
+    MemoryPackIndex,
+    Pack,
+    PackData,
+    write_pack_data,
     write_pack_objects,
     )
 from dulwich.tests import (
@@ -52,7 +62,9 @@ from dulwich.tests import (
 from dulwich.tests.utils import (
     make_object,
     make_tag,
+    build_commit_graph,
     build_pack,
+    clear_commit_graph_generations,
     )
 
 
@@ -184,6 +196,55 @@ class ObjectStoreTests(object):
         self.assertEqual((Blob.type_num, b'yummy data'),
                          self.store.get_raw(testobject.id))
 
+    def test_iter_raw(self):
+        self.store.add_object(testobject)
+        blob = make_object(Blob, data=b'more yummy data')
+        self.store.add_object(blob)
+        self.assertEqual(
+            [(blob.id, Blob.type_num, b'more yummy data'),
+             (testobject.id, Blob.type_num, b'yummy data')],
+            sorted((sha, type_num, b''.join(chunks)) for (sha, type_num, chunks)
+                   in self.store.iter_raw([testobject.id, blob.sha().digest()])))
+        self.assertEqual([], list(self.store.iter_raw([])))
+        self.assertRaises(KeyError, list,
+                          self.store.iter_raw([testobject.id, b'1' * 40]))
+
+    def test_get_many(self):
+        self.store.add_object(testobject)
+        self.assertEqual([testobject],
+                         list(self.store.get_many([testobject.id])))
+        self.assertRaises(KeyError, list, self.store.get_many([b'1' * 40]))
+
+    def test_iter_pack_records(self):
+        self.store.add_object(testobject)
+        f = BytesIO()
+        entries, checksum = write_pack_data(
+            f, 1, self.store.iter_pack_records([testobject.id]))
+        offset, crc32 = entries[testobject.sha().digest()]
+        data = PackData.from_file(BytesIO(f.getvalue()), len(f.getvalue()))
+        self.assertEqual((Blob.type_num, [b'yummy data']),
+                         data.get_object_at(offset))
+
+    def test_commit_metadata(self):
+        c1, c2, c3 = build_commit_graph(self.store, [[1], [2], [3, 1, 2]])
+        self.assertEqual([c1.id, c2.id], self.store.get_parents(c3.id))
+        self.assertEqual([], self.store.get_parents(c1.id))
+        self.assertEqual(c3.commit_time, self.store.get_commit_time(c3.id))
+        self.assertEqual(c3.tree, self.store.get_commit_tree(c3.id))
+        self.assertRaises(KeyError, self.store.get_parents, b'1' * 40)
+
+    def test_commit_cache(self):
+        c1, c2 = build_commit_graph(self.store, [[1], [2, 1]])
+        self.store.commit_cache.clear()
+        hits = self.store.commit_cache.hits
+        self.store.get_parents(c2.id)
+        self.assertEqual(c2.tree, self.store.get_commit_tree(c2.id))
+        self.assertEqual(c2.commit_time, self.store.get_commit_time(c2.id))
+        stats = self.store.commit_cache.stats()
+        self.assertEqual(hits + 2, stats['hits'])
+        self.assertEqual(1, stats['commits'])
+        self.assertTrue(0 < stats['size'] <= stats['max_size'])
+
     def test_close(self):
         # For now, just check that close doesn't barf.
         self.store.add_object(testobject)
@@ -342,6 +403,386 @@ class DiskObjectStoreTests(PackBasedObjectStoreTests, TestCase):
         finally:
             o.close()
 
+    def test_add_thin_pack_index_processes(self):
+        o = DiskObjectStore(self.store_dir, index_processes=2)
+        try:
+            blob = make_object(Blob, data=b'yummy data')
+            o.add_object(blob)
+
+            f = BytesIO()
+            entries = build_pack(f, [
+              (Blob.type_num, b'other data'),
+              (REF_DELTA, (blob.id, b'more yummy data')),
+              (OFS_DELTA, (1, b'more yummy data, and more')),
+              ], store=o)
+
+            with o.add_thin_pack(f.read, None) as pack:
+                pack.check()
+                self.assertEqual(
+                    sorted([blob.id] +
+                           [sha_to_hex(entry[3]) for entry in entries]),
+                    list(pack))
+                self.assertEqual((Blob.type_num, b'more yummy data, and more'),
+                                 o.get_raw(sha_to_hex(entries[2][3])))
+        finally:
+            o.close()
+
+    def test_add_pack_index_processes(self):
+        self.store.index_processes = 2
+        shas = self._add_delta_pack()
+        pack, = self.store.packs
+        pack.check()
+        self.assertEqual(sorted(shas), list(pack))
+        self.assertEqual((Blob.type_num, b'more yummy data'),
+                         self.store.get_raw(shas[2]))
+
+    def _build_history(self):
+        source = MemoryObjectStore()
+        blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii'))
+                 for i in range(3)]
+        commits = build_commit_graph(source, [[1], [2, 1], [3, 2]], trees={
+            1: [(b'a', blobs[0])],
+            2: [(b'a', blobs[1]), (b'b', blobs[0])],
+            3: [(b'a', blobs[2]), (b'b', blobs[0])],
+            })
+        pack = self.store.add_objects(
+            [(source[sha], None) for sha in source])
+        return source, commits, pack
+
+    def test_commit_graph(self):
+        c1, c2, c3 = build_commit_graph(self.store, [[1], [2, 1], [3, 1, 2]])
+        self.assertEqual(None, self.store.get_generation(c3.id))
+        self.assertEqual(3, self.store.write_commit_graph([c3.id]))
+        self.assertEqual(3, self.store.get_generation(c3.id))
+        self.assertEqual(1, self.store.get_generation(c1.id))
+        # The commit-graph is used rather than the commit objects.
+        for commit in (c1, c2, c3):
+            os.remove(self.store._get_shafile_path(commit.id))
+        self.assertEqual([c1.id, c2.id], self.store.get_parents(c3.id))
+        self.assertEqual(c2.commit_time, self.store.get_commit_time(c2.id))
+        self.assertRaises(KeyError, self.store.get_parents, b'1' * 40)
+        self.assertEqual(None, self.store.get_generation(b'1' * 40))
+        # Generation numbers of commits that are not in the commit-graph are
+        # computed from those of their parents.
+        c4, = build_commit_graph(self.store, [[4]], attrs={
+            4: {'parents': [c3.id, c1.id]}})
+        self.assertEqual(4, self.store.get_generation(c4.id))
+
+    def test_commit_graph_no_generations(self):
+        c1, c2, c3 = build_commit_graph(self.store, [[1], [2, 1], [3, 1, 2]])
+        self.store.write_commit_graph([c3.id])
+        path = os.path.join(self.store.path, 'info', 'commit-graph')
+        with open(path, 'rb') as f:
+            contents = f.read()
+        with open(path, 'wb') as f:
+            f.write(clear_commit_graph_generations(contents))
+        store = DiskObjectStore(self.store_dir)
+        self.addCleanup(store.close)
+        self.assertEqual(None, store.get_generation(c3.id))
+        self.assertEqual([c1.id, c2.id], store.get_parents(c3.id))
+        # Nor can the generation numbers of newer commits be computed.
+        c4, = build_commit_graph(store, [[4]], attrs={
+            4: {'parents': [c3.id]}})
+        self.assertEqual(None, store.get_generation(c4.id))
+        self.assertEqual(
+            set([c4.id, c4.tree]),
+            set(sha for (sha, path) in store.find_missing_objects(
+                [c3.id], [c4.id])))
+
+    def test_commit_graph_tag(self):
+        c1, c2 = build_commit_graph(self.store, [[1], [2, 1]])
+        tag = make_tag(c2)
+        self.store.add_object(tag)
+        self.store.add_object(testobject)
+        self.assertEqual(
+            2, self.store.write_commit_graph([tag.id, testobject.id]))
+        self.assertEqual(2, self.store.get_generation(c2.id))
+
+    def test_find_missing_objects_bitmap(self):
+        source, (c1, c2, c3), pack = self._build_history()
+        tag = make_tag(c3)
+        self.store.add_object(tag)
+        self.assertEqual(1, self.store.write_pack_bitmap(pack, [c2.id]))
+        self.assertTrue(os.path.exists(pack._basename + '.bitmap'))
+        self.assertIsNot(None, self.store._get_pack_bitmap())
+        expected = set(sha for (sha, path) in source.find_missing_objects(
+            [c1.id], [c3.id], get_parents=lambda commit: commit.parents))
+        self.assertEqual(
+            expected, set(sha for (sha, path) in
+                          self.store._find_missing_objects_bitmap(
+                              [c1.id], [c3.id])))
+        self.assertEqual(
+            expected | set([tag.id]),
+            set(sha for (sha, path) in self.store.find_missing_objects(
+                [c1.id], [c3.id], get_tagged=lambda: {c3.id: tag.id})))
+
+    def test_find_missing_objects_bitmap_loose(self):
+        source, (c1, c2, c3), pack = self._build_history()
+        self.store.write_pack_bitmap(pack, [c3.id])
+        c4, = build_commit_graph(self.store, [[4]], attrs={
+            4: {'parents': [c3.id]}})
+        # c4 is not in the pack, so the bitmap can not be used.
+        self.assertEqual(
+            None, self.store._find_missing_objects_bitmap([c2.id], [c4.id]))
+        self.assertEqual(
+            set([c4.id, c4.tree, c3.id, c3.tree, source[c3.tree][b'a'][1]]),
+            set(sha for (sha, path) in self.store.find_missing_objects(
+                [c2.id], [c4.id])))
+
+    def test_pack_bitmap_outdated(self):
+        source, (c1, c2, c3), pack = self._build_history()
+        self.store.write_pack_bitmap(pack, [c3.id])
+        with open(pack._basename + '.bitmap', 'r+b') as f:
+            # Overwrite the pack checksum in the bitmap header.
+            f.seek(12)
+            f.write(b'\xff' * 20)
+        self.store._update_pack_cache()
+        self.assertEqual(None, self.store._get_pack_bitmap())
+
+    def _add_delta_pack(self):
+        f, commit, abort = self.store.add_pack()
+        try:
+            entries = build_pack(f, [
+                (Blob.type_num, b'yummy data'),
+                (OFS_DELTA, (0, b'yummy data, and more')),
+                (REF_DELTA, (0, b'more yummy data')),
+                ], store=self.store)
+        except:
+            abort()
+            raise
+        else:
+            commit()
+        return [sha_to_hex(entry[3]) for entry in entries]
+
+    def _write_pack_records(self, shas):
+        f = BytesIO()
+        entries, checksum = write_pack_data(
+            f, len(shas), self.store.iter_pack_records(shas))
+        data = PackData.from_file(BytesIO(f.getvalue()), len(f.getvalue()))
+        index = MemoryPackIndex(
+            sorted((sha, offset, crc32)
+                   for (sha, (offset, crc32)) in entries.items()),
+            checksum)
+        return Pack.from_objects(data, index)
+
+    def test_loose_listing_cached(self):
+        self.store.add_object(testobject)
+        path = self.store._get_shafile_path(testobject.id)
+        dir = os.path.dirname(path)
+        other = testobject.id[:2] + b'1' * 38
+        # Listings of recently modified directories are cached, but not
+        # trusted to be complete.
+        self.assertFalse(self.store.contains_loose(other))
+        self.assertFalse(self.store._loose_listings[dir][3])
+        shutil.copy(path, self.store._get_shafile_path(other))
+        self.assertTrue(self.store.contains_loose(other))
+        os.remove(self.store._get_shafile_path(other))
+        mtime = os.stat(dir).st_mtime - 10
+        os.utime(dir, (mtime, mtime))
+        self.assertFalse(self.store.contains_loose(other))
+        self.assertTrue(self.store.contains_loose(testobject.id))
+        # Sneak an object in without changing the mtime; the cached listing
+        # is used.
+        shutil.copy(path, self.store._get_shafile_path(other))
+        os.utime(dir, (mtime, mtime))
+        self.assertFalse(self.store.contains_loose(other))
+        self.assertRaises(KeyError, self.store.get_raw, other)
+        # Adding an object changes the mtime, which invalidates the listing.
+        blob = make_object(Blob, data=b'more yummy data')
+        self.store.add_object(blob)
+        blob_dir = os.path.dirname(self.store._get_shafile_path(blob.id))
+        os.utime(blob_dir, (mtime + 1, mtime + 1))
+        os.utime(dir, (mtime + 1, mtime + 1))
+        self.assertTrue(self.store.contains_loose(other))
+        self.assertTrue(self.store.contains_loose(blob.id))
+
+    def test_pack_hits(self):
+        blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii'))
+                 for i in range(3)]
+        packs = [self.store.add_objects([(blob, None)]) for blob in blobs]
+        names = [os.path.basename(pack._basename) for pack in packs]
+        for blob in [blobs[2], blobs[1], blobs[2]]:
+            self.assertEqual(blob.as_raw_string(),
+                             self.store.get_raw(blob.id)[1])
+        self.assertEqual({names[0]: 0, names[1]: 1, names[2]: 2},
+                         self.store.pack_hits)
+        # The most recently hit pack is tried first.
+        self.assertEqual([names[2], names[1], names[0]],
+                         [name for (name, pack) in self.store._ordered_packs()])
+        self.assertRaises(KeyError, self.store.get_raw, b'1' * 40)
+
+    def test_pack_hits_many(self):
+        blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii'))
+                 for i in range(3)]
+        packs = [self.store.add_objects([(blob, None)]) for blob in blobs]
+        names = [os.path.basename(pack._basename) for pack in packs]
+        self.assertEqual(
+            set([blobs[0].id, blobs[2].id]),
+            set(sha for (sha, type_num, chunks)
+                in self.store.iter_raw([blobs[0].id, blobs[2].id])))
+        self.assertEqual({names[0]: 1, names[1]: 0, names[2]: 1},
+                         self.store.pack_hits)
+        self.assertEqual(names[1], self.store._ordered_packs()[-1][0])
+
+    def test_refresh_interval(self):
+        o = DiskObjectStore(self.store_dir, refresh_interval=None,
+                            refresh_on_miss=False)
+        self.addCleanup(o.close)
+        self.assertEqual([], list(o.packs))
+        # Packs added by others are not noticed until the store is refreshed.
+        self.store.add_objects([(testobject, None)])
+        self.assertEqual([], list(o.packs))
+        self.assertNotIn(testobject.id, o)
+        o.refresh()
+        self.assertIn(testobject.id, o)
+        # The same goes for loose objects.
+        blob = make_object(Blob, data=b'more yummy data')
+        other = make_object(Blob, data=b'other data')
+        dir = os.path.dirname(self.store._get_shafile_path(blob.id))
+        os.mkdir(dir)
+        mtime = os.stat(dir).st_mtime - 10
+        os.utime(dir, (mtime, mtime))
+        self.assertNotIn(blob.id, o)
+        self.store.add_object(blob)
+        self.assertNotIn(blob.id, o)
+        o.refresh()
+        self.assertIn(blob.id, o)
+        # Objects added through the store itself are seen right away.
+        o.add_object(other)
+        self.assertIn(other.id, o)
+
+    def test_refresh_on_miss(self):
+        o = DiskObjectStore(self.store_dir, refresh_interval=None)
+        self.addCleanup(o.close)
+        self.assertEqual([], list(o.packs))
+        self.store.add_objects([(testobject, None)])
+        self.assertEqual((Blob.type_num, b'yummy data'),
+                         o.get_raw(testobject.id))
+        blob = make_object(Blob, data=b'more yummy data')
+        self.assertNotIn(blob.id, o)
+        self.store.add_object(blob)
+        self.assertIn(blob.id, o)
+        other = make_object(Blob, data=b'other data')
+        self.store.add_objects([(other, None)])
+        self.assertEqual([other], list(o.get_many([other.id])))
+        self.assertRaises(KeyError, o.get_raw, b'1' * 40)
+
+    def test_iter_raw_mixed(self):
+        alternate_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, alternate_dir)
+        alternate_store = DiskObjectStore(alternate_dir)
+        alternate_blob = make_object(Blob, data=b'alternate data')
+        alternate_store.add_object(alternate_blob)
+        self.store.add_alternate_path(alternate_dir)
+        shas = self._add_delta_pack()
+        loose_blob = make_object(Blob, data=b'loose data')
+        self.store.add_object(loose_blob)
+        wanted = [alternate_blob.id, loose_blob.id] + list(reversed(shas))
+        retrieved = [(sha, type_num, b''.join(chunks))
+                     for (sha, type_num, chunks) in self.store.iter_raw(wanted)]
+        # Packed objects come first, in pack order.
+        self.assertEqual(shas, [sha for (sha, type_num, raw) in retrieved[:3]])
+        self.assertEqual(
+            sorted((sha,) + self.store.get_raw(sha) for sha in wanted),
+            sorted(retrieved))
+
+    def test_iter_pack_records_reuses_deltas(self):
+        shas = self._add_delta_pack()
+        pack = self._write_pack_records(shas)
+        self.assertEqual(
+            [Blob.type_num, OFS_DELTA, OFS_DELTA],
+            [pack.get_unpacked_object(sha).pack_type_num for sha in shas])
+        for sha in shas:
+            self.assertEqual(self.store.get_raw(sha), pack.get_raw(sha))
+
+    def test_iter_pack_records_base_not_sent(self):
+        shas = self._add_delta_pack()[1:]
+        pack = self._write_pack_records(shas)
+        self.assertEqual(
+            [Blob.type_num, Blob.type_num],
+            [pack.get_unpacked_object(sha).pack_type_num for sha in shas])
+        for sha in shas:
+            self.assertEqual(self.store.get_raw(sha), pack.get_raw(sha))
+
+    def test_delta_base_cache(self):
+        alternate_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, alternate_dir)
+        alternate_store = DiskObjectStore.init(alternate_dir)
+        alternate_store.add_objects([(testobject, None)])
+        alternate_store.close()
+        store = DiskObjectStore(self.store_dir, delta_base_cache_size=1024)
+        self.addCleanup(store.close)
+        self.assertEqual([], store.alternates)
+        store.add_alternate_path(alternate_dir)
+        b1 = make_object(Blob, data=b"more yummy data")
+        store.add_objects([(b1, None)])
+        self.assertEqual(1024, store.delta_base_cache.stats()['max_size'])
+        for s in [store] + store.alternates:
+            for pack in s.packs:
+                self.assertIs(store.delta_base_cache,
+                              pack.data._delta_base_cache)
+        for s in store.alternates:
+            s.close()
+
+    def test_write_multi_pack_index(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        b2 = make_object(Blob, data=b"more yummy data")
+        b3 = make_object(Blob, data=b"even more yummy data")
+        self.store.add_objects([(b1, None), (b2, None)])
+        self.store.add_objects([(b2, None), (b3, None)])
+        self.assertEqual(2, self.store.write_multi_pack_index())
+        self.store.add_objects([(testobject, None)])
+        store = DiskObjectStore(self.store_dir)
+        self.addCleanup(store.close)
+        list(store.packs)
+        self.assertEqual(3, len(store._midx))
+        for obj in [b1, b2, b3, testobject]:
+            self.assertTrue(store.contains_packed(obj.id))
+            self.assertEqual(obj, store[obj.id])
+        self.assertFalse(store.contains_packed(b"a" * 40))
+
+    def test_iter_raw_multi_pack_index(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        b2 = make_object(Blob, data=b"more yummy data")
+        p1 = self.store.add_objects([(b1, None)])
+        p2 = self.store.add_objects([(b2, None)])
+        self.store.write_multi_pack_index()
+        p3 = self.store.add_objects([(testobject, None)])
+        store = DiskObjectStore(self.store_dir)
+        self.addCleanup(store.close)
+        shas = [b1.id, b2.id, testobject.id]
+        self.assertEqual(
+            dict((obj.id, obj.as_raw_string())
+                 for obj in [b1, b2, testobject]),
+            dict((sha, b''.join(chunks))
+                 for (sha, type_num, chunks) in store.iter_raw(shas)))
+        self.assertEqual(
+            dict((os.path.basename(pack._basename), 1)
+                 for pack in [p1, p2, p3]),
+            store.pack_hits)
+        self.assertRaises(KeyError, list, store.iter_raw([b"a" * 40]))
+
+    def test_write_multi_pack_index_no_packs(self):
+        self.assertEqual(0, self.store.write_multi_pack_index())
+        self.assertFalse(os.path.exists(
+            os.path.join(self.store.pack_dir, "multi-pack-index")))
+
+    def test_stale_multi_pack_index(self):
+        pack = self.store.add_objects([(testobject, None)])
+        self.store.write_multi_pack_index()
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.store.add_objects([(testobject, None), (b2, None)])
+        self.store.close()
+        os.remove(pack._data_path)
+        os.remove(pack._idx_path)
+        store = DiskObjectStore(self.store_dir)
+        self.addCleanup(store.close)
+        self.assertEqual(testobject, store[testobject.id])
+        self.assertEqual(
+            [testobject.id],
+            [sha for (sha, type_num, chunks)
+             in store.iter_raw([testobject.id])])
+
     def test_add_thin_pack_empty(self):
         o = DiskObjectStore(self.store_dir)
 
@@ -350,6 +791,184 @@ class DiskObjectStoreTests(PackBasedObjectStoreTests, TestCase):
         self.assertEqual([], entries)
         o.add_thin_pack(f.read, None)
 
+    def test_from_config(self):
+        config = ConfigDict()
+        store = DiskObjectStore.from_config(self.store_dir, config)
+        self.assertEqual(-1, store.pack_compression_level)
+        self.assertEqual(-1, store.loose_compression_level)
+        config.set((b'core', ), b'compression', b'1')
+        store = DiskObjectStore.from_config(self.store_dir, config)
+        self.assertEqual(1, store.pack_compression_level)
+        self.assertEqual(1, store.loose_compression_level)
+        config.set((b'pack', ), b'compression', b'0')
+        config.set((b'core', ), b'loosecompression', b'9')
+        store = DiskObjectStore.from_config(self.store_dir, config)
+        self.assertEqual(0, store.pack_compression_level)
+        self.assertEqual(9, store.loose_compression_level)
+        config.set((b'pack', ), b'compression', b'10')
+        self.assertRaises(ValueError, DiskObjectStore.from_config,
+                          self.store_dir, config)
+
+    def test_compression_level(self):
+        store = DiskObjectStore(self.store_dir, pack_compression_level=0,
+                                loose_compression_level=0)
+        self.addCleanup(store.close)
+        b1 = make_object(Blob, data=b'loose data ' * 10)
+        b2 = make_object(Blob, data=b'packed data ' * 10)
+        store.add_object(b1)
+        pack = store.add_objects([(b2, None)])
+        # Without compression, the data is stored as-is.
+        with open(store._get_shafile_path(b1.id), 'rb') as f:
+            self.assertIn(b1.data, f.read())
+        with open(pack._data_path, 'rb') as f:
+            self.assertIn(b2.data, f.read())
+        self.assertEqual(b1, store[b1.id])
+        self.assertEqual(b2, store[b2.id])
+
+    def _add_blob_pack(self, count, prefix):
+        blobs = [make_object(Blob, data=('%s %d' % (prefix, i)).encode('ascii'))
+                 for i in range(count)]
+        self.store.add_objects([(b, None) for b in blobs])
+        return blobs
+
+    def test_repack(self):
+        blobs = self._add_blob_pack(2, 'first') + self._add_blob_pack(3, 'second')
+        kept = self.store.add_objects([(testobject, None)])
+        kept.keep()
+        loose = make_object(Blob, data=b'loose data')
+        self.store.add_object(loose)
+        # Another store reading from the packs.
+        reader = DiskObjectStore(self.store_dir)
+        self.addCleanup(reader.close)
+        self.assertEqual(blobs[0], reader[blobs[0].id])
+        pack = self.store.repack()
+        self.assertEqual(len(blobs) + 1, len(pack))
+        self.assertEqual(
+            sorted([os.path.basename(pack._basename),
+                    os.path.basename(kept._basename)]),
+            sorted(name for name in os.listdir(self.store.pack_dir)
+                   if name.endswith(".pack") and name.startswith("pack-")
+                   for name in [name[:-len(".pack")]]))
+        self.assertEqual([], list(self.store._iter_loose_objects()))
+        for o in blobs + [loose, testobject]:
+            self.assertEqual(o, self.store[o.id])
+            self.assertEqual(o, reader[o.id])
+        # Nothing left to merge.
+        self.assertEqual(None, self.store.repack())
+
+    def test_repack_loose_only(self):
+        blobs = [make_object(Blob, data=('loose %d' % i).encode('ascii'))
+                 for i in range(2)]
+        for blob in blobs:
+            self.store.add_object(blob)
+        pack = self.store.repack()
+        self.assertEqual(sorted(b.id for b in blobs), sorted(pack))
+        self.assertEqual([], list(self.store._iter_loose_objects()))
+        for o in blobs:
+            self.assertEqual(o, self.store[o.id])
+
+    def test_repack_failure(self):
+        self._add_blob_pack(2, 'first')
+        self._add_blob_pack(2, 'second')
+        before = sorted(os.listdir(self.store.pack_dir))
+
+        def iter_pack_records(shas):
+            raise IOError("disk failure")
+        self.store.iter_pack_records = iter_pack_records
+        self.assertRaises(IOError, self.store.repack)
+        # The partially written pack is removed.
+        self.assertEqual(before, sorted(os.listdir(self.store.pack_dir)))
+
+    def test_repack_reuses_deltas(self):
+        shas = self._add_delta_pack()
+        self._add_blob_pack(1, 'other')
+        pack = self.store.repack()
+        self.assertEqual(
+            [Blob.type_num, OFS_DELTA, OFS_DELTA],
+            [pack.get_unpacked_object(sha).pack_type_num for sha in shas])
+
+    def test_repack_geometric(self):
+        large = self._add_blob_pack(20, 'large')
+        small = self._add_blob_pack(2, 'small') + self._add_blob_pack(2, 'tiny')
+        before = set(p._basename for p in self.store.packs)
+        pack = self.store.repack(geometric=2)
+        self.assertEqual(len(small), len(pack))
+        after = set(p._basename for p in self.store.packs)
+        self.assertEqual(set([pack._basename]), after - before)
+        # The large pack was not touched.
+        self.assertEqual(1, len(after & before))
+        for o in large + small:
+            self.assertEqual(o, self.store[o.id])
+        # 4 * 2 <= 20, so the packs form a geometric progression.
+        self.assertEqual(None, self.store.repack(geometric=2))
+        # Loose objects are packed regardless.
+        loose = make_object(Blob, data=b'loose data')
+        self.store.add_object(loose)
+        pack = self.store.repack(geometric=2)
+        self.assertEqual([loose.id], list(pack))
+        self.assertEqual([], list(self.store._iter_loose_objects()))
+
+    def test_repack_multi_pack_index(self):
+        blobs = self._add_blob_pack(2, 'first') + self._add_blob_pack(1, 'second')
+        self.store.write_multi_pack_index()
+        pack = self.store.repack()
+        self.assertEqual(
+            [os.path.basename(pack._basename) + ".idx"],
+            self.store._midx.pack_names)
+        for o in blobs:
+            self.assertEqual(o, self.store[o.id])
+
+
+class GeometricRollupTests(TestCase):
+
+    def test_progression(self):
+        self.assertEqual([], _geometric_rollup([], 2))
+        self.assertEqual([], _geometric_rollup([(10, 'a')], 2))
+        self.assertEqual([], _geometric_rollup([(1, 'a'), (2, 'b'), (4, 'c')], 2))
+
+    def test_smallest(self):
+        self.assertEqual(
+            ['a', 'b', 'c'],
+            _geometric_rollup([(100, 'd'), (1, 'a'), (1, 'b'), (1, 'c')], 2))
+
+    def test_merged_breaks_progression(self):
+        # Merging a and b gives 2 objects, which is too many for c.
+        self.assertEqual(
+            ['a', 'b', 'c'],
+            _geometric_rollup([(1, 'a'), (1, 'b'), (3, 'c'), (50, 'd')], 2))
+
+
+class CommitCacheTests(TestCase):
+
+    def test_limit(self):
+        cache = CommitCache(max_size=1000)
+        for i in range(10):
+            cache.add(str(i).encode('ascii') * 40,
+                      (b'1' * 40, (b'2' * 40,), i))
+        self.assertEqual(None, cache.get(b'0' * 40))
+        self.assertEqual((b'1' * 40, (b'2' * 40,), 9), cache.get(b'9' * 40))
+        stats = cache.stats()
+        self.assertTrue(stats['size'] <= 1000)
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_subclass_without_init(self):
+        class Store(MemoryObjectStore):
+
+            def __init__(self):
+                self._data = {}
+
+        store = Store()
+        c1, c2 = build_commit_graph(store, [[1], [2, 1]])
+        self.assertEqual([c1.id], store.get_parents(c2.id))
+        self.assertEqual(1, len(store.commit_cache))
+
+    def test_parents_not_shared(self):
+        store = MemoryObjectStore()
+        c1, c2 = build_commit_graph(store, [[1], [2, 1]])
+        store.get_parents(c2.id).append(c2.id)
+        self.assertEqual([c1.id], store.get_parents(c2.id))
+
 
 class TreeLookupPathTests(TestCase):
 
@@ -48,6 +48,7 @@ from dulwich.objects import (
     hex_to_filename,
     check_hexsha,
     check_identity,
+    parse_commit_header,
     parse_timezone,
     object_class,
     parse_tree,
@@ -129,6 +130,13 @@ class BlobReadTests(TestCase):
         b2 = b1.from_file(BytesIO(b_raw))
         self.assertEqual(b1, b2)
 
+    def test_legacy_compression_level(self):
+        b1 = Blob.from_string(b'foo' * 100)
+        b_raw = b1.as_legacy_object(compression_level=0)
+        self.assertIn(b'foo' * 100, b_raw)
+        self.assertTrue(len(b_raw) > len(b1.as_legacy_object()))
+        self.assertEqual(b1, b1.from_file(BytesIO(b_raw)))
+
     def test_chunks(self):
         string = b'test 5\n'
         b = Blob.from_string(string)
@@ -542,6 +550,37 @@ class CommitParseTests(ShaFileCheckTests):
         self.assertEqual(0, c.author_timezone)
         self.assertEqual(None, c.encoding)
 
+    def test_header_only(self):
+        text = self.make_commit_text(extra={b'extra-field': b'data'})
+        c = Commit.from_string(text)
+        self.assertEqual(
+            (c.tree, c.parents, c.commit_time),
+            parse_commit_header([text]))
+        # The rest of the commit is only parsed when needed.
+        self.assertTrue(c._needs_parsing)
+        self.assertEqual(text, c.as_raw_string())
+        self.assertTrue(c._needs_parsing)
+        self.assertEqual([(b'extra-field', b'data')], c.extra)
+        self.assertFalse(c._needs_parsing)
+        self.assertEqual(text, c.as_raw_string())
+
+    def test_header_only_set(self):
+        c = Commit.from_string(self.make_commit_text())
+        c.tree = b'1' * 40
+        self.assertEqual(b'Merge ../b\n', c.message)
+        self.assertEqual(Commit.from_string(self.make_commit_text(
+            tree=b'1' * 40)).id, c.id)
+
+    def test_parse_commit_header(self):
+        self.assertEqual(
+            (b'd80c186a03f423a81b39df39dc87fd269736ca86',
+             [b'ab64bbdcc51b170d21588e5c5d391ee5c0c96dfd',
+              b'4cffe90e0a41ad3f5190079d7c8f036bde29cbe6'],
+             1174773719),
+            parse_commit_header([self.make_commit_text()]))
+        self.assertEqual((None, [], None), parse_commit_header([
+            self.make_commit_text(tree=None, parents=None, committer=None)]))
+
     def test_custom(self):
         c = Commit.from_string(self.make_commit_text(
             extra={b'extra-field': b'data'}))
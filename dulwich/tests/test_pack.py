@@ -24,6 +24,7 @@ from io import BytesIO
 from hashlib import sha1
 import os
 import shutil
+import sys
 import tempfile
 import zlib
 
@@ -53,9 +54,11 @@ from dulwich.pack import (
     apply_delta,
     create_delta,
     deltify_pack_objects,
+    iter_pack_data,
     load_pack_index,
     UnpackedObject,
     read_zlib_chunks,
+    write_pack_data,
     write_pack_header,
     write_pack_index_v1,
     write_pack_index_v2,
@@ -65,7 +68,14 @@ from dulwich.pack import (
     compute_file_sha,
     PackStreamReader,
     DeltaChainIterator,
+    DeltaBaseCache,
+    DeltaIndex,
+    _create_delta_py,
+    _DeltaIndex_py,
+    _read_zlib_chunks_py,
+    _unpack_object_py,
     _delta_encode_size,
+    _deltify_batches,
     _encode_copy_operation,
     )
 from dulwich.tests import (
@@ -74,6 +84,8 @@ from dulwich.tests import (
 from dulwich.tests.utils import (
     make_object,
     build_pack,
+    functest_builder,
+    ext_functest_builder,
     )
 
 pack1_sha = b'bc63ddad95e7321ee734ea11a7a62d314e0d7481'
@@ -123,6 +135,19 @@ class PackIndexTests(PackTests):
         self.assertEqual(p.object_index(tree_sha), 138)
         self.assertEqual(p.object_index(commit_sha), 12)
 
+    def test_lookup_many(self):
+        p = self.get_pack_index(pack1_sha)
+        self.assertEqual(
+            {a_sha: 178, hex_to_sha(commit_sha): 12},
+            p.lookup_many([pack1_sha, hex_to_sha(commit_sha), a_sha]))
+        self.assertEqual({}, p.lookup_many([]))
+
+    def test_object_crc32(self):
+        p = self.get_pack_index(pack1_sha)
+        self.assertRaises(KeyError, p.object_crc32, pack1_sha)
+        # Version 1 indexes don't store checksums.
+        self.assertEqual(None, p.object_crc32(a_sha))
+
     def test_index_len(self):
         p = self.get_pack_index(pack1_sha)
         self.assertEqual(3, len(p))
@@ -197,6 +222,72 @@ class TestPackDeltas(TestCase):
             apply_delta, b'', b'\x00\x80\x02\xb0\x11\x11')
 
 
+class CreateDeltaTests(TestCase):
+
+    def _do_test_roundtrip(self, create_delta):
+        base = b''.join(b'line ' + str(i).encode('ascii') + b'\n'
+                        for i in range(1000))
+        for target in [base, b'', b'x' + base, base + b'x', base[500:],
+                       base.replace(b'line 5', b'LINE 5'),
+                       base[4000:] + base[:4000], b'unrelated' * 100]:
+            delta = create_delta(base, target)
+            self.assertEqual(target, b''.join(apply_delta(base, delta)))
+        self.assertEqual(b'', b''.join(apply_delta(b'', create_delta(b'', b''))))
+
+    test_roundtrip = functest_builder(_do_test_roundtrip, _create_delta_py)
+    test_roundtrip_extension = ext_functest_builder(_do_test_roundtrip,
+                                                    create_delta)
+
+    def _do_test_copy(self, create_delta):
+        base = bytes(bytearray(range(256))) * 4
+        # The whole base can be copied with a single copy operation.
+        self.assertEqual(b'\x80\x08\x80\x08\xa0\x04',
+                         create_delta(base, base))
+        # Matches are extended backwards from the aligned block they were
+        # found through.
+        self.assertEqual(b'\x80\x08\x80\x08\x01x\xb1\x01\xff\x03',
+                         create_delta(base, b'x' + base[1:1025]))
+
+    test_copy = functest_builder(_do_test_copy, _create_delta_py)
+    test_copy_extension = ext_functest_builder(_do_test_copy, create_delta)
+
+    def _do_test_large_blob(self, create_delta):
+        base = b''.join(b'line ' + str(i).encode('ascii') + b'\n'
+                        for i in range(100000))
+        target = base.replace(b'line 1234\n', b'line twelve\n').replace(
+            b'line 54321\n', b'line fifty\n')
+        delta = create_delta(base, target)
+        self.assertTrue(len(delta) < 200)
+        self.assertEqual(target, b''.join(apply_delta(base, delta)))
+
+    test_large_blob = functest_builder(_do_test_large_blob, _create_delta_py)
+    test_large_blob_extension = ext_functest_builder(_do_test_large_blob,
+                                                     create_delta)
+
+
+class DeltaIndexTests(TestCase):
+
+    def _do_test_create_delta(self, index_cls):
+        base = b''.join(b'line ' + str(i).encode('ascii') + b'\n'
+                        for i in range(1000))
+        index = index_cls(base)
+        for target in [base, b'', base[500:], base.replace(b'line 5', b'L5')]:
+            self.assertEqual(_create_delta_py(base, target),
+                             index.create_delta(target))
+
+    test_create_delta = functest_builder(_do_test_create_delta,
+                                         _DeltaIndex_py)
+    test_create_delta_extension = ext_functest_builder(
+        _do_test_create_delta, DeltaIndex)
+
+    def _do_test_sizeof(self, index_cls):
+        base = b'x' * 1000
+        self.assertTrue(sys.getsizeof(index_cls(base)) > len(base))
+
+    test_sizeof = functest_builder(_do_test_sizeof, _DeltaIndex_py)
+    test_sizeof_extension = ext_functest_builder(_do_test_sizeof, DeltaIndex)
+
+
 class TestPackData(PackTests):
     """Tests getting the data from the packfile."""
 
@@ -261,6 +352,89 @@ class TestPackData(PackTests):
             idx2 = self.get_pack_index(pack1_sha)
             self.assertEqual(idx1, idx2)
 
+    def test_get_object_at(self):
+        path = os.path.join(self.datadir, 'pack-%s.pack' % pack1_sha.decode('ascii'))
+        with PackData(path) as mapped:
+            with PackData(path, use_mmap=False) as unmapped:
+                self.assertEqual(None, unmapped._contents)
+                for offset in (12, 138, 178):
+                    self.assertEqual(unmapped.get_object_at(offset),
+                                     mapped.get_object_at(offset))
+                self.assertEqual(unmapped.get_stored_checksum(),
+                                 mapped.get_stored_checksum())
+
+    def test_get_object_at_unmappable(self):
+        path = os.path.join(self.datadir, 'pack-%s.pack' % pack1_sha.decode('ascii'))
+        with open(path, 'rb') as f:
+            data = PackData('', file=BytesIO(f.read()))
+        self.assertEqual(None, data._contents)
+        self.assertEqual(3, data.get_object_at(178)[0])
+
+    def test_shared_delta_base_cache(self):
+        path = os.path.join(self.tempdir, 'deltas.pack')
+        with open(path, 'wb') as f:
+            entries = build_pack(f, [
+                (Blob.type_num, b'blob'),
+                (OFS_DELTA, (0, b'blob with more data')),
+                ])
+        offset = entries[1][0]
+        cache = DeltaBaseCache()
+        with PackData(path, delta_base_cache=cache) as data1:
+            with PackData(path, delta_base_cache=cache) as data2:
+                type_num, obj = data1.get_object_at(offset)
+                self.assertEqual(OFS_DELTA, type_num)
+                data1.resolve_object(offset, type_num, obj)
+                self.assertIn((data1, offset), cache)
+                self.assertNotIn((data2, offset), cache)
+                type_num, chunks = data1.get_object_at(offset)
+                self.assertEqual((Blob.type_num, b'blob with more data'),
+                                 (type_num, b''.join(chunks)))
+                self.assertEqual(OFS_DELTA, data2.get_object_at(offset)[0])
+                data2.resolve_object(offset, OFS_DELTA,
+                                     data2.get_object_at(offset)[1])
+            # Closing a pack removes its objects from the cache.
+            self.assertNotIn((data2, offset), cache)
+            self.assertIn((data1, offset), cache)
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.stats()['size'])
+
+    def _write_delta_chain(self, n):
+        objects_spec = [(Blob.type_num, b'blob')]
+        for i in range(n):
+            objects_spec.append(
+                (OFS_DELTA, (i, b'blob' + str(i).encode('ascii'))))
+        path = os.path.join(self.tempdir, 'chain.pack')
+        with open(path, 'wb') as f:
+            entries = build_pack(f, objects_spec)
+        return path, [entry[0] for entry in entries]
+
+    def test_resolve_object_long_chain(self):
+        # Deeper than the recursion limit.
+        n = sys.getrecursionlimit() + 10
+        path, offsets = self._write_delta_chain(n)
+        with PackData(path) as data:
+            type_num, obj = data.get_object_at(offsets[-1])
+            type_num, chunks = data.resolve_object(offsets[-1], type_num, obj)
+            self.assertEqual(Blob.type_num, type_num)
+            self.assertEqual(b'blob' + str(n - 1).encode('ascii'),
+                             b''.join(chunks))
+
+    def test_resolve_object_cached_ancestor(self):
+        path, offsets = self._write_delta_chain(60)
+        cache = DeltaBaseCache()
+        with PackData(path, delta_base_cache=cache) as data:
+            type_num, obj = data.get_object_at(offsets[50])
+            data.resolve_object(offsets[50], type_num, obj)
+            # Everything on the way was cached.
+            self.assertIn((data, offsets[30]), cache)
+            type_num, obj = data.get_object_at(offsets[-1])
+            hits = cache.hits
+            type_num, chunks = data.resolve_object(
+                offsets[-1], type_num, obj)
+            self.assertEqual(b'blob59', b''.join(chunks))
+            # The chain is only followed down to the cached object.
+            self.assertEqual(hits + 1, cache.hits)
+
     def test_compute_file_sha(self):
         f = BytesIO(b'abcd1234wxyz')
         self.assertEqual(sha1(b'abcd1234wxyz').hexdigest(),
@@ -327,6 +501,39 @@ class TestPack(PackTests):
             self.assertEqual(obj.type_name, b'commit')
             self.assertEqual(obj.sha().hexdigest().encode('ascii'), commit_sha)
 
+    def test_get_unpacked_object(self):
+        with self.get_pack(pack1_sha) as p:
+            unpacked = p.get_unpacked_object(a_sha)
+            self.assertEqual(178, unpacked.offset)
+            self.assertEqual(hex_to_sha(a_sha), unpacked.sha())
+            self.assertEqual(Blob.type_num, unpacked.pack_type_num)
+            self.assertEqual([b'test 1\n'], unpacked.decomp_chunks)
+            self.assertEqual(None, unpacked.comp_chunks)
+            self.assertEqual(None, unpacked.crc32)
+
+    def test_get_unpacked_object_include_comp(self):
+        with self.get_pack(pack1_sha) as p:
+            unpacked = p.get_unpacked_object(a_sha, include_comp=True)
+            self.assertEqual(
+                b'test 1\n', zlib.decompress(b''.join(unpacked.comp_chunks)))
+
+    def test_copy_unpacked(self):
+        with self.get_pack(pack1_sha) as origpack:
+            f = BytesIO()
+            records = [origpack.get_unpacked_object(sha, include_comp=True)
+                       for sha in origpack]
+            entries, checksum = write_pack_data(f, len(records), records)
+            f.seek(0)
+            newdata = PackData.from_file(f, len(f.getvalue()))
+            self.assertEqual(
+                sorted((sha, offset, crc32)
+                       for (sha, (offset, crc32)) in entries.items()),
+                sorted(newdata.iterentries()))
+            for sha, (offset, crc32) in entries.items():
+                type_num, chunks = newdata.get_object_at(offset)
+                self.assertEqual(origpack.get_raw(sha),
+                                 (type_num, b''.join(chunks)))
+
     def test_copy(self):
         with self.get_pack(pack1_sha) as origpack:
             self.assertSucceeds(origpack.index.check)
@@ -476,6 +683,16 @@ class TestThinPack(PackTests):
                 (3, b'foo1234'),
                 p.get_raw(self.blobs[b'foo1234'].id))
 
+    def test_get_raw_caches_ext_refs(self):
+        calls = []
+        def resolve_ext_ref(sha):
+            calls.append(sha)
+            return self.store.get_raw(sha)
+        with Pack(self.pack_prefix, resolve_ext_ref=resolve_ext_ref) as p:
+            p.data.get_ref(self.blobs[b'foo'].sha().digest())
+            p.data.get_ref(self.blobs[b'foo'].sha().digest())
+        self.assertEqual([self.blobs[b'foo'].sha().digest()], calls)
+
     def test_iterobjects(self):
         with self.make_pack(False) as p:
             self.assertRaises(KeyError, list, p.iterobjects())
@@ -510,6 +727,17 @@ class WritePackTests(TestCase):
         self.assertEqual(crc32, unpacked.crc32)
         self.assertEqual(b'x', unused)
 
+    def test_write_pack_object_compression_level(self):
+        f = BytesIO()
+        crc32 = write_pack_object(f, Blob.type_num, b'blob' * 100,
+                                  compression_level=0)
+        self.assertIn(b'blob' * 100, f.getvalue())
+        self.assertEqual(crc32, zlib.crc32(f.getvalue()) & 0xffffffff)
+        f.write(b'x')
+        f.seek(0)
+        unpacked, unused = unpack_object(f.read)
+        self.assertEqual([b'blob' * 100], unpacked.decomp_chunks)
+
     def test_write_pack_object_sha(self):
         f = BytesIO()
         f.write(b'header')
@@ -521,6 +749,70 @@ class WritePackTests(TestCase):
         sha_b.update(f.getvalue()[offset:])
         self.assertEqual(sha_a.digest(), sha_b.digest())
 
+    def make_records(self, count):
+        blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii') * 50)
+                 for i in range(count)]
+        return [(b.type_num, b.sha().digest(), None, b.as_raw_string())
+                for b in blobs]
+
+    def test_write_pack_data_workers(self):
+        records = self.make_records(50)
+        base = make_object(Blob, data=b'base data' * 50)
+        records.append((base.type_num, base.sha().digest(), None,
+                        base.as_raw_string()))
+        target = make_object(Blob, data=b'base data' * 50 + b'more')
+        records.append((target.type_num, target.sha().digest(),
+                        base.sha().digest(),
+                        create_delta(base.as_raw_string(),
+                                     target.as_raw_string())))
+        f = BytesIO()
+        entries, checksum = write_pack_data(f, len(records), records,
+                                            compression_level=1)
+        for workers in (1, 2, 4):
+            g = BytesIO()
+            self.assertEqual(
+                (entries, checksum),
+                write_pack_data(g, len(records), iter(records),
+                                workers=workers, compression_level=1))
+            self.assertEqual(f.getvalue(), g.getvalue())
+        g.seek(0)
+        data = PackData.from_file(g, len(g.getvalue()))
+        self.assertEqual(sorted((sha, offset, crc32) for (sha, (offset, crc32))
+                                in entries.items()),
+                         sorted(data.iterentries()))
+
+    def test_iter_pack_data(self):
+        records = self.make_records(100)
+        f = BytesIO()
+        write_pack_data(f, len(records), records)
+        chunks = list(iter_pack_data(len(records), iter(records),
+                                     chunk_size=1000))
+        self.assertEqual(f.getvalue(), b''.join(chunks))
+        self.assertEqual([1000] * (len(chunks) - 1),
+                         [len(c) for c in chunks[:-1]])
+        self.assertTrue(0 < len(chunks[-1]) <= 1000)
+
+    def test_iter_pack_data_error(self):
+        def records():
+            yield self.make_records(1)[0]
+            raise KeyError('missing')
+        self.assertRaises(KeyError, list, iter_pack_data(2, records()))
+
+    def test_iter_pack_data_close(self):
+        records = self.make_records(100)
+        produced = []
+
+        def iter_records():
+            for record in records:
+                produced.append(record)
+                yield record
+        chunks = iter_pack_data(len(records), iter_records(), chunk_size=10,
+                                depth=1)
+        self.assertEqual(b'PACK\x00\x00\x00\x02\x00\x00', next(chunks))
+        chunks.close()
+        # The producer has stopped, rather than writing the whole pack.
+        self.assertTrue(len(produced) < len(records))
+
 
 pack_checksum = hex_to_sha('721980e866af9a5f93ad674144e1459b8ba3e7b7')
 
@@ -565,6 +857,20 @@ class BaseTestPackIndexWriting(object):
             else:
                 self.assertTrue(actual_crc is None)
 
+    def test_lookup_many(self):
+        entries = sorted(
+            (sha1(str(i).encode('ascii')).digest(), i * 10, i)
+            for i in range(200))
+        idx = self.index('many.idx', entries, pack_checksum)
+        missing = [sha1(str(-i).encode('ascii')).digest()
+                   for i in range(1, 50)]
+        wanted = [sha for (sha, offset, crc32) in entries[::3]]
+        self.assertEqual(
+            dict((sha, offset) for (sha, offset, crc32) in entries[::3]),
+            idx.lookup_many(list(reversed(wanted)) + missing))
+        self.assertEqual({sha_to_hex(entries[1][0]): entries[1][1]},
+                         idx.lookup_many([sha_to_hex(entries[1][0])]))
+
     def test_single(self):
         entry_sha = hex_to_sha('6f670c0fb53f9463760b7295fbb814e965fb20c8')
         my_entries = [(entry_sha, 178, 42)]
@@ -649,6 +955,48 @@ class TestPackIndexWritingv2(TestCase, BaseTestFilePackIndexWriting):
         TestCase.tearDown(self)
         BaseTestFilePackIndexWriting.tearDown(self)
 
+    def test_sha_table(self):
+        entries = sorted(
+            (sha1(str(i).encode('ascii')).digest(), i, i) for i in range(5))
+        idx = self.index('table.idx', entries, pack_checksum)
+        self.assertEqual(b''.join(sha for (sha, offset, crc32) in entries),
+                         bytes(idx.sha_table))
+
+
+class DeltaBaseCacheTests(TestCase):
+
+    def test_counters(self):
+        cache = DeltaBaseCache(max_size=100)
+        self.assertEqual(None, cache.get(('pack', 12)))
+        cache.add(('pack', 12), (Blob.type_num, [b'x' * 40]))
+        self.assertEqual((Blob.type_num, [b'x' * 40]), cache.get(('pack', 12)))
+        cache.add(('pack', 24), (Blob.type_num, [b'y' * 40]))
+        cache.add(('pack', 36), (Blob.type_num, [b'z' * 40]))
+        # The least recently used entry is evicted.
+        self.assertEqual(None, cache.get(('pack', 12)))
+        self.assertEqual(
+            {'hits': 1, 'misses': 2, 'evictions': 1, 'size': 80,
+             'max_size': 100},
+            cache.stats())
+
+    def test_delta_size(self):
+        cache = DeltaBaseCache(max_size=100)
+        cache.add(('pack', 12), (OFS_DELTA, (12, [b'x' * 10])))
+        self.assertEqual(10, cache.stats()['size'])
+
+    def test_remove_pack_data(self):
+        cache = DeltaBaseCache(max_size=100)
+        for key in [('a', 1), ('b', 1), ('a', 2), ('b', 2), ('a', 3)]:
+            cache.add(key, (Blob.type_num, [b'x']))
+        cache.remove_pack_data('a')
+        self.assertEqual([('b', 1), ('b', 2)], sorted(cache.keys()))
+        self.assertEqual(2, cache.stats()['size'])
+        cache.add(('a', 4), (Blob.type_num, [b'x']))
+        self.assertEqual((Blob.type_num, [b'x']), cache.get(('b', 1)))
+
+    def test_default_size(self):
+        self.assertEqual(20 * 1024 * 1024, DeltaBaseCache().stats()['max_size'])
+
 
 class ReadZlibTests(TestCase):
 
@@ -667,7 +1015,7 @@ class ReadZlibTests(TestCase):
         self.read = BytesIO(self.comp + self.extra).read
         self.unpacked = UnpackedObject(Tree.type_num, None, len(self.decomp), 0)
 
-    def test_decompress_size(self):
+    def _do_test_decompress_size(self, read_zlib_chunks):
         good_decomp_len = len(self.decomp)
         self.unpacked.decomp_len = -1
         self.assertRaises(ValueError, read_zlib_chunks, self.read,
@@ -679,14 +1027,33 @@ class ReadZlibTests(TestCase):
         self.assertRaises(zlib.error, read_zlib_chunks, self.read,
                           self.unpacked)
 
-    def test_decompress_truncated(self):
+    test_decompress_size = functest_builder(
+        _do_test_decompress_size, _read_zlib_chunks_py)
+    test_decompress_size_extension = ext_functest_builder(
+        _do_test_decompress_size, read_zlib_chunks)
+
+    def _do_test_decompress_truncated(self, read_zlib_chunks):
         read = BytesIO(self.comp[:10]).read
         self.assertRaises(zlib.error, read_zlib_chunks, read, self.unpacked)
 
         read = BytesIO(self.comp).read
         self.assertRaises(zlib.error, read_zlib_chunks, read, self.unpacked)
 
-    def test_decompress_empty(self):
+    test_decompress_truncated = functest_builder(
+        _do_test_decompress_truncated, _read_zlib_chunks_py)
+    test_decompress_truncated_extension = ext_functest_builder(
+        _do_test_decompress_truncated, read_zlib_chunks)
+
+    def _do_test_decompress_corrupt(self, read_zlib_chunks):
+        read = BytesIO(b'garbage' + self.comp + self.extra).read
+        self.assertRaises(zlib.error, read_zlib_chunks, read, self.unpacked)
+
+    test_decompress_corrupt = functest_builder(
+        _do_test_decompress_corrupt, _read_zlib_chunks_py)
+    test_decompress_corrupt_extension = ext_functest_builder(
+        _do_test_decompress_corrupt, read_zlib_chunks)
+
+    def _do_test_decompress_empty(self, read_zlib_chunks):
         unpacked = UnpackedObject(Tree.type_num, None, 0, None)
         comp = zlib.compress(b'')
         read = BytesIO(comp + self.extra).read
@@ -695,41 +1062,142 @@ class ReadZlibTests(TestCase):
         self.assertNotEqual(b'', unused)
         self.assertEqual(self.extra, unused + read())
 
-    def test_decompress_no_crc32(self):
+    test_decompress_empty = functest_builder(
+        _do_test_decompress_empty, _read_zlib_chunks_py)
+    test_decompress_empty_extension = ext_functest_builder(
+        _do_test_decompress_empty, read_zlib_chunks)
+
+    def _do_test_decompress_no_crc32(self, read_zlib_chunks):
         self.unpacked.crc32 = None
         read_zlib_chunks(self.read, self.unpacked)
         self.assertEqual(None, self.unpacked.crc32)
 
-    def _do_decompress_test(self, buffer_size, **kwargs):
+    test_decompress_no_crc32 = functest_builder(
+        _do_test_decompress_no_crc32, _read_zlib_chunks_py)
+    test_decompress_no_crc32_extension = ext_functest_builder(
+        _do_test_decompress_no_crc32, read_zlib_chunks)
+
+    def _do_decompress_test(self, read_zlib_chunks, buffer_size, **kwargs):
         unused = read_zlib_chunks(self.read, self.unpacked,
                                   buffer_size=buffer_size, **kwargs)
         self.assertEqual(self.decomp, b''.join(self.unpacked.decomp_chunks))
-        self.assertEqual(zlib.crc32(self.comp), self.unpacked.crc32)
+        self.assertEqual(zlib.crc32(self.comp) & 0xffffffff,
+                         self.unpacked.crc32)
         self.assertNotEqual(b'', unused)
         self.assertEqual(self.extra, unused + self.read())
 
-    def test_simple_decompress(self):
-        self._do_decompress_test(4096)
+    def _do_test_simple_decompress(self, read_zlib_chunks):
+        self._do_decompress_test(read_zlib_chunks, 4096)
         self.assertEqual(None, self.unpacked.comp_chunks)
 
+    test_simple_decompress = functest_builder(
+        _do_test_simple_decompress, _read_zlib_chunks_py)
+    test_simple_decompress_extension = ext_functest_builder(
+        _do_test_simple_decompress, read_zlib_chunks)
+
     # These buffer sizes are not intended to be realistic, but rather simulate
     # larger buffer sizes that may end at various places.
-    def test_decompress_buffer_size_1(self):
-        self._do_decompress_test(1)
+    def _do_test_decompress_buffer_size_1(self, read_zlib_chunks):
+        self._do_decompress_test(read_zlib_chunks, 1)
+
+    test_decompress_buffer_size_1 = functest_builder(
+        _do_test_decompress_buffer_size_1, _read_zlib_chunks_py)
+    test_decompress_buffer_size_1_extension = ext_functest_builder(
+        _do_test_decompress_buffer_size_1, read_zlib_chunks)
+
+    def _do_test_decompress_buffer_size_2(self, read_zlib_chunks):
+        self._do_decompress_test(read_zlib_chunks, 2)
 
-    def test_decompress_buffer_size_2(self):
-        self._do_decompress_test(2)
+    test_decompress_buffer_size_2 = functest_builder(
+        _do_test_decompress_buffer_size_2, _read_zlib_chunks_py)
+    test_decompress_buffer_size_2_extension = ext_functest_builder(
+        _do_test_decompress_buffer_size_2, read_zlib_chunks)
 
-    def test_decompress_buffer_size_3(self):
-        self._do_decompress_test(3)
+    def _do_test_decompress_buffer_size_3(self, read_zlib_chunks):
+        self._do_decompress_test(read_zlib_chunks, 3)
 
-    def test_decompress_buffer_size_4(self):
-        self._do_decompress_test(4)
+    test_decompress_buffer_size_3 = functest_builder(
+        _do_test_decompress_buffer_size_3, _read_zlib_chunks_py)
+    test_decompress_buffer_size_3_extension = ext_functest_builder(
+        _do_test_decompress_buffer_size_3, read_zlib_chunks)
 
-    def test_decompress_include_comp(self):
-        self._do_decompress_test(4096, include_comp=True)
+    def _do_test_decompress_buffer_size_4(self, read_zlib_chunks):
+        self._do_decompress_test(read_zlib_chunks, 4)
+
+    test_decompress_buffer_size_4 = functest_builder(
+        _do_test_decompress_buffer_size_4, _read_zlib_chunks_py)
+    test_decompress_buffer_size_4_extension = ext_functest_builder(
+        _do_test_decompress_buffer_size_4, read_zlib_chunks)
+
+    def _do_test_decompress_include_comp(self, read_zlib_chunks):
+        self._do_decompress_test(read_zlib_chunks, 4096, include_comp=True)
         self.assertEqual(self.comp, b''.join(self.unpacked.comp_chunks))
 
+    test_decompress_include_comp = functest_builder(
+        _do_test_decompress_include_comp, _read_zlib_chunks_py)
+    test_decompress_include_comp_extension = ext_functest_builder(
+        _do_test_decompress_include_comp, read_zlib_chunks)
+
+
+class UnpackObjectTests(TestCase):
+
+    def setUp(self):
+        super(UnpackObjectTests, self).setUp()
+        f = BytesIO()
+        self.entries = build_pack(f, [
+            (Blob.type_num, b'blob' * 100),
+            (OFS_DELTA, (0, b'blob' * 99 + b'blub')),
+            (REF_DELTA, (0, b'blob' * 98 + b'blab')),
+            ])
+        f.write(b'x')  # unpack_object needs extra trailing data.
+        self.contents = f.getvalue()
+
+    def _unpack_all(self, unpack_object, **kwargs):
+        ret = []
+        for offset, _, _, _, _ in self.entries:
+            f = BytesIO(self.contents)
+            f.seek(offset)
+            unpacked, unused = unpack_object(f.read, **kwargs)
+            ret.append((unpacked, unused + f.read()))
+        return ret
+
+    def _do_test_unpack(self, unpack_object):
+        unpacked = self._unpack_all(unpack_object, compute_crc32=True,
+                                    zlib_bufsize=7)
+        for i, (offset, _, _, _, crc32) in enumerate(self.entries[:-1]):
+            self.assertEqual(crc32, unpacked[i][0].crc32)
+            self.assertEqual(None, unpacked[i][0].comp_chunks)
+            self.assertEqual(self.contents[self.entries[i + 1][0]:],
+                             unpacked[i][1])
+        self.assertEqual(
+            [Blob.type_num, OFS_DELTA, REF_DELTA],
+            [u.pack_type_num for (u, _) in unpacked])
+        self.assertEqual(b'blob' * 100,
+                         b''.join(unpacked[0][0].obj_chunks))
+        self.assertEqual(self.entries[1][0] - self.entries[0][0],
+                         unpacked[1][0].delta_base)
+        self.assertEqual(self.entries[0][3], unpacked[2][0].delta_base)
+
+    test_unpack = functest_builder(_do_test_unpack, _unpack_object_py)
+    test_unpack_extension = ext_functest_builder(_do_test_unpack,
+                                                 unpack_object)
+
+    def _do_test_same_as_python(self, unpack_object):
+        for kwargs in [{}, {'compute_crc32': True},
+                       {'compute_crc32': True, 'include_comp': True,
+                        'zlib_bufsize': 1}]:
+            for (py, py_unused), (ext, ext_unused) in zip(
+                    self._unpack_all(_unpack_object_py, **kwargs),
+                    self._unpack_all(unpack_object, **kwargs)):
+                self.assertEqual(py_unused, ext_unused)
+                for attr in UnpackedObject.__slots__:
+                    self.assertEqual(getattr(py, attr), getattr(ext, attr))
+                    self.assertEqual(type(getattr(py, attr)),
+                                     type(getattr(ext, attr)))
+
+    test_same_as_python_extension = ext_functest_builder(
+        _do_test_same_as_python, unpack_object)
+
 
 class DeltifyTests(TestCase):
 
@@ -752,6 +1220,56 @@ class DeltifyTests(TestCase):
             ],
             list(deltify_pack_objects([(b1, b""), (b2, b"")])))
 
+    def test_window_size(self):
+        b1 = Blob.from_string(b"a" * 102)
+        b2 = Blob.from_string(b"a" * 101)
+        b3 = Blob.from_string(b"a" * 100)
+        objects = [(b1, b""), (b2, b""), (b3, b"")]
+        self.assertEqual(
+            [None, b1.sha().digest(), b2.sha().digest()],
+            [base for (_, _, base, _) in
+             deltify_pack_objects(objects, window_size=1)])
+        self.assertEqual(
+            [None, None, None],
+            [base for (_, _, base, _) in
+             deltify_pack_objects(objects, window_size=0)])
+
+    def test_window_memory(self):
+        b1 = Blob.from_string(b"a" * 1000 + b"b" * 1000)
+        b2 = Blob.from_string(b"a" * 1000 + b"c" * 999)
+        b3 = Blob.from_string(b"a" * 1000 + b"b" * 998)
+        objects = [(b1, b""), (b2, b""), (b3, b"")]
+        # Without a memory limit, b3 finds b1 as the best base.
+        self.assertEqual(
+            [None, b1.sha().digest(), b1.sha().digest()],
+            [base for (_, _, base, _) in
+             deltify_pack_objects(objects)])
+        # With a tiny limit, only the most recent object is kept.
+        self.assertEqual(
+            [None, b1.sha().digest(), b2.sha().digest()],
+            [base for (_, _, base, _) in
+             deltify_pack_objects(objects, window_memory=1)])
+
+    def test_processes(self):
+        blobs = [Blob.from_string(b"a" * (100 + i)) for i in range(10)]
+        objects = [(b, b"") for b in blobs]
+        for kwargs in [{}, {'window_size': 3}, {'window_memory': 250}]:
+            expected = list(deltify_pack_objects(objects, **kwargs))
+            for processes in [1, 2, 3]:
+                self.assertEqual(expected, list(deltify_pack_objects(
+                    objects, processes=processes, **kwargs)))
+
+    def test_batches(self):
+        magic = [(Blob.type_num, b"", -size, b"", None)
+                 for size in [30, 20, 20, 10, 10, 10]]
+        self.assertEqual([(0, 4), (4, 6)],
+                         list(_deltify_batches(magic, 4, None)))
+        # A batch is cut off once its objects fill the window memory.
+        self.assertEqual([(0, 2), (2, 5), (5, 6)],
+                         list(_deltify_batches(magic, 4, 40)))
+        self.assertEqual([(i, i + 1) for i in range(6)],
+                         list(_deltify_batches(magic, 0, None)))
+
 
 class TestPackStreamReader(TestCase):
 
@@ -1035,6 +1553,32 @@ class DeltaChainIteratorTests(TestCase):
             self.assertEqual((sorted([b2.id, b3.id]),), (sorted(e.args[0]),))
 
 
+class ParallelDeltaChainIteratorTests(DeltaChainIteratorTests):
+    """Run the delta chain iterator tests with worker processes."""
+
+    def make_pack_iter(self, f, thin=None):
+        if thin is None:
+            thin = bool(list(self.store))
+        resolve_ext_ref = thin and self.get_raw_no_repeat or None
+        fd, path = tempfile.mkstemp(suffix='.pack')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as pack_file:
+            pack_file.write(f.getvalue())
+        data = PackData(path)
+        self.addCleanup(data.close)
+        return TestPackIterator.for_pack_data(
+          data, resolve_ext_ref=resolve_ext_ref, processes=2)
+
+    def assertEntriesMatch(self, expected_indexes, entries, pack_iter):
+        # Chains are resolved in any order.
+        expected = sorted(entries[i] for i in expected_indexes)
+        self.assertEqual(expected, sorted(pack_iter._walk_all_chains()))
+
+    def test_requires_filename(self):
+        self.assertRaises(ValueError, TestPackIterator, BytesIO(),
+                          processes=2)
+
+
 class DeltaEncodeSizeTests(TestCase):
 
     def test_basic(self):
@@ -296,6 +296,17 @@ class RepositoryTests(TestCase):
         r = self._repo = open_repo('ooo_merge.git')
         self.assertIsInstance(r.get_config_stack(), Config)
 
+    def test_compression_config(self):
+        r = self._repo = open_repo('ooo_merge.git')
+        self.assertEqual(-1, r.object_store.pack_compression_level)
+        c = r.get_config()
+        c.set((b'core', ), b'compression', b'1')
+        c.set((b'core', ), b'loosecompression', b'0')
+        c.write_to_path()
+        r = Repo(r.path)
+        self.assertEqual(1, r.object_store.pack_compression_level)
+        self.assertEqual(0, r.object_store.loose_compression_level)
+
     def test_submodule(self):
         temp_dir = tempfile.mkdtemp()
         repo_dir = os.path.join(os.path.dirname(__file__), 'data', 'repos')
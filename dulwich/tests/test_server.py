@@ -382,6 +382,19 @@ class ProtocolGraphWalkerTestCase(TestCase):
         self.assertFalse(self._walker.all_wants_satisfied([THREE]))
         self.assertTrue(self._walker.all_wants_satisfied([TWO, THREE]))
 
+    def test_all_wants_satisfied_clock_skew(self):
+        # A have that is newer than its descendants is still found when
+        # generation numbers are known.
+        store = self._repo.object_store
+        skewed = make_commit(parents=[], commit_time=999)
+        child = make_commit(parents=[skewed.id], commit_time=111)
+        grandchild = make_commit(parents=[child.id], commit_time=222)
+        for commit in (skewed, child, grandchild):
+            store.add_object(commit)
+        self._walker.set_wants([grandchild.id])
+        self.assertTrue(self._walker.all_wants_satisfied([skewed.id]))
+        self.assertFalse(self._walker.all_wants_satisfied([FIVE]))
+
     def test_split_proto_line(self):
         allowed = (b'want', b'done', None)
         self.assertEqual((b'want', ONE),
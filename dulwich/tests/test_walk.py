@@ -21,6 +21,9 @@
 from itertools import (
     permutations,
     )
+import os
+import shutil
+import tempfile
 
 from dulwich.diff_tree import (
     CHANGE_MODIFY,
@@ -32,6 +35,7 @@ from dulwich.errors import (
     MissingCommitError,
     )
 from dulwich.object_store import (
+    DiskObjectStore,
     MemoryObjectStore,
     )
 from dulwich.objects import (
@@ -49,6 +53,7 @@ from dulwich.tests.utils import (
     F,
     make_object,
     build_commit_graph,
+    clear_commit_graph_generations,
     )
 
 
@@ -410,6 +415,52 @@ class WalkerTest(TestCase):
         # priority queue long before y5.
         self.assertWalkYields([m6, x2], [m6.id], exclude=[y5.id])
 
+    def test_out_of_order_with_exclude_generations(self):
+        # Create the following graph:
+        # c1--y2--...--y9--m11
+        #   \           \  /
+        #    \-----x10---/-e12
+        # Due to skew, e12 is the oldest commit, and it is only popped from
+        # the priority queue after more commits than the Walker buffers.
+        spec = [[1]] + [[i, i - 1] for i in range(2, 10)] + [
+            [10, 1], [11, 10, 9], [12, 9]]
+        commits = self.make_commits(
+            spec, times=[10] + list(range(11, 19)) + [19, 20, 1])
+        y9, x10, m11, e12 = commits[8:]
+        self.assertEqual(10, self.store.get_generation(e12.id))
+        self.assertWalkYields([m11, x10], [m11.id], exclude=[e12.id])
+        # Without generation numbers, commits are only held back for a few
+        # commits.
+        walker = Walker(self.store, [m11.id], exclude=[e12.id],
+                        get_parents=lambda commit: commit.parents)
+        self.assertIn(y9, [entry.commit for entry in walker])
+
+    def test_out_of_order_with_exclude_zero_generations(self):
+        # The same graph as in test_out_of_order_with_exclude, in a
+        # commit-graph written without generation numbers.
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        os.mkdir(os.path.join(store_dir, 'info'))
+        os.mkdir(os.path.join(store_dir, 'pack'))
+        self.store = DiskObjectStore(store_dir)
+        self.addCleanup(self.store.close)
+        c1, x2, y3, y4, y5, m6 = self.make_commits(
+          [[1], [2, 1], [3, 1], [4, 3], [5, 4], [6, 2, 4]],
+          times=[2, 3, 4, 5, 1, 6])
+        self.store.write_commit_graph([m6.id, y5.id])
+        path = os.path.join(store_dir, 'info', 'commit-graph')
+        with open(path, 'rb') as f:
+            contents = f.read()
+        with open(path, 'wb') as f:
+            f.write(clear_commit_graph_generations(contents))
+        self.store.close()
+        self.store = DiskObjectStore(store_dir)
+        self.addCleanup(self.store.close)
+        walker = Walker(self.store, [m6.id], exclude=[y5.id])
+        # The commit times are used instead.
+        self.assertFalse(walker._queue._use_generations)
+        self.assertEqual([m6, x2], [entry.commit for entry in walker])
+
     def test_empty_walk(self):
         c1, c2, c3 = self.make_linear_commits(3)
         self.assertWalkYields([], [c3.id], exclude=[c3.id])
@@ -21,8 +21,11 @@
 
 
 import datetime
+from hashlib import sha1
+from io import BytesIO
 import os
 import shutil
+import struct
 import sys
 import tempfile
 import time
@@ -30,6 +33,9 @@ import types
 
 import warnings
 
+from dulwich.commit_graph import (
+    CommitGraph,
+    )
 from dulwich.index import (
     commit_tree,
     )
@@ -183,17 +189,25 @@ def ext_functest_builder(method, func):
 
     :param method: The method to run. It must must two parameters, self and the
         function implementation to test.
-    :param func: The function implementation to pass to method.
+    :param func: The function implementation to pass to method. This may also
+        be a class, which is only considered an extension if it is
+        implemented in C.
     """
 
     def do_test(self):
-        if not isinstance(func, types.BuiltinFunctionType):
+        if not (isinstance(func, types.BuiltinFunctionType) or
+                (isinstance(func, type) and
+                 not func.__flags__ & _Py_TPFLAGS_HEAPTYPE)):
             raise SkipTest("%s extension not found" % func)
         method(self, func)
 
     return do_test
 
 
+# Set for all classes defined in Python, but not for static extension types.
+_Py_TPFLAGS_HEAPTYPE = 1 << 9
+
+
 def build_pack(f, objects_spec, store=None):
     """Write test pack data from a concise spec.
 
@@ -341,6 +355,26 @@ def build_commit_graph(object_store, commit_spec, trees=None, attrs=None):
     return commits
 
 
+def clear_commit_graph_generations(contents):
+    """Clear the generation numbers in the contents of a commit-graph file.
+
+    This gives the same file as versions of C git that don't compute
+    generation numbers write.
+
+    :param contents: Contents of a commit-graph file
+    :return: The contents with all generation numbers set to zero
+    """
+    graph = CommitGraph('commit-graph', file=BytesIO(contents),
+                        contents=contents, size=len(contents))
+    data = bytearray(contents[:-20])
+    for i in range(len(graph)):
+        offset = graph._data_start + i * 36 + 28
+        (generation, ) = struct.unpack_from('>L', data, offset)
+        # Keep the two high bits of the commit time.
+        struct.pack_into('>L', data, offset, generation & 0x3)
+    return bytes(data) + sha1(data).digest()
+
+
 def setup_warning_catcher():
     """Wrap warnings.showwarning with code that records warnings."""
 
@@ -89,67 +89,134 @@ class _CommitTimeQueue(object):
     def __init__(self, walker):
         self._walker = walker
         self._store = walker.store
-        self._get_parents = walker.get_parents
+        self._get_parents = walker._get_parents_by_sha
+        self._get_commit_time = walker._get_commit_time
+        self._get_generation = walker._get_generation
         self._excluded = walker.excluded
         self._pq = []
         self._pq_set = set()
         self._seen = set()
         self._done = set()
         self._min_time = walker.since
-        self._last = None
+        self._last_time = None
         self._extra_commits_left = _MAX_EXTRA_COMMITS
+        # Generation numbers are only needed to decide whether a commit can
+        # still be excluded. Until one turns out to be unknown, they are used
+        # instead of guessing based on commit times.
+        self._use_generations = bool(self._excluded)
+        self._held = collections.deque()
+        # Queued excluded commits, by largest generation number first;
+        # entries for commits that have left the queue are skipped lazily.
+        self._excluded_pq = []
         self._is_finished = False
 
         for commit_id in chain(walker.include, walker.excluded):
             self._push(commit_id)
 
     def _push(self, commit_id):
-        try:
-            commit = self._store[commit_id]
-        except KeyError:
-            raise MissingCommitError(commit_id)
         if commit_id not in self._pq_set and commit_id not in self._done:
-            heapq.heappush(self._pq, (-commit.commit_time, commit))
+            # Only the commit time is needed to queue a commit, which the
+            # object store can often provide without parsing the commit.
+            try:
+                commit_time = self._get_commit_time(commit_id)
+            except KeyError:
+                raise MissingCommitError(commit_id)
+            heapq.heappush(self._pq, (-commit_time, commit_id))
             self._pq_set.add(commit_id)
             self._seen.add(commit_id)
+            if commit_id in self._excluded:
+                self._push_excluded(commit_id)
+
+    def _push_excluded(self, sha):
+        if self._use_generations:
+            generation = self._generation(sha)
+            if generation is not None:
+                heapq.heappush(self._excluded_pq, (-generation, sha))
 
-    def _exclude_parents(self, commit):
+    def _exclude_parents(self, sha):
         excluded = self._excluded
         seen = self._seen
-        todo = [commit]
+        todo = [sha]
         while todo:
-            commit = todo.pop()
-            for parent in self._get_parents(commit):
-                if parent not in excluded and parent in seen:
-                    # TODO: This is inefficient unless the object store does
-                    # some caching (which DiskObjectStore currently does not).
-                    # We could either add caching in this class or pass around
-                    # parsed queue entry objects instead of commits.
-                    todo.append(self._store[parent])
+            sha = todo.pop()
+            for parent in self._get_parents(sha):
+                if parent in excluded:
+                    continue
                 excluded.add(parent)
+                if parent in seen:
+                    todo.append(parent)
+                if parent in self._pq_set:
+                    self._push_excluded(parent)
+
+    def _generation(self, sha):
+        generation = self._get_generation(sha)
+        if generation is None:
+            # Fall back to guessing based on commit times.
+            self._use_generations = False
+        return generation
+
+    def _can_return(self, sha):
+        """Check whether a commit can no longer be excluded.
+
+        A commit can only be reached from commits with a larger generation
+        number, so once no queued excluded commit has a larger generation
+        number, the commit will not be excluded later on.
+        """
+        if not self._use_generations:
+            return True
+        generation = self._generation(sha)
+        if generation is None:
+            return True
+        excluded_pq = self._excluded_pq
+        while excluded_pq and excluded_pq[0][1] not in self._pq_set:
+            heapq.heappop(excluded_pq)
+        return not excluded_pq or -excluded_pq[0][0] <= generation
+
+    def _next_held(self, finished=False):
+        """Return the next held back commit, if it can be returned."""
+        while self._held:
+            sha = self._held[0]
+            if sha in self._excluded:
+                self._held.popleft()
+                continue
+            if not finished and not self._can_return(sha):
+                return None
+            self._held.popleft()
+            return WalkEntry(self._walker, self._store[sha])
+        return None
 
     def next(self):
         if self._is_finished:
-            return None
-        while self._pq:
-            _, commit = heapq.heappop(self._pq)
-            sha = commit.id
+            return self._next_held(finished=True)
+        while True:
+            entry = self._next_held()
+            if entry is not None:
+                return entry
+            if not self._pq:
+                break
+            neg_time, sha = heapq.heappop(self._pq)
+            commit_time = -neg_time
             self._pq_set.remove(sha)
             if sha in self._done:
                 continue
             self._done.add(sha)
 
-            for parent_id in self._get_parents(commit):
+            for parent_id in self._get_parents(sha):
                 self._push(parent_id)
 
             reset_extra_commits = True
             is_excluded = sha in self._excluded
             if is_excluded:
-                self._exclude_parents(commit)
-                if self._pq and all(c.id in self._excluded
+                self._exclude_parents(sha)
+                if self._pq and all(c in self._excluded
                                     for _, c in self._pq):
-                    _, n = self._pq[0]
-                    if self._last and n.commit_time >= self._last.commit_time:
+                    if self._use_generations:
+                        # Only excluded commits are left, so the walk is
+                        # done once no commit is held back anymore.
+                        if not self._held:
+                            break
+                    elif (self._last_time is not None and
+                            -self._pq[0][0] >= self._last_time):
                         # If the next commit is newer than the last one, we need
                         # to keep walking in case its parents (which we may not
                         # have seen yet) are excluded. This gives the excluded
@@ -160,7 +227,7 @@ class _CommitTimeQueue(object):
                         reset_extra_commits = False
 
             if (self._min_time is not None and
-                commit.commit_time < self._min_time):
+                commit_time < self._min_time):
                 # We want to stop walking at min_time, but commits at the
                 # boundary may be out of order with respect to their parents. So
                 # we walk _MAX_EXTRA_COMMITS more commits once we hit this
@@ -176,10 +243,12 @@ class _CommitTimeQueue(object):
                     break
 
             if not is_excluded:
-                self._last = commit
-                return WalkEntry(self._walker, commit)
+                self._last_time = commit_time
+                # Hold the commit back until it is known whether any of the
+                # excluded commits can reach it.
+                self._held.append(sha)
         self._is_finished = True
-        return None
+        return self._next_held(finished=True)
 
     __next__ = next
 
@@ -194,8 +263,7 @@ class Walker(object):
     def __init__(self, store, include, exclude=None, order=ORDER_DATE,
                  reverse=False, max_entries=None, paths=None,
                  rename_detector=None, follow=False, since=None, until=None,
-                 get_parents=lambda commit: commit.parents,
-                 queue_cls=_CommitTimeQueue):
+                 get_parents=None, queue_cls=_CommitTimeQueue):
         """Constructor.
 
         :param store: ObjectStore instance for looking up objects.
@@ -216,7 +284,9 @@ class Walker(object):
             default rename_detector.
         :param since: Timestamp to list commits after.
         :param until: Timestamp to list commits before.
-        :param get_parents: Method to retrieve the parents of a commit
+        :param get_parents: Method to retrieve the parents of a commit. If not
+            given, the parents are looked up in the object store, which can
+            do so without parsing the commit.
         :param queue_cls: A class to use for a queue of commits, supporting the
             iterator protocol. The constructor takes a single argument, the
             Walker.
@@ -237,7 +307,16 @@ class Walker(object):
         if follow and not rename_detector:
             rename_detector = RenameDetector(store)
         self.rename_detector = rename_detector
-        self.get_parents = get_parents
+        if get_parents is None:
+            self.get_parents = lambda commit: commit.parents
+            self._get_parents_by_sha = lambda sha: store.get_parents(sha)
+            self._get_generation = lambda sha: store.get_generation(sha)
+        else:
+            self.get_parents = get_parents
+            self._get_parents_by_sha = lambda sha: get_parents(store[sha])
+            # Generation numbers don't take e.g. grafts into account.
+            self._get_generation = lambda sha: None
+        self._get_commit_time = lambda sha: store.get_commit_time(sha)
         self.follow = follow
         self.since = since
         self.until = until
@@ -16,6 +16,43 @@ import os
 import sys
 if sys.platform == 'win32':
     include_dirs.append('dulwich')
+    zlib_library = 'zlib'
+else:
+    zlib_library = 'z'
+
+
+def has_zlib(library):
+    """Check whether C extensions can be built against zlib."""
+    import shutil
+    import tempfile
+    from distutils.ccompiler import new_compiler
+    from distutils.errors import CCompilerError, DistutilsError
+    from distutils.sysconfig import customize_compiler
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmpdir, 'zlibtest.c')
+        with open(source, 'w') as f:
+            f.write('#include <zlib.h>\n'
+                    'int main(void) { return inflateEnd(0) == Z_OK; }\n')
+        objects = compiler.compile([source], output_dir=tmpdir)
+        compiler.link_executable(objects, os.path.join(tmpdir, 'zlibtest'),
+                                 libraries=[library])
+    except (CCompilerError, DistutilsError):
+        return False
+    finally:
+        shutil.rmtree(tmpdir)
+    return True
+
+
+# Without zlib, _pack is built without its zlib-based functions, and the
+# pure-Python versions of those are used instead.
+pack_extension = Extension('dulwich._pack', ['dulwich/_pack.c'],
+                           include_dirs=include_dirs)
+if has_zlib(zlib_library):
+    pack_extension.define_macros.append(('HAVE_ZLIB', None))
+    pack_extension.libraries.append(zlib_library)
 
 class DulwichDistribution(Distribution):
 
@@ -89,8 +126,7 @@ setup(name='dulwich',
       ext_modules=[
           Extension('dulwich._objects', ['dulwich/_objects.c'],
                     include_dirs=include_dirs),
-          Extension('dulwich._pack', ['dulwich/_pack.c'],
-              include_dirs=include_dirs),
+          pack_extension,
           Extension('dulwich._diff_tree', ['dulwich/_diff_tree.c'],
               include_dirs=include_dirs),
       ],